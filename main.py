@@ -47,7 +47,8 @@ if __name__ == "__main__":
     const.HOLD_PROFILE_SETUP.wait()
     if const.END_OR_NOT is True:
         exit(1)
-    const.THIS_OBJECT = RemotePeer(const.USERNAME, const.THIS_IP, const.PORT_THIS, report=const.PORT_REQ, status=1)
+    const.THIS_OBJECT = RemotePeer(const.USERNAME, const.THIS_IP, const.PORT_THIS, report=const.PORT_REQ, status=1,
+                                   host_id=const.HOST_ID)
 
     src.configurations.configure_app.print_constants()
     tracemalloc.start()
@@ -0,0 +1,611 @@
+"""
+Zip archives compressed on every core.
+Files are cut into chunks, each chunk is deflated on a worker process (primed with the 32KB before it,
+so ratio stays close to deflating whole file at once) and chunks of a file are joined back into one
+deflate stream (every chunk but last ends with a sync flush, which keeps the stream byte aligned).
+Archive is written front to back with data descriptors, so it can go into any writable (file or socket),
+zip64 records are used where sizes or offsets need them. Stored files are written as deflate's stored blocks,
+which keeps every member self delimiting, so `ZipStreamExtractor` can extract an archive while it is arriving.
+
+Worker processes are kept warm in `compress_pool` and reused by every archive being made.
+`CompressionPolicy` decides per file whether it is stored or deflated (and at what level).
+This module only imports the standard library as workers import it too
+"""
+import os
+import queue
+import stat
+import struct
+import threading
+import time
+import zlib
+from collections import deque, Counter
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import BinaryIO, Optional
+
+CHUNK_SIZE = 4 * 1024 * 1024  # a file bigger than this is deflated on many workers
+TASK_SIZE = 4 * 1024 * 1024  # small files are put together into a task of about this many bytes
+DICT_SIZE = 32 * 1024  # deflate window, each chunk is primed with these many bytes before it
+STORED = None  # level of a member that is not compressed (kept in deflate's stored blocks)
+DEFAULT_LEVEL = 6
+ZIP64_LIMIT = (1 << 31) - 1
+
+LEVELS = (1, 6)  # levels tried by `CompressionPolicy`
+CORE_SPEED = {1: 80 * 1024 ** 2, 6: 25 * 1024 ** 2}  # bytes/sec deflated by one core, till probes measure it
+DEFAULT_LINK_RATE = 12.5 * 1024 ** 2  # bytes/sec (100Mbit) assumed when nothing is measured with a peer
+PROBE_SIZE = 16 * 1024
+PROBE_MIN = 256 * 1024  # smaller files are not probed, they go by what probes said so far
+MIN_SAVING = 0.1  # compressing has to cut estimated time by this share to be chosen
+SMOOTHING = 0.3
+INCOMPRESSIBLE = frozenset({
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.txz', '.7z', '.rar', '.zst', '.lz4', '.br', '.cab',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.avif', '.jxl',
+    '.mp3', '.aac', '.ogg', '.opus', '.flac', '.m4a', '.wma',
+    '.mp4', '.mkv', '.avi', '.mov', '.webm', '.m4v', '.wmv', '.flv',
+    '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.odp', '.epub', '.jar', '.apk', '.whl', '.woff', '.woff2',
+})
+
+QUEUE_CHUNKS = 64  # chunks an extractor holds before whoever feeds it has to wait
+EXTRACT_CHUNK = 1024 * 1024
+
+_LOCAL = struct.Struct('<IHHHHHIIIHH')
+_CENTRAL = struct.Struct('<IHHHHHHIIIHHHHHII')
+_END = struct.Struct('<IHHHHIIH')
+_END64 = struct.Struct('<IQHHIIQQQQ')
+_LOCATOR64 = struct.Struct('<IIQI')
+_DESCRIPTOR = struct.Struct('<IIII')
+_DESCRIPTOR64 = struct.Struct('<IIQQ')
+_UTF8 = 0x0800
+_HAS_DESCRIPTOR = 0x0008
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def compress_pool() -> ProcessPoolExecutor:
+    """process pool kept warm across archives, made on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+        return _pool
+
+
+def shutdown_compress_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _deflate_pieces(pieces) -> list[tuple[int, int, bytes]]:
+    """worker side, :returns (crc32, length, raw deflate) of each (path, offset, length, level, last):"""
+    results = []
+    for path, offset, length, level, last in pieces:
+        with open(path, 'rb') as file:
+            start = max(0, offset - DICT_SIZE)
+            file.seek(start)
+            history = file.read(offset - start)
+            data = file.read(length)
+        if history:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=history)
+        else:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        deflated = compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+        results.append((zlib.crc32(data), len(data), deflated))
+    return results
+
+
+def _gf2_times(matrix, vector):
+    total, index = 0, 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[index]
+        vector >>= 1
+        index += 1
+    return total
+
+
+def _gf2_square(matrix):
+    return [_gf2_times(matrix, row) for row in matrix]
+
+
+def _zeros_operator(length) -> list[int]:
+    """matrix that carries a crc past :param length: zero bytes, what `crc32_combine` applies to crc1"""
+    operator = [1 << n for n in range(32)]
+    odd = [0xEDB88320] + [1 << n for n in range(31)]
+    even = _gf2_square(odd)
+    odd = _gf2_square(even)
+    while length:
+        even = _gf2_square(odd)
+        if length & 1:
+            operator = [_gf2_times(even, column) for column in operator]
+        length >>= 1
+        if not length:
+            break
+        odd = _gf2_square(even)
+        if length & 1:
+            operator = [_gf2_times(odd, column) for column in operator]
+        length >>= 1
+    return operator
+
+
+def crc32_combine(crc1, crc2, length2, operator=None) -> int:
+    """
+    crc32 of a+b from crc32 of a, crc32 of b and len(b) (zlib's crc32_combine, which python does not expose)
+    :param operator: `_zeros_operator` of length2 if it's already made, (every chunk but a file's last one
+                     is CHUNK_SIZE long, see `_CHUNK_OPERATOR`)
+    """
+    if length2 <= 0:
+        return crc1
+    if operator is not None:
+        return _gf2_times(operator, crc1) ^ crc2
+    odd = [0xEDB88320] + [1 << n for n in range(31)]
+    even = _gf2_square(odd)
+    odd = _gf2_square(even)
+    while True:
+        even = _gf2_square(odd)
+        if length2 & 1:
+            crc1 = _gf2_times(even, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+        odd = _gf2_square(even)
+        if length2 & 1:
+            crc1 = _gf2_times(odd, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+    return crc1 ^ crc2
+
+
+_CHUNK_OPERATOR = _zeros_operator(CHUNK_SIZE)
+
+
+class CompressionPolicy:
+    """
+    Chooses per file whether to store or deflate it (and at which of `LEVELS`), so that compressing is done
+    only where it shortens the whole transfer.
+    Archive is sent while it is being made, so time per input byte is taken as the slower of
+    1/(core speed * workers) and ratio/link rate for a level, against 1/link rate for storing.
+
+    Files with known compressed extensions are stored, others bigger than `PROBE_MIN` get a probe:
+    samples from start, middle and end are deflated at every level, which gives the ratio for that file
+    and (timed) the core speed, smaller files use ratios averaged over probes done so far.
+    On a gigabit link mostly nothing but text is worth compressing, on a vpn most things are
+
+    :param link_rate: bytes per second to the receiver (`peer_stats.link_rate`), a guess if None
+    :param workers: number of processes compressing
+    """
+    __slots__ = 'link_rate', 'workers', '__speed', '__ratio', 'decisions'
+
+    def __init__(self, link_rate=None, workers=None):
+        self.link_rate = link_rate or DEFAULT_LINK_RATE
+        self.workers = workers or os.cpu_count() or 1
+        self.__speed = dict(CORE_SPEED)
+        self.__ratio = {level: 0.5 for level in LEVELS}  # average over probes, for files that are not probed
+        self.decisions = Counter()
+
+    def level_for(self, path, size) -> Optional[int]:
+        """:returns deflate level for the file, `STORED` if it should not be compressed:"""
+        if size == 0 or os.path.splitext(path)[1].lower() in INCOMPRESSIBLE:
+            level = STORED
+        else:
+            ratios = self.__probe(path, size) if size >= PROBE_MIN else None
+            level = self.__choose(ratios or self.__ratio)
+        self.decisions[level] += 1
+        return level
+
+    def __probe(self, path, size):
+        try:
+            with open(path, 'rb') as file:
+                sample = b''
+                for offset in (0, size // 2, size - PROBE_SIZE):
+                    file.seek(max(0, offset))
+                    sample += file.read(PROBE_SIZE)
+        except OSError:
+            return None
+        if not sample:
+            return None
+        ratios = {}
+        for level in LEVELS:
+            start = time.perf_counter()
+            compressed = len(zlib.compress(sample, level))
+            took = time.perf_counter() - start
+            ratios[level] = min(1.0, compressed / len(sample))
+            if took > 0:
+                self.__speed[level] += SMOOTHING * (len(sample) / took - self.__speed[level])
+            self.__ratio[level] += SMOOTHING * (ratios[level] - self.__ratio[level])
+        return ratios
+
+    def __choose(self, ratios):
+        stored = 1 / self.link_rate
+        best, best_time = STORED, stored * (1 - MIN_SAVING)
+        for level in LEVELS:
+            estimate = max(1 / (self.__speed[level] * self.workers), ratios[level] / self.link_rate)
+            if estimate < best_time:
+                best, best_time = level, estimate
+        return best
+
+    def __repr__(self):
+        return (f"CompressionPolicy(link={self.link_rate / 1024 ** 2:.1f}MB/s, workers={self.workers},"
+                f" decisions={dict(self.decisions)})")
+
+
+def _dos_time(mtime):
+    t = time.localtime(max(mtime, 315532800))  # zip can't hold dates before 1980
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+class _Member:
+    __slots__ = 'arcname', 'path', 'size', 'mtime', 'mode', 'level', 'crc', 'compressed', 'written', 'offset'
+
+    def __init__(self, arcname, path, size, mtime, mode, level):
+        self.arcname, self.path, self.size, self.mtime, self.mode, self.level = arcname, path, size, mtime, mode, level
+        self.crc, self.compressed, self.written, self.offset = 0, 0, 0, 0
+
+    @property
+    def is_dir(self):
+        return self.arcname.endswith('/')
+
+    @property
+    def method(self):
+        return 0 if self.is_dir else 8
+
+    @property
+    def flags(self):
+        return _UTF8 if self.is_dir else _UTF8 | _HAS_DESCRIPTOR
+
+    @property
+    def zip64(self):
+        return self.size * 1.05 + 1024 > ZIP64_LIMIT  # decided before compressing, so some headroom
+
+    def __repr__(self):
+        return f"_Member({self.arcname}, size={self.size}, level={self.level})"
+
+
+class ParallelZipWriter:
+    """
+    Writes a zip archive into :param fileobj: (needs only `write`), members are compressed on :param executor:
+
+        with ParallelZipWriter(file, compress_pool()) as archive:
+            archive.add_file(path, 'dir/name.txt')
+            archive.add_directory('dir/empty/')
+    """
+    __slots__ = 'fileobj', 'executor', 'offset', 'members', '__queue', '__in_flight', '__window', 'progress'
+
+    def __init__(self, fileobj: BinaryIO, executor=None, *, window=None, progress=None):
+        """
+        :param window: tasks kept submitted at once, bounds memory held by compressed chunks
+        :param progress: called with number of input bytes each time some of them are written
+        """
+        self.fileobj = fileobj
+        self.executor = executor or compress_pool()
+        self.offset = 0
+        self.members: list[_Member] = []
+        self.__queue: list[tuple] = []  # pieces not yet submitted
+        self.__in_flight: deque[tuple[Optional[Future], list]] = deque()
+        self.__window = window or 2 * (getattr(self.executor, '_max_workers', None) or os.cpu_count() or 1)
+        self.progress = progress
+
+    def add_file(self, path, arcname, level=DEFAULT_LEVEL):
+        """:param level: deflate level, `STORED` to keep it as it is"""
+        stat_result = os.stat(path)
+        member = _Member(arcname, path, stat_result.st_size, stat_result.st_mtime, stat_result.st_mode, level)
+        self.members.append(member)
+        if level is STORED:
+            self.__flush_queue()
+            self.__in_flight.append((None, [(member, 0, member.size, True)]))
+            self.__drain(self.__window)
+            return
+        offsets = range(0, member.size, CHUNK_SIZE) or [0]
+        for offset in offsets:
+            last = offset + CHUNK_SIZE >= member.size
+            self.__queue.append((member, offset, min(CHUNK_SIZE, member.size - offset), last))
+            if sum(piece[2] for piece in self.__queue) >= TASK_SIZE:
+                self.__flush_queue()
+
+    def add_directory(self, arcname, mtime=None):
+        arcname = arcname if arcname.endswith('/') else arcname + '/'
+        member = _Member(arcname, None, 0, mtime or time.time(), stat.S_IFDIR | 0o755, STORED)
+        self.members.append(member)
+        self.__flush_queue()
+        self.__in_flight.append((None, [(member, 0, 0, True)]))
+        self.__drain(self.__window)
+
+    def __flush_queue(self):
+        if not self.__queue:
+            return
+        pieces, self.__queue = self.__queue, []
+        task = [(member.path, offset, length, member.level, last) for member, offset, length, last in pieces]
+        self.__in_flight.append((self.executor.submit(_deflate_pieces, task), pieces))
+        self.__drain(self.__window)
+
+    def __drain(self, keep):
+        while len(self.__in_flight) > keep:
+            future, pieces = self.__in_flight.popleft()
+            results = future.result() if future else [None] * len(pieces)
+            for (member, offset, length, last), result in zip(pieces, results):
+                if offset == 0:
+                    self.__local_header(member)
+                if result is None:
+                    self.__copy_stored(member)
+                else:
+                    crc, read, deflated = result
+                    operator = _CHUNK_OPERATOR if read == CHUNK_SIZE else None
+                    member.crc = crc32_combine(member.crc, crc, read, operator) if offset else crc
+                    member.written += read
+                    member.compressed += len(deflated)
+                    self.__write(deflated)
+                    self.progress(read) if self.progress else None
+                if last:
+                    self.__descriptor(member)
+
+    def __copy_stored(self, member: _Member):
+        """level 0 deflate, only framing is added around the bytes so no worker is needed"""
+        if member.is_dir:
+            return
+        compressor = zlib.compressobj(0, zlib.DEFLATED, -15)
+        with open(member.path, 'rb') as file:
+            while chunk := file.read(CHUNK_SIZE):
+                member.crc = zlib.crc32(chunk, member.crc)
+                member.written += len(chunk)
+                self.__write_member(member, compressor.compress(chunk))
+                self.progress(len(chunk)) if self.progress else None
+        self.__write_member(member, compressor.flush())
+
+    def __write_member(self, member: _Member, data):
+        member.compressed += len(data)
+        self.__write(data)
+
+    def __write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def __local_header(self, member: _Member):
+        member.offset = self.offset
+        name = member.arcname.encode('utf-8')
+        extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0) if member.zip64 else b''
+        dos_time, dos_date = _dos_time(member.mtime)
+        self.__write(_LOCAL.pack(0x04034b50, 45 if member.zip64 else 20, member.flags, member.method,
+                                 dos_time, dos_date, 0, 0xFFFFFFFF if member.zip64 else 0,
+                                 0xFFFFFFFF if member.zip64 else 0, len(name), len(extra)) + name + extra)
+
+    def __descriptor(self, member: _Member):
+        if member.is_dir:
+            return
+        if member.zip64:
+            self.__write(_DESCRIPTOR64.pack(0x08074b50, member.crc, member.compressed, member.written))
+        else:
+            self.__write(_DESCRIPTOR.pack(0x08074b50, member.crc, member.compressed, member.written))
+
+    def close(self):
+        self.__flush_queue()
+        self.__drain(0)
+        start, count = self.offset, len(self.members)
+        for member in self.members:
+            self.__central_header(member)
+        size = self.offset - start
+        if count > 0xFFFF or start > 0xFFFFFFFF or size > 0xFFFFFFFF:
+            end64 = self.offset
+            self.__write(_END64.pack(0x06064b50, _END64.size - 12, 45, 45, 0, 0, count, count, size, start))
+            self.__write(_LOCATOR64.pack(0x07064b50, 0, end64, 1))
+        self.__write(_END.pack(0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                               min(size, 0xFFFFFFFF), min(start, 0xFFFFFFFF), 0))
+
+    def __central_header(self, member: _Member):
+        name = member.arcname.encode('utf-8')
+        sizes = [member.written, member.compressed, member.offset]
+        big = [x > 0xFFFFFFFF or (i < 2 and member.zip64) for i, x in enumerate(sizes)]
+        extra_values = [x for x, is_big in zip(sizes, big) if is_big]
+        extra = struct.pack(f'<HH{len(extra_values)}Q', 0x0001, 8 * len(extra_values), *extra_values) \
+            if extra_values else b''
+        version = 45 if extra_values else 20
+        dos_time, dos_date = _dos_time(member.mtime)
+        written, compressed, offset = (0xFFFFFFFF if is_big else x for x, is_big in zip(sizes, big))
+        self.__write(_CENTRAL.pack(0x02014b50, (3 << 8) | version, version, member.flags, member.method,
+                                   dos_time, dos_date, member.crc, compressed, written, len(name), len(extra), 0,
+                                   0, 0, (member.mode & 0xFFFF) << 16 | (0x10 if member.is_dir else 0),
+                                   offset) + name + extra)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+    def __repr__(self):
+        return f"ParallelZipWriter(members={len(self.members)}, offset={self.offset})"
+
+
+class _QueueReader:
+    """reads exact sizes out of chunks coming through a queue, b'' (or None) in queue marks the end"""
+    __slots__ = 'queue', 'buffer', 'ended'
+
+    def __init__(self, chunks: queue.Queue):
+        self.queue = chunks
+        self.buffer = bytearray()
+        self.ended = False
+
+    def __pull(self) -> bool:
+        if self.ended:
+            return False
+        chunk = self.queue.get()
+        if not chunk:
+            self.ended = True
+            return False
+        self.buffer += chunk
+        return True
+
+    def read(self, size) -> bytes:
+        while len(self.buffer) < size:
+            if not self.__pull():
+                raise EOFError("archive ended abruptly")
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def read_some(self) -> bytes:
+        """whatever is buffered, or the next chunk"""
+        if not self.buffer and not self.__pull():
+            raise EOFError("archive ended abruptly")
+        data, self.buffer = bytes(self.buffer), bytearray()
+        return data
+
+    def unread(self, data):
+        self.buffer[:0] = data
+
+    def drain(self):
+        self.buffer.clear()
+        while self.__pull():
+            self.buffer.clear()
+
+
+class ZipStreamExtractor:
+    """
+    Extracts a zip archive while it's bytes are still arriving, so first files are out long before the archive
+    is over and the archive itself is never kept on disk.
+    Entries are read through their local headers, which needs every member to be self delimiting (deflated,
+    or sizes in local header), as `ParallelZipWriter` writes them.
+    Extraction runs on a thread of it's own fed through a bounded queue (`feed`), the feeding (socket) thread
+    only blocks once extraction is `QUEUE_CHUNKS` behind, which slows the sender down through tcp
+
+    :param destination: directory entries go into
+    :param strip_components: leading path components removed from every entry name (like tar)
+    """
+    __slots__ = 'destination', 'strip_components', 'extracted', 'error', '__queue', '__thread', '__safe_path'
+
+    def __init__(self, destination, *, strip_components=0, queue_size=QUEUE_CHUNKS, safe_path=None):
+        """:param safe_path: turns an entry name into a relative path, None for names to be refused"""
+        self.destination = destination
+        self.strip_components = strip_components
+        self.extracted: list[str] = []
+        self.error: Optional[BaseException] = None
+        self.__queue = queue.Queue(queue_size)
+        self.__safe_path = safe_path or (lambda name: name)
+        self.__thread = threading.Thread(target=self.__run, name='peer-connect-unzipping', daemon=True)
+
+    def start(self):
+        self.__thread.start()
+        return self
+
+    def feed(self, chunk: bytes):
+        """blocks while queue is full, b'' ends the archive"""
+        self.__queue.put(chunk)
+
+    def finish(self, timeout=None) -> bool:
+        """:returns True if every entry got extracted and verified:"""
+        self.__queue.put(b'')
+        self.__thread.join(timeout)
+        return self.error is None and not self.__thread.is_alive()
+
+    def __run(self):
+        reader = _QueueReader(self.__queue)
+        try:
+            while True:
+                signature = struct.unpack('<I', reader.read(4))[0]
+                if signature != 0x04034b50:
+                    break  # central directory (or anything else) means entries are over
+                self.__entry(reader)
+        except Exception as e:
+            self.error = e
+        finally:
+            reader.drain()  # feeder never stays blocked on a full queue
+
+    def __entry(self, reader: _QueueReader):
+        (_, _, flags, method, _, _, crc, compressed, size,
+         name_length, extra_length) = _LOCAL.unpack(b'\0' * 4 + reader.read(_LOCAL.size - 4))
+        name = reader.read(name_length).decode('utf-8' if flags & _UTF8 else 'cp437')
+        zip64 = _has_zip64(reader.read(extra_length))
+        path = self.__path_for(name)
+        if name.endswith('/'):
+            if path:
+                os.makedirs(path, exist_ok=True)
+            if flags & _HAS_DESCRIPTOR:
+                raise ValueError(f"directory entry {name} with a data descriptor")
+            return
+        if method == 8:
+            crc_got = self.__inflate(reader, path)
+        elif method == 0 and not flags & _HAS_DESCRIPTOR:
+            crc_got = self.__copy(reader, path, compressed)
+        else:
+            raise ValueError(f"entry {name} can't be extracted while streaming (method {method}, flags {flags})")
+        if flags & _HAS_DESCRIPTOR:
+            crc = self.__descriptor(reader, zip64)
+        if crc_got != crc:
+            if path:
+                os.remove(path)
+            raise ValueError(f"crc mismatch for {name}")
+        if path:
+            self.extracted.append(path)
+
+    def __path_for(self, name) -> Optional[str]:
+        """None for an entry that is skipped (refused name or stripped away completely), data is still read"""
+        parts = name.split('/')
+        relative = '/'.join(parts[self.strip_components:])
+        if not relative.strip('/') or (relative := self.__safe_path(relative)) is None:
+            return None
+        path = os.path.join(self.destination, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    @staticmethod
+    def __inflate(reader: _QueueReader, path):
+        decompressor, crc = zlib.decompressobj(-15), 0
+        with open(path, 'wb') if path else _NullFile() as file:
+            while not decompressor.eof:
+                data = decompressor.decompress(reader.read_some(), EXTRACT_CHUNK)
+                while True:
+                    crc = zlib.crc32(data, crc)
+                    file.write(data)
+                    if decompressor.eof or not decompressor.unconsumed_tail:
+                        break  # past the end, rest of input is in unused_data (unconsumed_tail is stale)
+                    data = decompressor.decompress(decompressor.unconsumed_tail, EXTRACT_CHUNK)
+        reader.unread(decompressor.unused_data)
+        return crc
+
+    @staticmethod
+    def __copy(reader: _QueueReader, path, size):
+        crc = 0
+        with open(path, 'wb') if path else _NullFile() as file:
+            while size > 0:
+                data = reader.read(min(EXTRACT_CHUNK, size))
+                crc = zlib.crc32(data, crc)
+                file.write(data)
+                size -= len(data)
+        return crc
+
+    @staticmethod
+    def __descriptor(reader: _QueueReader, zip64) -> int:
+        """:returns crc in it, signature of descriptor is optional:"""
+        first = reader.read(4)
+        if struct.unpack('<I', first)[0] != 0x08074b50:
+            reader.unread(first)
+        crc = struct.unpack('<I', reader.read(4))[0]
+        reader.read(16 if zip64 else 8)
+        return crc
+
+    def __repr__(self):
+        return f"ZipStreamExtractor({self.destination}, extracted={len(self.extracted)}, error={self.error})"
+
+
+def _has_zip64(extra: bytes) -> bool:
+    offset = 0
+    while offset + 4 <= len(extra):
+        tag, length = struct.unpack_from('<HH', extra, offset)
+        if tag == 0x0001:
+            return True
+        offset += 4 + length
+    return False
+
+
+class _NullFile:
+    def write(self, data):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
@@ -0,0 +1,215 @@
+"""
+Codecs `DataWeaver` messages go over peer sockets in.
+Every socket starts with `JsonCodec`, both ends offer the codecs they know right after connecting
+(`CMD_CODEC_OFFER` as json, peers that do not know it ignore it) and each end switches to the first codec
+of it's own preference the other end offered, for what it sends on that socket.
+
+A received message is decoded by it's first byte, json always starts with '{', a binary frame with it's version,
+so receiving needs no negotiated state, and messages sent before the offer arrived are still read.
+The page is always talked to in json (`DataWeaver.dump`).
+
+binary frame (big endian) :
+    version(B) + header length(H) + id length(H) + content kind(B) + header + id + content
+
+    content kinds : NONE nothing, TEXT utf-8 string, JSON anything else as json
+    (nested values stay json, C json is faster at those than packing them with struct from python)
+    a message with a header or id that is not a string is sent as json as a whole
+
+opcode frame, binary frame with header sent as it's index in `OPCODES` :
+    version(B) + opcode(B) + id length(H) + content kind(B) + id + content
+    a header missing from the table goes as a binary frame, decoded header is the table's own string object,
+    so dispatching on it is a lookup with cached hash and identity comparison
+
+a batch, `CMD_BATCH` message with a list of messages (as dicts) for content, is sent only on sockets
+whose other end offered batches along with it's codecs, same goes for compressed texts (see `SimplePeerText`)
+and sequenced messages (see `PeerOutbox`)
+
+requests (on request sockets, plain `SimplePeerText`) to peers known to read opcodes
+are sent as `SHORT_HEADER` + opcode, peers not known to (and server) get the whole header
+"""
+import weakref
+
+from src.core import *
+
+
+class JsonCodec:
+    name = 'json'
+
+    @staticmethod
+    def encode(data: dict) -> bytes:
+        return json.dumps(data).encode(const.FORMAT)
+
+    @staticmethod
+    def decode(raw: bytes) -> dict:
+        return json.loads(raw)
+
+
+class BinaryCodec:
+    name = 'binary'
+    VERSION = 1
+    NONE, TEXT, JSON = 0, 1, 2
+    _HEAD = struct.Struct('!BHHB')
+
+    @classmethod
+    def pack_content(cls, content) -> tuple[int, bytes]:
+        if content is None:
+            return cls.NONE, b''
+        if isinstance(content, str):
+            return cls.TEXT, content.encode(const.FORMAT)
+        return cls.JSON, json.dumps(content).encode(const.FORMAT)
+
+    @classmethod
+    def unpack_content(cls, kind, raw: bytes):
+        if kind == cls.TEXT:
+            return raw.decode(const.FORMAT)
+        if kind == cls.JSON:
+            return json.loads(raw)
+        return None
+
+    @classmethod
+    def encode(cls, data: dict) -> bytes:
+        header, _id, content = data['header'], data['id'], data['content']
+        if not (isinstance(header, str) and isinstance(_id, str)):
+            return JsonCodec.encode(data)
+        header, _id = header.encode(const.FORMAT), _id.encode(const.FORMAT)
+        kind, content = cls.pack_content(content)
+        return b''.join((cls._HEAD.pack(cls.VERSION, len(header), len(_id), kind), header, _id, content))
+
+    @classmethod
+    def decode(cls, raw: bytes) -> dict:
+        _, header_length, id_length, kind = cls._HEAD.unpack_from(raw)
+        start = cls._HEAD.size
+        id_start = start + header_length
+        content_start = id_start + id_length
+        return {
+            'header': raw[start:id_start].decode(const.FORMAT),
+            'content': cls.unpack_content(kind, raw[content_start:]),
+            'id': raw[id_start:content_start].decode(const.FORMAT),
+        }
+
+
+OPCODES = (  # append only, a header's index is it's opcode on both ends
+    const.CMD_TEXT,
+    const.CMD_RECV_FILE,
+    const.CMD_RECV_FILE_AGAIN,
+    const.CMD_CLOSING_HEADER,
+    const.CMD_RECV_DIR,
+    const.CMD_RECV_LOCAL_FILE,
+    const.CMD_RECV_MULTICAST,
+    const.CMD_SWARM_QUERY,
+    const.CMD_SWARM_HAVE,
+    const.CMD_SWARM_SERVE,
+    const.CMD_CODEC_OFFER,
+    const.REQ_FOR_LIST,
+    const.I_AM_ACTIVE,
+    const.SERVER_PING,
+    const.ACTIVE_PING,
+    const.LIST_SYNC,
+    const.CMD_BATCH,
+    const.CMD_SEQUENCED,
+)
+_OPCODE_OF = {header: opcode for opcode, header in enumerate(OPCODES)}
+SHORT_HEADER = b'\0'
+
+
+class OpcodeCodec:
+    name = 'opcode'
+    VERSION = 2
+    _HEAD = struct.Struct('!BBHB')
+
+    @classmethod
+    def encode(cls, data: dict) -> bytes:
+        header, _id, content = data['header'], data['id'], data['content']
+        opcode = _OPCODE_OF.get(header) if isinstance(header, str) else None
+        if opcode is None or not isinstance(_id, str):
+            return BinaryCodec.encode(data)
+        _id = _id.encode(const.FORMAT)
+        kind, content = BinaryCodec.pack_content(content)
+        return b''.join((cls._HEAD.pack(cls.VERSION, opcode, len(_id), kind), _id, content))
+
+    @classmethod
+    def decode(cls, raw: bytes) -> dict:
+        _, opcode, id_length, kind = cls._HEAD.unpack_from(raw)
+        content_start = cls._HEAD.size + id_length
+        return {
+            'header': OPCODES[opcode],
+            'content': BinaryCodec.unpack_content(kind, raw[content_start:]),
+            'id': raw[cls._HEAD.size:content_start].decode(const.FORMAT),
+        }
+
+
+CODECS = {codec.name: codec for codec in (OpcodeCodec, BinaryCodec, JsonCodec)}  # in order of preference
+_negotiated = weakref.WeakKeyDictionary()  # socket: codec used for sending on it
+_reads_opcodes = set()  # ids of peers that offered opcodes
+_reads_batches = weakref.WeakSet()  # sockets whose other end offered batches
+_reads_compressed = weakref.WeakSet()  # sockets whose other end offered compressed texts
+_reads_sequenced = weakref.WeakSet()  # sockets whose other end offered sequenced messages (see `PeerOutbox`)
+COMPRESSIONS = ('zlib',)
+_lock = threading.Lock()
+
+
+def offer() -> dict:
+    """what this end reads, sent to the other end as content of `CMD_CODEC_OFFER`"""
+    return {'codecs': list(CODECS), 'batch': True, 'compress': list(COMPRESSIONS), 'sequenced': True}
+
+
+def accept(sock: socket.socket, offered: dict, peer_id=None):
+    """
+    picks codec used for sending on :param sock: out of what was :param offered: by the other end (see `offer`),
+    and remembers whether it reads batches, compressed texts and sequenced messages
+    """
+    codec = next((CODECS[name] for name in CODECS if name in offered['codecs']), JsonCodec)
+    with _lock:
+        _negotiated[sock] = codec
+        if offered.get('batch'):
+            _reads_batches.add(sock)
+        if offered.get('sequenced'):
+            _reads_sequenced.add(sock)
+        if any(name in COMPRESSIONS for name in offered.get('compress', ())):
+            _reads_compressed.add(sock)
+        if peer_id is not None and OpcodeCodec.name in offered['codecs']:
+            _reads_opcodes.add(peer_id)
+
+
+def request_header(header: bytes, peer_id) -> bytes:
+    """:returns: :param header: as sent to :param peer_id: on a request socket"""
+    with _lock:
+        short = peer_id in _reads_opcodes
+    return SHORT_HEADER + bytes((_OPCODE_OF[header],)) if short else header
+
+
+def resolve_request(raw: bytes) -> bytes:
+    """request header received in either form, as the table's own object if known"""
+    if len(raw) == 2 and raw[:1] == SHORT_HEADER and raw[1] < len(OPCODES):
+        return OPCODES[raw[1]]
+    return raw
+
+
+def reads_batches(sock: socket.socket) -> bool:
+    with _lock:
+        return sock in _reads_batches
+
+
+def reads_sequenced(sock: socket.socket) -> bool:
+    with _lock:
+        return sock in _reads_sequenced
+
+
+def reads_compressed(sock: socket.socket) -> bool:
+    with _lock:
+        return sock in _reads_compressed
+
+
+def codec_for(sock: socket.socket):
+    with _lock:
+        return _negotiated.get(sock, JsonCodec)
+
+
+def decode(raw: bytes) -> dict:
+    if raw[:1] == b'{' or not raw:
+        return JsonCodec.decode(raw)
+    if raw[0] == OpcodeCodec.VERSION:
+        return OpcodeCodec.decode(raw)
+    if raw[0] == BinaryCodec.VERSION:
+        return BinaryCodec.decode(raw)
+    raise ValueError(f"unknown message format {raw[:1]}")
@@ -1,8 +1,11 @@
+import os
 import random
 import socket as soc
+import tempfile
 
 import select
 import socket
+import struct
 from typing import Optional
 
 import src.avails.constants as const
@@ -69,6 +72,47 @@ BASIC_URI_CONNECT = 13
 REQ_URI_CONNECT = 12
 
 
+def is_same_host(peer_obj) -> bool:
+    """
+    Whether the peer runs on this machine, compared by host id peers carry with them,
+    peers that do not carry one (older versions, host id is None then) are taken to be elsewhere
+    """
+    host_id = getattr(peer_obj, 'host_id', None)
+    return host_id is not None and bool(const.HOST_ID) and host_id == const.HOST_ID
+
+
+def local_socket_path(peer_id) -> str:
+    """path of the unix domain socket a peer with the given id listens on, for peers of the same host"""
+    safe_id = ''.join(c if c.isalnum() or c in '.-' else '_' for c in str(peer_id))
+    return os.path.join(tempfile.gettempdir(), f"peerconnect-{safe_id}.sock")
+
+
+def create_local_server(path, backlog=5) -> Socket:
+    """
+    Unix domain server socket at given path, a stale path left by a crashed instance is removed
+    :raises OSError: if unix sockets are not supported here
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    sock = Socket(family=socket.AF_UNIX, type=socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(backlog)
+    return sock
+
+
+def _connect_local(path, timeout) -> Optional[Socket]:
+    sock = Socket(family=socket.AF_UNIX, type=socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        return sock
+    except OSError:
+        sock.close()
+        return None
+
+
 def connect_to_peer(_peer_obj=None, peer_id=None, to_which: int = BASIC_URI_CONNECT, timeout=None, *args):
     """
     Creates a basic socket connection to peer id passed in, or to the peer_obj passed in.
@@ -84,10 +128,41 @@ def connect_to_peer(_peer_obj=None, peer_id=None, to_which: int = BASIC_URI_CONN
     :return:
     """
     peer_obj = _peer_obj or const.LIST_OF_PEERS.get_peer(peer_id)
+    if to_which == BASIC_URI_CONNECT and not args and hasattr(socket, 'AF_UNIX') and is_same_host(peer_obj):
+        # peers on the same machine talk over unix domain sockets, skipping the loopback tcp stack
+        local_path = local_socket_path(peer_obj.id)
+        if os.path.exists(local_path) and (sock := _connect_local(local_path, timeout)):
+            return sock
     addr = peer_obj.req_uri if to_which == REQ_URI_CONNECT else peer_obj.uri
     return create_connection(addr,timeout, *args)
 
 
+IOV_MAX = 1024  # buffers per sendmsg call, linux's limit
+
+
+def send_buffers(sock, buffers) -> int:
+    """
+    Writes :param buffers: back to back as if they were one, header and payload of a frame
+    (or several frames corked together) go in one sendmsg (scatter-gather) instead of a send each,
+    sockets without sendmsg (windows) get them joined into one sendall
+    :returns: number of bytes written
+    """
+    if not hasattr(sock, 'sendmsg'):
+        data = b''.join(buffers)
+        sock.sendall(data)
+        return len(data)
+    views = [view for view in (memoryview(buffer).cast('B') for buffer in buffers) if len(view)]
+    total, index = sum(len(view) for view in views), 0
+    while index < len(views):
+        sent = sock.sendmsg(views[index:index + IOV_MAX])
+        while index < len(views) and sent >= len(views[index]):
+            sent -= len(views[index])
+            index += 1
+        if sent:
+            views[index] = views[index][sent:]
+    return total
+
+
 def read_sock(sock, actuator, data_len, timeout=10) -> Optional[bytes]:
     reads, _, _ = select.select([sock, actuator],[],[], timeout)
     if sock in reads:
@@ -96,20 +171,36 @@ def read_sock(sock, actuator, data_len, timeout=10) -> Optional[bytes]:
 
 
 def is_socket_connected(sock:Socket):
+    """
+    peeks at :param sock: without waiting, and without touching it's blocking mode
+    (other threads may be sending on it at the same time)
+    """
     try:
         sock.getpeername()
-        sock.setblocking(False)
-        data = sock.recv(1, socket.MSG_PEEK)
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return True
+        data = sock.recv(1, socket.MSG_PEEK | getattr(socket, 'MSG_DONTWAIT', 0))
         return False if data == b'' else True
     except BlockingIOError:
         return True
-    except (ConnectionResetError, ConnectionError, ConnectionAbortedError, OSError):
+    except (ConnectionResetError, ConnectionError, ConnectionAbortedError, OSError, ValueError):
         return False
-    finally:
-        try:
-            sock.setblocking(True)
-        except OSError:
-            return False
+
+
+def tcp_rtt(sock) -> Optional[float]:
+    """
+    Smoothed round trip time (in sec) kernel keeps for a connected tcp socket,
+    available only where `TCP_INFO` is (linux), returns None elsewhere
+    """
+    if not (const.LINUX and hasattr(socket, 'TCP_INFO')):
+        return None
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+        # struct tcp_info : 8 u8 fields, 15 u32 fields (tcpi_rto .. tcpi_rcv_ssthresh) then tcpi_rtt (usec)
+        return struct.unpack_from('I', info, 68)[0] / 1_000_000
+    except (OSError, struct.error):
+        return None
 
 
 def get_free_port() -> int:
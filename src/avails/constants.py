@@ -11,6 +11,7 @@ END_OR_NOT = False
 USERNAME = 'admin'
 SERVER_IP = ''
 THIS_IP = 'localhost'
+HOST_ID = ''  # same for every instance running on this machine
 
 WINDOWS = platform == "win32"
 DARWIN = platform == "darwin"
@@ -32,6 +33,8 @@ PORT_PAGE_SERVE = 40000
 PATH_CURRENT = '..\\..'
 PATH_LOG = '..\\..\\logs'
 PATH_PROFILES = '..\\..\\profiles'
+PATH_CACHE = '..\\..\\cache'
+PATH_HISTORY = '..\\..\\history'
 PATH_PAGE = '..\\webpage'
 PATH_DOWNLOAD = path.join(path.expanduser('~'), 'Downloads')
 PATH_CONFIG = f'..\\configurations\\{DEFAULT_CONFIG_FILE}'
@@ -83,6 +86,14 @@ CMD_RECV_FILE = 'this is a command to core_/!_recv a file'
 CMD_CLOSING_HEADER = 'this is a command to core_/!_close connection'
 CMD_TEXT = "this is a message"
 CMD_RECV_DIR = 'this is a command to core_/!_recv dir'
+CMD_RECV_LOCAL_FILE = 'this is a command to core_/!_copy a file on this host'
+CMD_RECV_MULTICAST = 'this is a command to core_/!_recv multicast files'
+CMD_SWARM_QUERY = 'this is a command to core_/!_who has this file'
+CMD_SWARM_HAVE = 'this is a command to core_/!_i have this file'
+CMD_SWARM_SERVE = 'this is a command to core_/!_serve pieces of file'
+CMD_CODEC_OFFER = 'this is a command to core_/!_use one of these codecs'
+CMD_BATCH = 'this is a batch of messages'
+CMD_SEQUENCED = 'this is a numbered batch of messages'
 
 
 CMD_VERIFY_HEADER = b'this is a verification header'
@@ -108,8 +119,16 @@ HANDLE_FILE_HEADER = 'this is a file'
 HANDLE_CONNECT_USER = 'connect user'
 HANDLE_RELOAD = 'this is command to core_/!_reload'
 HANDLE_DIR_HEADER = 'this is a dir'
+HANDLE_FAN_OUT_FILE_HEADER = 'this is a file for many'
+HANDLE_MULTICAST_FILE_HEADER = 'this is a file for everyone'
+HANDLE_SWARM_SHARE = 'share a file with swarm'
+HANDLE_SWARM_DOWNLOAD = 'download a file from swarm'
 HANDLE_POP_DIR_SELECTOR = 'pop dir selector'
 HANDLE_PUSH_FILE_SELECTOR = 'push file selector'
 HANDLE_OPEN_FILE = 'open file'
 HANDLE_SYNC_USERS = 'sync users'
 HANDLE_VERIFICATION = 'handle verification'
+HANDLE_OUTBOX_STATUS = 'outbox status'
+HANDLE_MESSAGE_REFUSED = 'message refused'
+HANDLE_LOAD_HISTORY = 'load history'
+HANDLE_SEARCH_HISTORY = 'search history'
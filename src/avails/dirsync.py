@@ -0,0 +1,307 @@
+"""
+Directory sync, sending only what changed since the last time a directory was received.
+Receiver keeps a manifest of it's copy (relative path, size, mtime, sha256 as the sender had them),
+sender walks it's tree in the same order as the manifest and compares both streams side by side,
+so neither side holds a whole manifest in memory, what comes out is a list of changes :
+
+    F   file (or empty directory) is sent
+    T   file is same as before (hash matched) only it's mtime changed, only manifest gets updated
+    D   file (or empty directory) is deleted at receiver
+
+Entries are ordered by path with '/' sorting before every other character (same as comparing
+path components one by one), which is the order `walk_sorted` yields them in.
+
+entry on wire and in manifest files (all big endian) :
+    name length(H) + name + size(Q) + mtime_ns(q) + sha256(32s)      name length 0 ends the entries
+change on wire :
+    op(B) + entry                                                      op 0 ends the changes
+    changes go as one blob prefixed with it's length(Q), as receiver's socket is handed to a file pool right after
+
+manifest file :
+    root length(H) + root path + entries
+"""
+import hashlib
+import io
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+from src.core import *
+from src.avails.fileobject import safe_relative_path
+from src.avails.scancache import ScanCache
+
+type SyncEntry = tuple[str, int, int, bytes]  # (name, size, mtime_ns, digest)
+
+SYNC_FOLDER = '.peerconnect-sync'  # under downloads, holds manifests of received directories
+NO_DIGEST = bytes(32)
+SEND, TOUCH, DELETE = b'F', b'T', b'D'
+
+_ENTRY = struct.Struct('!Qq32s')
+_LENGTH = struct.Struct('!H')
+_BLOB = struct.Struct('!Q')
+
+
+def sort_key(name: str):
+    return name.replace('/', '\0')
+
+
+def sync_id_for(root) -> str:
+    """same directory of same machine always gets same id, that is what receiver remembers it's copy by"""
+    return hashlib.sha256(f"{const.HOST_ID}:{os.path.abspath(root)}".encode(const.FORMAT)).hexdigest()[:32]
+
+
+def is_sync_id(sync_id) -> bool:
+    """id sent by a peer names a manifest file, only what `sync_id_for` makes is taken"""
+    return isinstance(sync_id, str) and len(sync_id) == 32 and all(x in '0123456789abcdef' for x in sync_id)
+
+
+def file_digest(path) -> bytes:
+    with open(path, 'rb') as file:
+        return hashlib.file_digest(file, 'sha256').digest()
+
+
+def walk_sorted(root, relative='', cache: ScanCache = None) -> Iterator[SyncEntry]:
+    """
+    Files under :param root: in manifest order with their size and mtime (digest left empty, computed only
+    when needed, unless :param cache: has it), an empty directory comes as it's name ending with '/'.
+    Symlinked directories are not followed
+    """
+    try:
+        with os.scandir(os.path.join(root, relative)) as listing:
+            entries = sorted(listing, key=lambda x: sort_key(x.name))
+    except OSError as e:
+        error_log(f"::listing failed at {func_str(walk_sorted)} exp: {e}")
+        return
+    if not entries and relative:
+        yield relative + '/', 0, 0, NO_DIGEST
+    for entry in entries:
+        name = f"{relative}/{entry.name}" if relative else entry.name
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk_sorted(root, name, cache)
+            elif entry.is_file():
+                stat_result = entry.stat()
+                size, mtime = stat_result.st_size, stat_result.st_mtime_ns
+                digest = cache.digest(name, size, mtime, entry.inode()) if cache is not None else None
+                yield name, size, mtime, digest or NO_DIGEST
+        except OSError as e:
+            error_log(f"::skipping {entry.path} at {func_str(walk_sorted)} exp: {e}")
+
+
+def write_entry(writer: BinaryIO, entry: SyncEntry):
+    name = entry[0].encode(const.FORMAT)
+    writer.write(_LENGTH.pack(len(name)) + name + _ENTRY.pack(*entry[1:]))
+
+
+def write_entries(writer: BinaryIO, entries: Iterable[SyncEntry]):
+    for entry in entries:
+        write_entry(writer, entry)
+    writer.write(_LENGTH.pack(0))
+
+
+def _read_exact(reader: BinaryIO, size) -> bytes:
+    data = reader.read(size)
+    if len(data) < size:
+        raise ConnectionError("entries ended abruptly")
+    return data
+
+
+def read_entry(reader: BinaryIO) -> Optional[SyncEntry]:
+    length = _LENGTH.unpack(_read_exact(reader, _LENGTH.size))[0]
+    if not length:
+        return None
+    name = _read_exact(reader, length).decode(const.FORMAT)
+    return name, *_ENTRY.unpack(_read_exact(reader, _ENTRY.size))
+
+
+def read_entries(reader: BinaryIO) -> Iterator[SyncEntry]:
+    while (entry := read_entry(reader)) is not None:
+        yield entry
+
+
+def write_changes(writer: BinaryIO, changes: Iterable[tuple[bytes, SyncEntry]]):
+    for op, entry in changes:
+        writer.write(op)
+        write_entry(writer, entry)
+    writer.write(b'\0')
+
+
+def read_changes(reader: BinaryIO) -> Iterator[tuple[bytes, SyncEntry]]:
+    while (op := _read_exact(reader, 1)) != b'\0':
+        yield op, read_entry(reader)
+
+
+def send_changes(sock: socket.socket, changes: Iterable[tuple[bytes, SyncEntry]]):
+    buffer = io.BytesIO()
+    write_changes(buffer, changes)
+    sock.sendall(_BLOB.pack(buffer.tell()))
+    sock.sendall(buffer.getbuffer())
+
+
+def recv_changes(sock: socket.socket) -> list[tuple[bytes, SyncEntry]]:
+    length = _BLOB.unpack(_recv_exact(sock, _BLOB.size))[0]
+    return list(read_changes(io.BytesIO(_recv_exact(sock, length))))
+
+
+def _recv_exact(sock: socket.socket, size) -> bytearray:
+    buffer = bytearray(size)
+    view, received = memoryview(buffer), 0
+    while received < size:
+        got = sock.recv_into(view[received:])
+        if not got:
+            raise ConnectionError("sender closed the connection")
+        received += got
+    return buffer
+
+
+def diff(root, local: Iterable[SyncEntry], remote: Iterable[SyncEntry],
+         cache: ScanCache = None) -> Iterator[tuple[bytes, SyncEntry]]:
+    """
+    Compares sender's :param local: entries against receiver's :param remote: manifest, both in manifest order,
+    a file whose size matches but mtime doesn't is hashed to tell whether it really changed
+    (digest :param local: came with is taken if there is one, what gets hashed goes into :param cache:)
+    """
+    local, remote = iter(local), iter(remote)
+    mine, theirs = next(local, None), next(remote, None)
+    while mine is not None or theirs is not None:
+        if theirs is None or (mine is not None and sort_key(mine[0]) < sort_key(theirs[0])):
+            yield SEND, mine
+            mine = next(local, None)
+            continue
+        if mine is None or sort_key(theirs[0]) < sort_key(mine[0]):
+            yield DELETE, theirs
+            theirs = next(remote, None)
+            continue
+        name, size, mtime, _ = mine
+        if name.endswith('/') or (size, mtime) == theirs[1:3]:
+            pass
+        elif size == theirs[1] and theirs[3] != NO_DIGEST:
+            digest = mine[3] if mine[3] != NO_DIGEST else _hashed(root, name, cache)
+            yield (TOUCH, (name, size, mtime, digest)) if digest == theirs[3] else (SEND, mine)
+        else:
+            yield SEND, mine
+        mine, theirs = next(local, None), next(remote, None)
+
+
+def _hashed(root, name, cache: Optional[ScanCache]) -> bytes:
+    path = os.path.join(root, name)
+    try:
+        stat_result, hashed_at = os.stat(path), time.time_ns()
+        digest = file_digest(path)
+    except OSError:
+        return NO_DIGEST
+    if cache is not None:
+        cache.store_digest(name, stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino, hashed_at, digest)
+    return digest
+
+
+def merge(root, old: Iterable[SyncEntry], changes: list[tuple[bytes, SyncEntry]]) -> Iterator[SyncEntry]:
+    """
+    Receiver side, manifest after :param changes: are applied on :param old: manifest,
+    sent files are hashed from disk and left out if they did not arrive completely (so next sync sends them)
+    """
+    old, changed = iter(old), iter(changes)
+    entry, (op, change) = next(old, None), next(changed, (None, None))
+    while entry is not None or change is not None:
+        if change is None or (entry is not None and sort_key(entry[0]) < sort_key(change[0])):
+            yield entry
+            entry = next(old, None)
+            continue
+        if entry is not None and entry[0] == change[0]:
+            entry = next(old, None)
+        if op == TOUCH:
+            yield change
+        elif op == SEND:
+            if (received := _received(root, change)) is not None:
+                yield received
+        op, change = next(changed, (None, None))
+
+
+def local_path(root, name) -> Optional[str]:
+    """
+    path of entry :param name: (as a peer sent it) under :param root:,
+    None if it would be anywhere else (see `safe_relative_path`, and it's parent has to resolve under root)
+    """
+    if (relative := safe_relative_path(name.rstrip('/'))) is None:
+        return None
+    path = os.path.join(root, relative)
+    root = os.path.realpath(root)
+    if os.path.commonpath((root, os.path.realpath(os.path.dirname(path)))) != root:
+        return None
+    return path
+
+
+def _received(root, entry: SyncEntry) -> Optional[SyncEntry]:
+    if (path := local_path(root, entry[0])) is None:
+        return None
+    if entry[0].endswith('/'):
+        return entry if os.path.isdir(path) else None
+    try:
+        if os.path.getsize(path) != entry[1]:
+            return None
+        return entry[0], entry[1], entry[2], file_digest(path)
+    except OSError:
+        return None
+
+
+def apply_deletions(root, changes: Iterable[tuple[bytes, SyncEntry]]):
+    """
+    removes deleted files, and directories left empty by that (upto :param root:),
+    names that are not under root (see `local_path`) are skipped
+    """
+    for op, (name, *_) in changes:
+        if op != DELETE:
+            continue
+        if (path := local_path(root, name)) is None:
+            error_log(f"::not deleting {name!r} outside {root} at {func_str(apply_deletions)}")
+            continue
+        try:
+            os.rmdir(path) if name.endswith('/') else os.remove(path)
+        except OSError:
+            continue
+        parent = os.path.dirname(path)
+        while os.path.normpath(parent) != os.path.normpath(root):
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+
+
+def manifest_path(sync_id):
+    return os.path.join(const.PATH_DOWNLOAD, SYNC_FOLDER, f"{sync_id}.manifest")
+
+
+def open_manifest(sync_id) -> tuple[Optional[str], Optional[BinaryIO]]:
+    """
+    :returns root the directory was last received into and manifest file positioned at it's entries,
+             (None, None) if it was never received or the copy is gone:
+    """
+    try:
+        file = open(manifest_path(sync_id), 'rb')
+    except OSError:
+        return None, None
+    try:
+        length = _LENGTH.unpack(_read_exact(file, _LENGTH.size))[0]
+        root = _read_exact(file, length).decode(const.FORMAT)
+    except (ConnectionError, UnicodeDecodeError, struct.error):
+        file.close()
+        return None, None
+    if not os.path.isdir(root):
+        file.close()
+        return None, None
+    return root, file
+
+
+def save_manifest(sync_id, root, entries: Iterable[SyncEntry], previous: Optional[BinaryIO] = None):
+    """
+    Written next to the old one and swapped in, so a crash in between leaves the old manifest,
+    :param previous: old manifest file :param entries: are read from, closed before swapping
+    """
+    path = manifest_path(sync_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.new', 'wb') as file:
+        encoded = root.encode(const.FORMAT)
+        file.write(_LENGTH.pack(len(encoded)) + encoded)
+        write_entries(file, entries)
+    if previous:
+        previous.close()
+    os.replace(path + '.new', path)
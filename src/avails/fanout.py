@@ -0,0 +1,195 @@
+"""
+Sending same files to many peers at once,
+files are read from disk once into a ring of chunks shared by every peer's socket.
+Receivers see an ordinary `PeerFilePool` stream, nothing changes on their side
+"""
+from typing import Hashable, Optional
+
+from concurrent.futures import ThreadPoolExecutor
+
+from src.core import *
+from src.avails.fileobject import _FileItem, data_extents, file_header, BATCH_FILES, END_OF_BATCHES
+
+RING_CHUNK = 1024 * 1024
+RING_CHUNKS = 64  # chunks held in memory, i.e. how far a receiver can lag behind the reader
+STALL_TIMEOUT = 1  # sec, reader waits this long on the slowest receiver before leaving it to read from disk
+
+type _Piece = tuple[int, int, int]  # file index, offset, length
+
+
+class _ChunkRing:
+    """
+    Fixed number of slots holding the latest chunks read, chunk `seq` lives in slot `seq % capacity`.
+    Every attached receiver has a position (next chunk it needs), reader does not overwrite a chunk
+    the slowest receiver still needs, unless it is kept waiting for `STALL_TIMEOUT`, in which case
+    that receiver gets detached and reads the rest from disk by itself (spilled)
+    """
+    __slots__ = '__chunks', '__capacity', '__head', '__positions', '__cond', '__closed'
+
+    def __init__(self, capacity=RING_CHUNKS):
+        self.__chunks: list[Optional[bytes]] = [None] * capacity
+        self.__capacity = capacity
+        self.__head = 0  # seq of the next chunk to be published
+        self.__positions: dict[Hashable, int] = {}
+        self.__cond = threading.Condition()
+        self.__closed = False
+
+    def attach(self, key):
+        with self.__cond:
+            self.__positions[key] = 0
+
+    def detach(self, key):
+        with self.__cond:
+            self.__positions.pop(key, None)
+            self.__cond.notify_all()
+
+    def publish(self, chunk: bytes) -> bool:
+        """
+        Puts the next chunk into ring, blocks while it would overwrite a chunk an attached receiver needs
+        :returns False if no receiver is left reading from ring (or ring is closed):
+        """
+        with self.__cond:
+            deadline = None
+            while self.__positions and not self.__closed:
+                slowest = min(self.__positions.values())
+                if self.__head - slowest < self.__capacity:
+                    break
+                deadline = deadline or time.monotonic() + STALL_TIMEOUT
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    for key in [k for k, position in self.__positions.items() if position == slowest]:
+                        del self.__positions[key]  # spilled
+                    deadline = None
+                    continue
+                self.__cond.wait(remaining)
+            if not self.__positions or self.__closed:
+                return False
+            self.__chunks[self.__head % self.__capacity] = chunk
+            self.__head += 1
+            self.__cond.notify_all()
+            return True
+
+    def get(self, key, seq) -> Optional[bytes]:
+        """
+        Waits for chunk `seq` to be published
+        :returns the chunk, None if the receiver is detached (spilled) or reader stopped before `seq`:
+        """
+        with self.__cond:
+            while seq >= self.__head and key in self.__positions and not self.__closed:
+                self.__cond.wait()
+            if key not in self.__positions or seq >= self.__head or self.__head - seq > self.__capacity:
+                self.__positions.pop(key, None)
+                return None
+            self.__positions[key] = seq + 1
+            self.__cond.notify_all()
+            return self.__chunks[seq % self.__capacity]
+
+    def close(self):
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify_all()
+
+    def __repr__(self):
+        return f"_ChunkRing(head={self.__head}, capacity={self.__capacity}, receivers={len(self.__positions)})"
+
+
+class FanOutSender:
+    """
+    Sends given files to many sockets with a single reader.
+    Files are cut into pieces (data extents, at most `chunk_size` each) up front, reader thread publishes
+    pieces in order into a `_ChunkRing` and a thread per socket walks the same pieces, taking them from ring
+    or reading from disk once it is spilled.
+    Wire format is same as `PeerFilePool.send_files`, so any peer can receive it with `PeerFilePool.recv_files`
+    """
+    __slots__ = 'file_items', 'controller', '__extents', '__pieces', '__ring', '__chunk_size'
+
+    def __init__(self, file_items: list[_FileItem], *, capacity=RING_CHUNKS, chunk_size=RING_CHUNK):
+        self.file_items = file_items
+        self.controller = ThreadActuator(None)
+        self.__chunk_size = chunk_size
+        self.__ring = _ChunkRing(capacity)
+        self.__extents: list[list[tuple[int, int]]] = []
+        self.__pieces: list[_Piece] = []
+        for index, file in enumerate(file_items):
+            with open(file.path, 'rb') as f:
+                extents = data_extents(f.fileno(), 0, file.size)
+            self.__extents.append(extents)
+            for offset, length in extents:
+                self.__pieces.extend(
+                    (index, start, min(chunk_size, offset + length - start))
+                    for start in range(offset, offset + length, chunk_size)
+                )
+
+    def send(self, sockets: dict[Hashable, socket.socket]) -> dict[Hashable, Optional[int]]:
+        """
+        Blocks until files are sent to every socket (or they fail)
+        :param sockets: key to tell the results apart, and connected socket
+        :returns key and None if every file is sent, else index of the file that got interrupted:
+        """
+        for key in sockets:
+            self.__ring.attach(key)
+        with ThreadPoolExecutor(max_workers=len(sockets) + 1, thread_name_prefix='peer-connect-fan-out') as pool:
+            pool.submit(self.__read_loop)
+            futures = {key: pool.submit(self.__send_to, key, sock) for key, sock in sockets.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+    def __read_loop(self):
+        current_index, current_file = None, None
+        try:
+            for index, offset, length in self.__pieces:
+                if self.controller.to_stop:
+                    return
+                if index != current_index:
+                    current_file.close() if current_file else None
+                    current_index, current_file = index, open(self.file_items[index].path, 'rb')
+                current_file.seek(offset)
+                chunk = current_file.read(length)
+                if len(chunk) < length or not self.__ring.publish(chunk):
+                    return
+        except OSError as e:
+            error_log(f"::reading failed at {func_str(FanOutSender.__read_loop)} exp: {e}")
+        finally:
+            current_file.close() if current_file else None
+            self.__ring.close()  # receivers still behind read rest of the pieces from disk
+
+    def __send_to(self, key, sock) -> Optional[int]:
+        index, seq, spill = 0, 0, None
+        pieces, total = self.__pieces, len(self.file_items)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, False)
+            for index, file in enumerate(self.file_items):
+                batch_count = min(BATCH_FILES, total - index) if index % BATCH_FILES == 0 else None
+                connect.send_buffers(sock, file_header(sock, file, self.__extents[index], batch_count=batch_count))
+                while seq < len(pieces) and pieces[seq][0] == index:
+                    if self.controller.to_stop:
+                        return index
+                    chunk = self.__ring.get(key, seq)
+                    if chunk is None:
+                        spill = self.__spill_file(spill, index)
+                        spill[1].seek(pieces[seq][1])
+                        chunk = spill[1].read(pieces[seq][2])
+                        if len(chunk) < pieces[seq][2]:
+                            return index
+                    sock.sendall(chunk)
+                    seq += 1
+            sock.sendall(END_OF_BATCHES)
+            return None
+        except OSError as e:
+            error_log(f"::sending failed at {func_str(FanOutSender.__send_to)} exp: {e}")
+            return index
+        finally:
+            self.__ring.detach(key)
+            spill[1].close() if spill else None
+
+    def __spill_file(self, spill, index):
+        if spill and spill[0] == index:
+            return spill
+        spill[1].close() if spill else None
+        return index, open(self.file_items[index].path, 'rb')
+
+    def break_loop(self):
+        self.controller.signal_stopping()
+        self.__ring.close()
+
+    def __repr__(self):
+        return f"FanOutSender(files={len(self.file_items)}, pieces={len(self.__pieces)}, {self.__ring})"
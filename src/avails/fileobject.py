@@ -1,11 +1,16 @@
+import errno
+import heapq
 import itertools
 import os.path
-from typing import Any, Iterator
+from typing import Any, Iterable, Iterator, Optional
 
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
-from math import isclose
+from stat import S_ISREG
 import tqdm
 from src.core import *
+from src.avails.scancache import ScanCache, Listing
 from src.avails.textobject import SimplePeerText
 
 type _Name = str
@@ -55,6 +60,146 @@ class _FileItem:
         return (self.name, self.size, self.path)[item]
 
 
+def data_extents(fd, start, size) -> list[tuple[int, int]]:
+    """
+    Finds data regions of a (possibly sparse) file using `SEEK_DATA`/`SEEK_HOLE`,
+    anything in between two extents is a hole
+    falls back to a single extent covering [start, size) where the platform or the filesystem can't tell holes
+    :param fd: file descriptor of the file opened for reading
+    :param start: offset to start looking from
+    :param size: size of the file
+    :returns list[tuple(offset, length)]:
+    """
+    if not hasattr(os, 'SEEK_DATA'):
+        return [(start, size - start)] if size > start else []
+    extents = []
+    offset = start
+    while offset < size:
+        try:
+            data = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:  # nothing but a hole till the end
+                break
+            return [(start, size - start)]
+        if data >= size:
+            break
+        hole = min(os.lseek(fd, data, os.SEEK_HOLE), size)
+        extents.append((data, hole - data))
+        offset = hole
+    return extents
+
+
+def pack_extents(extents: list[tuple[int, int]]) -> bytes:
+    """
+    Packs extents as count(!I) followed by (offset, length) pairs (!QQ),
+    count is always there so an empty map is never confused with a failed receive
+    """
+    count = len(extents)
+    return struct.pack(f'!I{count * 2}Q', count, *itertools.chain.from_iterable(extents))
+
+
+def unpack_extents(raw_extents: bytes, start, size) -> Optional[list[tuple[int, int]]]:
+    """
+    extents as `pack_extents` packed them, None if they are not what `data_extents` could have made
+    for a file of :param size: sent from :param start: (in order, not overlapping, within the file),
+    rest of the file's bytes on socket can't be told apart from the next file's then
+    """
+    if not raw_extents or len(raw_extents) < 4:
+        return None
+    count = struct.unpack_from('!I', raw_extents)[0]
+    if len(raw_extents) != 4 + count * 16:
+        return None
+    extents = list(struct.iter_unpack('!QQ', raw_extents[4:]))
+    end = start
+    for offset, length in extents:
+        if offset < end or offset + length > size:
+            return None
+        end = offset + length
+    return extents
+
+
+_COUNT = struct.Struct('!I')
+END_OF_BATCHES = _COUNT.pack(0)  # an empty batch ends a pool's stream
+
+
+def file_header(sock, file: _FileItem, extents: Optional[list[tuple[int, int]]] = None, *,
+                batch_count=None, resumed=False) -> list[bytes]:
+    """
+    Buffers that go before a file's data on a pool's socket (see `PeerFilePool.recv_files`), to be written
+    in one `connect.send_buffers` : file count(!I) if :param batch_count: is given (file starts a batch),
+    name, size(!Q), then data :param extents: (see `pack_extents`), which a directory does not have (None).
+    A :param resumed: file goes with only it's extents, receiver knows the rest already
+    """
+    buffers = [] if batch_count is None else [_COUNT.pack(batch_count)]
+    if not resumed:
+        buffers += SimplePeerText(sock, file.name.encode(const.FORMAT)).frame()
+        buffers.append(struct.pack('!Q', file.size))
+    if extents is not None:
+        buffers += SimplePeerText(sock, pack_extents(extents)).frame()
+    return buffers
+
+
+COPY_CHUNK = 64 * 1024 * 1024
+_COPY_FALLBACK_ERRORS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP}
+
+
+def copy_local_file(source, destination, controller, chunk_size=COPY_CHUNK) -> int:
+    """
+    Copies a file within this machine without passing it's bytes through user space where possible,
+    `os.copy_file_range` lets the filesystem share blocks (reflink on btrfs/xfs) or copy them in kernel,
+    falls back to a plain read/write loop where it is not supported.
+    Copy stops early once :param controller: says so (pool controllers are flipped, to_stop True means proceed)
+
+    :returns number of bytes copied:
+    """
+    with open(source, 'rb') as src_file, open(destination, 'xb') as dst_file:
+        size = os.fstat(src_file.fileno()).st_size
+        copied = 0
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while controller.to_stop and copied < size:
+                    done = os.copy_file_range(src_file.fileno(), dst_file.fileno(), min(chunk_size, size - copied))
+                    if not done:
+                        break
+                    copied += done
+                return copied
+            except OSError as e:
+                if copied or e.errno not in _COPY_FALLBACK_ERRORS:
+                    raise
+        buffer = memoryview(bytearray(min(chunk_size, 1024 * 1024)))
+        while controller.to_stop and copied < size:
+            read = src_file.readinto(buffer)
+            if not read:
+                break
+            dst_file.write(buffer[:read])
+            copied += read
+        return copied
+
+
+def safe_relative_path(name: str) -> Optional[str]:
+    """
+    Turns a '/' separated name sent by a peer into a relative path of this os,
+    None if it tries to get out of the directory it is received into (absolute paths, '..', drive letters)
+    """
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or '..' in parts or name.startswith(('/', '\\')):
+        return None
+    relative = os.path.join(*parts)
+    if os.path.isabs(relative) or os.path.splitdrive(relative)[0]:
+        return None
+    return relative
+
+
+def safe_name(name) -> Optional[str]:
+    """
+    Last component of a name sent by a peer, for a single file or directory made right under downloads,
+    None if nothing usable is left ('', '.', '..')
+    """
+    name = str(name).replace('\\', '/').rstrip('/').rsplit('/', 1)[-1]
+    name = os.path.splitdrive(name)[1]
+    return None if name in ('', '.', '..') else name
+
+
 def stringify_size(size):
     sizes = ['B', 'KB', 'MB', 'GB', 'TB']
     index = 0
@@ -64,24 +209,45 @@ def stringify_size(size):
     return f"{size:.2f} {sizes[index]}"
 
 
+BATCH_FILES = 64
+BATCH_SIZE = 64 * 1024 * 1024
+
+
 class PeerFilePool:
-    __slots__ = 'file_items', 'controller', '__chunk_size', '__error_extension', 'id', 'current_file', 'file_count'
+    __slots__ = ('file_items', 'controller', '__chunk_size', '__error_extension', 'id', 'current_file', 'file_count',
+                 '__pending', '__feed', '__sealed', '__drained', 'bytes_sent', 'download_path', 'overwrite')
 
     def __init__(self,
                  file_items: list[_FileItem] = None, *,
                  _id,
                  control_flag=None,
                  chunk_size=1024 * 512,
-                 error_ext='.invalid'
+                 error_ext='.invalid',
+                 download_path=None,
+                 overwrite=False
                  ):
+        """
+        :param download_path: where received files go (defaults to downloads), file names can be relative paths
+                              under it (like 'dir/sub/file'), a name ending with '/' is an (empty) directory
+        :param overwrite: a received file replaces the one already there with same name, instead of getting
+                          a new name (used by directory sync)
+        """
 
         self.controller = control_flag or ThreadActuator(None)
         # setting event thus reducing ~not`ting~ of self.proceed() in most of the loop checkings
         self.controller.flip()
         self.__chunk_size = chunk_size
         self.__error_extension = error_ext
-        self.file_items: set[_FileItem] = set(file_items or [])
+        self.file_items: list[_FileItem] = list(file_items or [])
         self.id = _id
+        # files yet to be sent, a pool made without files can be fed using `self.feed` while it is sending
+        self.__pending: deque[_FileItem] = deque(self.file_items)
+        self.__feed = threading.Condition()
+        self.__sealed = file_items is not None
+        self.__drained = False  # sealed and everything is handed out, no more files can be taken in
+        self.bytes_sent = 0
+        self.download_path = download_path or const.PATH_DOWNLOAD
+        self.overwrite = overwrite
         self.current_file: Iterator[_FileItem] | _FileItem = self.file_items.__iter__()
         self.file_count = 0
         # this can be ~_FileItem() while recieving (we don't use ~self.file_items list in case of receiving
@@ -101,25 +267,97 @@ class PeerFilePool:
         #     if not os.path.isfile(file_path):
         #         raise IsADirectoryError(f"Not a regular file: {file_path}")
 
+    def feed(self, file_items: list[_FileItem]) -> bool:
+        """
+        Adds files to this pool, files fed while the pool is sending go out in it's next batch
+        :returns False if pool is already done with sending and can't take files:
+        """
+        with self.__feed:
+            if self.__drained:
+                return False
+            self.file_items.extend(file_items)
+            self.__pending.extend(file_items)
+            self.__feed.notify()
+            return True
+
+    def seal(self):
+        """
+        Marks that no more files are going to be fed, pool ends once pending files are sent
+        """
+        with self.__feed:
+            self.__sealed = True
+            self.__feed.notify()
+
+    def take_pending(self) -> list[_FileItem]:
+        """
+        Takes back files that are not yet picked into a batch, used to move them to another pool
+        """
+        with self.__feed:
+            taken = list(self.__pending)
+            self.__pending.clear()
+            taken_ids = set(map(id, taken))
+            self.file_items = [x for x in self.file_items if id(x) not in taken_ids]
+            return taken
+
+    @property
+    def pending_size(self):
+        with self.__feed:
+            return sum(x.size for x in self.__pending)
+
+    def __next_batch(self) -> list[_FileItem]:
+        """
+        a batch is kept small (BATCH_FILES files or BATCH_SIZE bytes) so that rest of the pending files
+        can still be moved to other pools
+        """
+        with self.__feed:
+            while not (self.__pending or self.__sealed) and self.controller.to_stop:
+                self.__feed.wait()
+            batch, batch_size = [], 0
+            while self.__pending and len(batch) < BATCH_FILES and (not batch or batch_size < BATCH_SIZE):
+                file = self.__pending.popleft()
+                batch.append(file)
+                batch_size += file.size
+            self.__drained = not batch
+            return batch
+
     def send_files(self, receiver_sock):
-        raw_file_count = struct.pack('!I', len(self.file_items))
-        # print("sent file count ", raw_file_count)  # debug
-        receiver_sock.send(raw_file_count)
         receiver_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, False)
-        self.current_file, iterator = itertools.tee(self.file_items)
-        return self.send_file_loop(iterator, receiver_sock)
+        return self.__send_batches(receiver_sock)
 
-    def send_file_loop(self, current_iter, receiver_sock):
+    def __send_batches(self, receiver_sock):
+        """
+        Files are sent in batches each prefixed with it's file count(!I) and an empty batch ends the pool,
+        so that sending starts with whatever is fed so far
+        """
+        while batch := self.__next_batch():
+            self.current_file, iterator = itertools.tee(batch)
+            if not self.send_file_loop(iterator, receiver_sock, len(batch)):
+                return False
+        if self.controller.to_stop is False:
+            return False
+        receiver_sock.sendall(END_OF_BATCHES)
+        return True
+
+    def send_file_loop(self, current_iter, receiver_sock, batch_count=None):
+        """:param batch_count: goes along with first file's header, if files start a batch"""
         for file in current_iter:
-            if self.controller.to_stop is False or self.__send_file(receiver_sock, file=file) is False:
+            if self.controller.to_stop is False or self.__send_file(receiver_sock, file=file,
+                                                                    batch_count=batch_count) is False:
                 return False
+            batch_count = None
             next(self.current_file)
         return True
 
-    def __send_file(self, receiver_sock, *, file: _FileItem):
-
-        SimplePeerText(text=file.name.encode(const.FORMAT), refer_sock=receiver_sock).send()
-        receiver_sock.send(struct.pack('!Q', file.size))
+    def __send_file(self, receiver_sock, *, file: _FileItem, batch_count=None):
+        if file.seeked == 0 and not file.name.endswith('/'):
+            try:
+                file.size = os.stat(file.path).st_size  # size walked may be stale (from a `ScanCache`)
+            except OSError:
+                pass
+        if file.name.endswith('/'):
+            # a directory, nothing more than it's name
+            connect.send_buffers(receiver_sock, file_header(receiver_sock, file, batch_count=batch_count))
+            return True
         self.calculate_chunk_size(file.size)
 
         send_progress = tqdm.tqdm(
@@ -130,45 +368,71 @@ class PeerFilePool:
             unit_divisor=1024
         )
 
-        self.__send_actual_file(file, receiver_sock, send_progress)
+        self.__send_actual_file(file, receiver_sock, send_progress, batch_count)
         send_progress.close()
+        return file.seeked == file.size
 
-    def __send_actual_file(self, file, receiver_sock, send_progress):
+    def __send_actual_file(self, file, receiver_sock, send_progress, batch_count=None, *, resumed=False):
+        # not sendall, it can time out after sending a part of chunk and leaves no way to tell how much
         sock_send = receiver_sock.send
         send_progress.update(file.seeked)
         with open(file.path, 'rb') as f:
             f_read, proceed = f.read, self.controller
-            f.seek(file.seeked)
+            extents = data_extents(f.fileno(), file.seeked, file.size)
+            # the receiver recreates whatever is not covered by these extents as holes
+            header = file_header(receiver_sock, file, extents, batch_count=batch_count, resumed=resumed)
+            connect.send_buffers(receiver_sock, header)
             seek = file.seeked
             try:
-                while proceed.to_stop:
-                    chunk = memoryview(f_read(self.__chunk_size))
-                    if not chunk:
-                        break
-                    try:
-                        sock_send(chunk)  # possible: connection reset err
-                    except TimeoutError:
-                        # may be the case where receiver is too slow , stimulating a delay
-                        time.sleep(3)  # just a random number
-                        continue
-                    except ConnectionResetError:
-                        break
-                    send_progress.update(len(chunk))
-                    seek += len(chunk)
+                for offset, length in extents:
+                    send_progress.update(offset - seek)  # skipped a hole
+                    seek = offset
+                    f.seek(offset)
+                    end = offset + length
+                    while proceed.to_stop and seek < end:
+                        chunk = memoryview(f_read(min(self.__chunk_size, end - seek)))
+                        if not chunk:
+                            break
+                        while chunk and proceed.to_stop:
+                            try:
+                                sent = sock_send(chunk)  # possible: connection reset err
+                            except TimeoutError:
+                                # may be the case where receiver is too slow , stimulating a delay
+                                # send() times out only when none of chunk went out, so nothing goes twice
+                                time.sleep(3)  # just a random number
+                                continue
+                            except ConnectionResetError:
+                                return
+                            chunk = chunk[sent:]
+                            send_progress.update(sent)
+                            seek += sent
+                            self.bytes_sent += sent
+                    if seek < end:
+                        return
+                send_progress.update(file.size - seek)  # trailing hole
+                seek = file.size
             finally:
                 file.seeked = seek  # can be ignored mostly for now
 
     def recv_files(self, sender_sock):
-        reads, _, _ = select.select([sender_sock, self.controller], [], [], 30)
-        if sender_sock in reads:
-            raw_file_count = sender_sock.recv(4) or b'\x00\x00\x00\x00'
-            self.file_count = struct.unpack('!I', raw_file_count)[0]
-        else:
-            print("TIMEOUT OF 30sec reached OR SOMETHING WRONG WITH SOCKET")
-            self.file_count = 0
-        print("received file count", self.file_count)  # debug
         sender_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, False)
-        return self.__receive_file_loop(self.file_count, sender_sock)
+        return self.__receive_batches(sender_sock)
+
+    def __receive_batches(self, sender_sock):
+        while True:
+            reads, _, _ = select.select([sender_sock, self.controller], [], [], 30)
+            if sender_sock not in reads:
+                print("TIMEOUT OF 30sec reached OR SOMETHING WRONG WITH SOCKET")
+                return False
+            raw_file_count = sender_sock.recv(4)
+            if len(raw_file_count) < 4:
+                return False
+            self.file_count = struct.unpack('!I', raw_file_count)[0]
+            print("received file count", self.file_count)  # debug
+            if self.file_count == 0:
+                return True
+            if not self.__receive_file_loop(self.file_count, sender_sock):
+                return False
 
     def __receive_file_loop(self, count, sender_sock):
         for _ in range(count):
@@ -183,9 +447,24 @@ class PeerFilePool:
 
     def __recv_file(self, sender_sock, file_item):
 
-        FILE_NAME = self.__validatename__(SimplePeerText(sender_sock).receive().decode(const.FORMAT))
+        raw_name = SimplePeerText(sender_sock).receive().decode(const.FORMAT)
+        if (relative_name := safe_relative_path(raw_name)) is None:
+            print("REFUSING FILE NAME", raw_name)  # debug
+            return False
+        if not raw_name.endswith('/'):
+            os.makedirs(os.path.dirname(os.path.join(self.download_path, relative_name)), exist_ok=True)
+        if raw_name.endswith('/'):
+            FILE_NAME = relative_name
+        elif self.overwrite:
+            FILE_NAME = relative_name
+            try:
+                os.remove(os.path.join(self.download_path, FILE_NAME))
+            except FileNotFoundError:
+                pass
+        else:
+            FILE_NAME = self.__validatename__(relative_name, self.download_path)
         file_item.name = FILE_NAME
-        file_item.path = os.path.join(const.PATH_DOWNLOAD, FILE_NAME)
+        file_item.path = os.path.join(self.download_path, FILE_NAME)
 
         reads, _, _ = select.select([sender_sock, self.controller], [], [], 30)
         if not self.controller.to_stop:
@@ -196,8 +475,12 @@ class PeerFilePool:
             return
         FILE_SIZE = struct.unpack('!Q', sender_sock.recv(8))[0]
         file_item.size = FILE_SIZE
+        if raw_name.endswith('/'):
+            os.makedirs(file_item.path, exist_ok=True)
+            self.file_items.append(file_item)
+            return True
         print('INTIAL FILE ITEM ', file_item)  # debug
-        self.file_items.add(file_item)
+        self.file_items.append(file_item)
         self.calculate_chunk_size(FILE_SIZE)
         progress = tqdm.tqdm(
             range(FILE_SIZE),
@@ -213,27 +496,43 @@ class PeerFilePool:
 
     def __recv_actual_file(self, sender_sock, file_item: _FileItem, progress):
         mode = 'xb' if file_item.seeked == 0 else 'rb+'
-
+        extents = unpack_extents(SimplePeerText(sender_sock).receive(), file_item.seeked, file_item.size)
+        if extents is None:
+            # nothing tells where this file's bytes end on the socket, so rest of the batch can't be received either
+            error_log(f"::bad extents for {file_item.name} at {func_str(self.__recv_actual_file)}")
+            return False
+        position = file_item.seeked
         try:
             with open(file_item.path, mode) as file:
-                f_write, f_recv, size = file.write, sender_sock.recv, file_item.size
-                file.seek(file_item.seeked)
-                progress.update(file_item.seeked)
-                while self.controller.to_stop and size > 0:
-                    try:
-                        data = f_recv(min(self.__chunk_size, size))  # possible: socket.error, s
-                    except BlockingIOError:
-                        continue
-                    except ConnectionResetError:
-                        break
-                    if not data:
+                f_write, f_recv = file.write, sender_sock.recv
+                # extending the file creates the holes, only data extents are written
+                file.truncate(file_item.size)
+                progress.update(position)
+                for offset, size in extents:
+                    progress.update(offset - position)
+                    position = offset
+                    file.seek(offset)
+                    while self.controller.to_stop and size > 0:
+                        try:
+                            data = f_recv(min(self.__chunk_size, size))  # possible: socket.error, s
+                        except BlockingIOError:
+                            continue
+                        except ConnectionResetError:
+                            break
+                        if not data:
+                            break
+                        f_write(data)  # possible: No Space Left
+                        size -= len(data)
+                        position += len(data)
+                        progress.update(len(data))
+                    if size > 0:
                         break
-                    f_write(data)  # possible: No Space Left
-                    size -= len(data)
-                    progress.update(len(data))
+                else:
+                    progress.update(file_item.size - position)
+                    position = file_item.size
         finally:
-            file_item.seeked = file_item.size - size
-            if size > 0:
+            file_item.seeked = position
+            if position < file_item.size:
                 self.__file_error__(file_item)
                 return False
             return True
@@ -250,17 +549,19 @@ class PeerFilePool:
         start_file.seeked = struct.unpack('!Q', receiver_sock.recv(8))[0]
         progress = tqdm.tqdm(range(start_file.size), f"::sending {start_file.name[:20]} ... ", unit="B",
                              unit_scale=True, unit_divisor=1024)
-        self.__send_actual_file(start_file, receiver_sock, progress)
+        self.__send_actual_file(start_file, receiver_sock, progress, resumed=True)
         progress.close()
         # -> ---------------------- file continuation part
 
-        self.send_file_loop(present_iter, receiver_sock)
-        return True
+        # rest of the interrupted batch goes out as the next batch
+        with self.__feed:
+            self.__pending.extendleft(reversed(list(present_iter)))
+        return self.__send_batches(receiver_sock)
 
     def receive_files_again(self, sender_sock):
         # -> ----------------------
         start_file = self.current_file
-        sender_sock.send(start_file.seeked)
+        sender_sock.send(struct.pack('!Q', start_file.seeked))
         progress = tqdm.tqdm(range(start_file.size), f"::receiving {start_file.name[:20]} ... ", unit="B",
                              unit_scale=True, unit_divisor=1024)
         self.__recv_actual_file(sender_sock, start_file, progress)
@@ -268,8 +569,45 @@ class PeerFilePool:
         progress.close()
         # -> ---------------------- file continuation part
 
-        self.__receive_file_loop(self.file_count, sender_sock)
-        return True
+        return self.__receive_batches(sender_sock)
+
+    def copy_files(self, file_items: list[_FileItem]) -> int:
+        """
+        Receiving side of a same-host transfer, sender hands over paths instead of bytes
+        and files are copied straight from them into download path, see `copy_local_file`.
+        names are taken like the ones that come over sockets (see `safe_relative_path`)
+
+        :returns: how many of :param file_items: (from the start, they are copied in order) were copied completely,
+                  sender sends the rest over network
+        """
+        for copied, file_item in enumerate(file_items):
+            if not self.controller.to_stop:
+                return copied
+            if (relative_name := safe_relative_path(file_item.name)) is None:
+                error_log(f"::refusing file name {file_item.name!r} at {func_str(PeerFilePool.copy_files)}")
+                return copied
+            source = file_item.path
+            if file_item.name.endswith('/'):
+                file_item.path = os.path.join(self.download_path, relative_name)
+                os.makedirs(file_item.path, exist_ok=True)
+                self.file_items.append(file_item)
+                continue
+            os.makedirs(os.path.dirname(os.path.join(self.download_path, relative_name)), exist_ok=True)
+            file_item.name = self.__validatename__(relative_name, self.download_path)
+            file_item.path = os.path.join(self.download_path, file_item.name)
+            self.current_file = file_item
+            self.file_items.append(file_item)
+            try:
+                file_item.seeked = copy_local_file(source, file_item.path, self.controller)
+            except OSError as e:
+                error_log(f"::copying {source} failed at {func_str(PeerFilePool.copy_files)} exp: {e}")
+                if not os.path.exists(file_item.path):
+                    self.file_items.pop()
+                    return copied
+            if file_item.seeked < file_item.size:
+                self.__file_error__(file_item)
+                return copied
+        return len(file_items)
 
     @NotInUse
     def __chunkify__(self, file_path):
@@ -286,28 +624,30 @@ class PeerFilePool:
             Handles file errors by renaming the file with an error extension.
         """
         pathed = Path(file_item.path)
-        file_name = self.__validatename__(file_item.name + self.__error_extension)
+        file_name = self.__validatename__(file_item.name + self.__error_extension, self.download_path)
         file_item.path = str(pathed)
-        pathed.rename(os.path.join(const.PATH_DOWNLOAD, file_name))
+        pathed.rename(os.path.join(self.download_path, file_name))
 
         file_item.name += self.__error_extension
         return file_item
 
     @staticmethod
-    def __validatename__(file_addr):
+    def __validatename__(file_addr, download_path=None):
         """
             Ensures a unique filename if a file with the same name already exists.
 
             Args:
                 file addr (str): The original filename.
+                download_path (str): directory the name is under, downloads if not given
 
             Returns:
                 str: The validated filename, ensuring uniqueness.
         """
+        download_path = download_path or const.PATH_DOWNLOAD
         base, ext = os.path.splitext(file_addr)
         counter = 1
         new_file_name = file_addr
-        while os.path.exists(os.path.join(const.PATH_DOWNLOAD, new_file_name)):
+        while os.path.exists(os.path.join(download_path, new_file_name)):
             new_file_name = f"{base}({counter}){ext}"
             counter += 1
         return new_file_name
@@ -317,8 +657,9 @@ class PeerFilePool:
             Removes file error ext by renaming the file with its actual file extension .
         """
         pathed = Path(file_item.path)
-        new_name = self.__validatename__(pathed.stem)
-        pathed.rename(os.path.join(const.PATH_DOWNLOAD, new_name))
+        new_name = self.__validatename__(os.path.relpath(pathed.with_suffix(''), self.download_path),
+                                         self.download_path)
+        pathed.rename(os.path.join(self.download_path, new_name))
         file_item.path = str(pathed)
     
     def __repr__(self):
@@ -335,6 +676,8 @@ class PeerFilePool:
 
     def break_loop(self):
         self.controller.signal_stopping()
+        with self.__feed:
+            self.__feed.notify_all()
         # self.__controller = None
 
     def calculate_chunk_size(self, file_size: int):
@@ -360,70 +703,87 @@ GROUP_MIN = 2
 GROUP_MID = 4
 GROUP_MAX = 6
 
+FILE_OVERHEAD = 256 * 1024  # bytes worth of time a file costs apart from it's data (headers, round trips, open/close)
+
 
 class _FileGroup:
-    def __init__(self, files: list[_FileItem] = None, *, bandwidth=1024 * 1024 * 512, level: int):
+    """
+    Partitions files into `grouping_level` parts, one part per socket,
+    such that all sockets are predicted to finish around the same time.
+
+    predicted time of a part = sum(file.size + file_overhead) / weight of the socket,
+    `weights` are relative throughputs of sockets (all equal if not known), and `file_overhead`
+    makes parts with many small files take fewer bytes
+    """
+
+    def __init__(self, files: list[_FileItem] = None, *, bandwidth=1024 * 1024 * 512, level: int,
+                 weights: list[float] = None, file_overhead=FILE_OVERHEAD):
         self.files = sorted(files, key=lambda x: x.size)
         self.grouped_files: list[list[_FileItem]] = []
         self.total_size = sum(x.size for x in files)
         self.bandwidth = bandwidth
         self.grouping_level = level
-        self.part_size = self.total_size // 6
+        self.weights = list(weights or [1.0] * level)
+        self.file_overhead = file_overhead
+        self.part_loads = [0] * level  # predicted cost (in bytes) assigned to each part so far
+        self.part_size = self.total_size // level
 
     def group(self):
-        self.part_size = self._adjust_part_size()
-        parts = [[]]
-        current_part_size = 0
+        """
+        Longest Processing Time first:
+        files are taken largest (cost) first, each one goes to the part where it would finish earliest,
+        which is within 4/3 of the best possible finishing time
+        """
+        self.grouped_files = [[] for _ in range(self.grouping_level)]
+        self.part_loads = [0] * self.grouping_level
+        self.__assign(self.files)
+        self.grouped_files = [x for x in self.grouped_files if x]
+        self.part_size = self.total_size // max(len(self.grouped_files), 1)
 
-        for file in self.files:
-            file_size = file.size
+    def add(self, files: list[_FileItem]) -> dict[int, list[_FileItem]]:
+        """
+        Incremental counterpart of `self.group`, used while files are still being scanned.
+        Number of parts stays fixed at `grouping_level`, a batch is placed the same way as in `self.group`
+        on top of what parts already hold
 
-            if current_part_size + file_size <= self.part_size or \
-                    isclose(current_part_size + file_size, self.part_size, rel_tol=0.004):
-                parts[-1].append(file)
-                current_part_size += file_size
-                continue
-            if file_size >= 2 ** 30 or isclose(file_size, 2 ** 30, rel_tol=0.0002):  # check again ??
-                parts.append([file])
-                current_part_size = 0
-            else:
-                parts.append([file])
-                current_part_size = file_size
-
-        self.grouped_files = [x for x in parts if x]
-
-        if len(self.grouped_files) > self.grouping_level:
-            self.re_group(self.grouping_level)
-
-    def _adjust_part_size(self):
-        if self.grouping_level == GROUP_MIN:
-            return self.total_size // 2
-        if self.grouping_level == GROUP_MAX:
-            return self.total_size // 6
-        if self.grouping_level == GROUP_MID:
-            return self.total_size // 4
-        return self.total_size
-
-    def re_group(self, size):
-        """Re-groups the files into the specified number of parts."""
-        new_group = []
-        combined_group = []
-        total_size = 0
-
-        for part in self.grouped_files:
-            part_size = sum(file.size for file in part)
-            if total_size + part_size <= self.part_size * size:
-                combined_group.extend(part)
-                total_size += part_size
-            else:
-                new_group.append(combined_group)
-                combined_group = part
-                total_size = part_size
-
-        if combined_group:
-            new_group.append(combined_group)
-
-        self.grouped_files = new_group
+        :returns mapping of part index to files added into that part:
+        """
+        if not self.grouped_files:
+            self.grouped_files = [[] for _ in range(self.grouping_level)]
+        added = self.__assign(files)
+        self.files.extend(files)
+        self.total_size += sum(x.size for x in files)
+        self.part_size = self.total_size // self.grouping_level
+        return added
+
+    def __assign(self, files) -> dict[int, list[_FileItem]]:
+        loads, weights, overhead = self.part_loads, self.weights, self.file_overhead
+        added = defaultdict(list)
+        files = sorted(files, key=lambda x: x.size, reverse=True)
+        if len(set(weights)) == 1:
+            # equal sockets, earliest finishing part is simply the least loaded one
+            heap = [(load, i) for i, load in enumerate(loads)]
+            heapq.heapify(heap)
+            for file in files:
+                load, index = heap[0]
+                loads[index] = load + file.size + overhead
+                heapq.heapreplace(heap, (loads[index], index))
+                self.grouped_files[index].append(file)
+                added[index].append(file)
+            return added
+
+        parts = range(self.grouping_level)
+        for file in files:
+            cost = file.size + overhead
+            index = min(parts, key=lambda i: (loads[i] + cost) / weights[i])
+            loads[index] += cost
+            self.grouped_files[index].append(file)
+            added[index].append(file)
+        return added
+
+    def predicted_times(self) -> list[float]:
+        """predicted time of each part in units of (bytes / weight)"""
+        return [load / weight for load, weight in zip(self.part_loads, self.weights) if load]
 
     def __len__(self):
         return self.grouped_files.__len__()
@@ -508,12 +868,146 @@ class _SockGroup:
         return f"_SockGroup(sock_count={self.sock_count})"
 
 
-def make_file_items(paths: list[_FilePath]) -> list[_FileItem]:
-    items = [_FileItem(os.path.basename(x), os.path.getsize(x), x, seeked=0) for x in paths]
+SCAN_BATCH_SIZE = 512
+SCAN_WORKERS = 8
+SCANDIR_THRESHOLD = 32  # directories with fewer selected files than this are not listed, files are stat'ed directly
+
+
+def _list_selected(directory, names: dict[str, str]) -> list[os.DirEntry | str]:
+    """
+    Lists directory once and picks entries of the selected names,
+    names that did not show up in the listing are returned back as paths to be stat'ed directly
+    """
+    remaining = dict(names)
+    found = []
+    try:
+        with os.scandir(directory or os.curdir) as entries:
+            for entry in entries:
+                if remaining.pop(entry.name, None) is not None:
+                    found.append(entry)
+    except OSError as e:
+        error_log(f"::listing failed at {func_str(_list_selected)} exp: {e}")
+    return found + list(remaining.values())
+
+
+def _stat_batch(batch: Iterable[os.DirEntry | str]) -> list[_FileItem]:
+    items = []
+    for entry in batch:
+        try:
+            if isinstance(entry, os.DirEntry):
+                if entry.is_file():
+                    items.append(_FileItem(entry.name, entry.stat().st_size, entry.path, seeked=0))
+                continue
+            stat_result = os.stat(entry)
+            if S_ISREG(stat_result.st_mode):
+                items.append(_FileItem(os.path.basename(entry), stat_result.st_size, entry, seeked=0))
+        except OSError as e:
+            error_log(f"::skipping {entry} at {func_str(_stat_batch)} exp: {e}")
     return items
 
 
-def make_file_groups(file_list: list[_FilePath], grouping_level) -> _FileGroup:
+def scan_file_items(paths: Iterable[_FilePath], *,
+                    batch_size=SCAN_BATCH_SIZE, workers=SCAN_WORKERS) -> Iterator[list[_FileItem]]:
+    """
+    Stats given paths on a thread pool and yields `_FileItem`s batch by batch in the order they complete,
+    consumer can go ahead with the first batches while the rest are still being scanned.
+    Selected files of a directory holding many of them are picked from a single `os.scandir` listing
+    (stat info comes along with the listing on Windows, and saves lookups on network shares)
+    Paths that can't be stat'ed or are not regular files are skipped
+
+    :param paths: file paths to scan
+    :param batch_size: max number of files stat'ed by a worker at once
+    :param workers: number of threads stat'ing in parallel
+    """
+    by_directory = defaultdict(dict)
+    for path in map(os.fspath, paths):
+        directory, name = os.path.split(path)
+        by_directory[directory][name] = path
+
+    loose = [path for names in by_directory.values() if len(names) < SCANDIR_THRESHOLD for path in names.values()]
+    with ThreadPoolExecutor(workers, thread_name_prefix='peer-connect-scan') as pool:
+        listings = {
+            pool.submit(_list_selected, directory, names)
+            for directory, names in by_directory.items() if len(names) >= SCANDIR_THRESHOLD
+        }
+        pending = listings | {pool.submit(_stat_batch, batch) for batch in itertools.batched(loose, batch_size)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in listings:
+                    pending |= {pool.submit(_stat_batch, batch)
+                                for batch in itertools.batched(future.result(), batch_size)}
+                elif items := future.result():
+                    yield items
+
+
+def _list_directory(directory, relative) -> Listing:
+    files, directories, empty = [], [], True
+    with os.scandir(directory or os.curdir) as entries:
+        for entry in entries:
+            empty = False
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.name)
+                elif entry.is_file():
+                    files.append((entry.name, entry.stat().st_size))
+            except OSError as e:
+                error_log(f"::skipping {entry.path} at {func_str(_list_directory)} exp: {e}")
+    return files, directories, empty and bool(relative)
+
+
+def walk_file_items(root: _FilePath, *, batch_size=SCAN_BATCH_SIZE,
+                    cache: ScanCache = None) -> Iterator[list[_FileItem]]:
+    """
+    Walks the tree under :param root: and yields `_FileItem`s batch by batch as directories get listed,
+    so that sending can start before the walk is over.
+    Names are '/' separated paths relative to root, an empty directory comes as it's name ending with '/'.
+    Symlinked directories are not followed
+    :param cache: listings of directories that did not change since last walk are taken from it instead,
+                  (sizes may be stale, see `ScanCache`) it is saved once the walk is over
+    """
+    root = os.fspath(root)
+    batch, stack = [], ['']
+    if cache is not None:
+        cache.begin()
+    try:
+        while stack:
+            relative = stack.pop()
+            directory = os.path.join(root, relative)
+            try:
+                if cache is None:
+                    listing = _list_directory(directory, relative)
+                else:
+                    mtime_ns = os.stat(directory).st_mtime_ns
+                    if (listing := cache.listing(relative, mtime_ns)) is None:
+                        listed_at = time.time_ns()
+                        listing = _list_directory(directory, relative)
+                        cache.store(relative, mtime_ns, listed_at, listing)
+            except OSError as e:
+                error_log(f"::listing failed at {func_str(walk_file_items)} exp: {e}")
+                continue
+            files, directories, empty = listing
+            prefix = relative + '/' if relative else ''
+            batch.extend(_FileItem(prefix + name, size, os.path.join(directory, name), seeked=0)
+                         for name, size in files)
+            stack.extend(prefix + name for name in directories)
+            if empty:
+                batch.append(_FileItem(relative + '/', 0, directory, seeked=0))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        if cache is not None:
+            cache.save(complete=not stack)  # stopped midway otherwise
+
+
+def make_file_items(paths: list[_FilePath]) -> list[_FileItem]:
+    return [item for batch in scan_file_items(paths) for item in batch]
+
+
+def make_file_groups(file_list: list[_FilePath], grouping_level, weights: list[float] = None) -> _FileGroup:
     """
 
     A factory function which
@@ -522,16 +1016,43 @@ def make_file_groups(file_list: list[_FilePath], grouping_level) -> _FileGroup:
     generates groups by calling func `_FileGroup::group`
 
     :param grouping_level: specifies grouping level
+    :param weights: relative throughput of each socket, if measured
     :returns _FileGroup:
     :param file_list:
     """
 
     file_items = make_file_items(paths=file_list)
-    grouped = _FileGroup(file_items, level=grouping_level)
+    grouped = _FileGroup(file_items, level=grouping_level, weights=weights)
     grouped.group()
     return grouped
 
 
+def stream_file_groups(batches: Iterable[list[_FileItem]], file_pools: list[PeerFilePool],
+                       weights: list[float] = None, *, seal=True) -> _FileGroup:
+    """
+    A factory function which
+    feeds files into given pools as they are scanned (pools can be sending meanwhile),
+    each pool being one part of the _FileGroup being built,
+    pools are sealed once the scan is over (or broke), unless :param seal: is False
+    in which case caller is responsible for sealing them
+
+    :param batches: file items batch by batch, usually from `scan_file_items`
+    :param file_pools: pools to feed files into, one per part
+    :param weights: relative throughput of each pool's socket, if measured
+    :returns _FileGroup:
+    """
+    grouped = _FileGroup([], level=len(file_pools), weights=weights)
+    try:
+        for batch in batches:
+            for index, files in grouped.add(batch).items():
+                file_pools[index].feed(files)
+    finally:
+        if seal:
+            for pool in file_pools:
+                pool.seal()
+    return grouped
+
+
 def make_sock_groups(sock_count, *, connect_ip: tuple[Any, ...] = None,
                      bind_ip: tuple[Any, ...] = None) -> _SockGroup:
     """
@@ -0,0 +1,212 @@
+"""
+Messages sent to and received from peers, kept in a sqlite database (in WAL mode) under `const.PATH_HISTORY`,
+so page can get a conversation back after a reload, a page at a time while it is scrolled up.
+
+Messages are only ever appended, `record` puts them in a queue and returns, a writer thread of it's own
+inserts whatever piled up in one transaction, so a burst of messages costs one commit and
+threads that receive or send messages never wait on disk.
+WAL lets pages be read on a separate connection while writer is at it.
+
+rowid is the order messages were recorded in, pages are read by (peer, rowid) index from a cursor
+(rowid of the oldest message page has), so a page costs the same however long a conversation gets
+
+content is indexed for search in an FTS5 table (`messages_text`, external content, it keeps only the index),
+a trigger adds every inserted message to it in the same transaction, a database from before the index
+existed is indexed once when it is opened. sqlite built without FTS5 still records, `search` finds nothing
+"""
+import sqlite3
+from collections import deque
+from typing import Optional
+
+from src.core import *
+
+PAGE_SIZE = 50
+SEARCH_PAGE_SIZE = 20
+FLUSH_LIMIT = 512  # messages inserted in one transaction at most
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    peer TEXT NOT NULL,
+    at REAL NOT NULL,
+    outgoing INTEGER NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_peer ON messages (peer, id);
+"""
+_TEXT_INDEX = """
+BEGIN;
+CREATE VIRTUAL TABLE messages_text USING fts5(
+    content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_indexed AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_text (rowid, content) VALUES (new.id, new.content);
+END;
+INSERT INTO messages_text (messages_text) VALUES ('rebuild');
+COMMIT;
+"""
+
+
+class MessageStore:
+    __annotations__ = {
+        'path': str,
+        'thread': threading.Thread,
+        'searchable': bool,
+    }
+    __slots__ = 'path', 'thread', 'searchable', '__pending', '__changed', '__closed', '__reader', '__read_lock'
+
+    def __init__(self, path):
+        self.path = path
+        self.__pending: deque[tuple[str, float, int, str]] = deque()
+        self.__changed = threading.Condition()
+        self.__closed = False
+        writer = self.__connect(check_same_thread=False)
+        self.searchable = self.__set_up(writer)  # before anyone reads
+        self.__reader = self.__connect(check_same_thread=False)
+        self.__read_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.__write_loop, args=(writer,), name="history-writer", daemon=True)
+        self.thread.start()
+
+    def __connect(self, **kwargs) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, **kwargs)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")  # durable enough in WAL mode, no fsync per commit
+        return connection
+
+    def __set_up(self, connection: sqlite3.Connection) -> bool:
+        """creates tables (and text index if it is not there yet), :returns: whether text index is there"""
+        connection.executescript(_SCHEMA)
+        exists = "SELECT 1 FROM sqlite_master WHERE name = 'messages_text'"
+        if connection.execute(exists).fetchone():
+            return True
+        try:
+            connection.executescript(_TEXT_INDEX)  # all of it or none of it
+        except sqlite3.OperationalError as e:  # no FTS5 in this sqlite
+            connection.rollback()
+            error_log(f"::messages can not be searched at {func_str(self.__set_up)} exp: {e}")
+            return False
+        return True
+
+    def record(self, peer_id, content: str, outgoing: bool):
+        with self.__changed:
+            if self.__closed:
+                return
+            self.__pending.append((peer_id, time.time(), int(outgoing), content))
+            self.__changed.notify()
+
+    def page(self, peer_id, before: Optional[int] = None, limit=PAGE_SIZE) -> tuple[list[dict], Optional[int]]:
+        """
+        :returns: upto :param limit: messages of :param peer_id: recorded before :param before: cursor (latest if None),
+        oldest first, and cursor for the page before this one (None once there are no older messages)
+        """
+        query = "SELECT id, at, outgoing, content FROM messages WHERE peer = ?"
+        arguments = [peer_id]
+        if before is not None:
+            query += " AND id < ?"
+            arguments.append(before)
+        query += " ORDER BY id DESC LIMIT ?"
+        arguments.append(limit + 1)  # one more tells whether there is a page before
+        with self.__read_lock:
+            rows = self.__reader.execute(query, arguments).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+        messages = [{'at': at, 'outgoing': bool(outgoing), 'content': content} for _, at, outgoing, content in rows]
+        return messages, rows[0][0] if more else None
+
+    def search(self, text, peer_id=None, page=0, limit=SEARCH_PAGE_SIZE) -> tuple[list[dict], bool]:
+        """
+        messages that have every word of :param text: (last one as a prefix, so it works while it is being typed),
+        best match first (bm25), of :param peer_id: only if given
+        :returns: :param page: th page of upto :param limit: matches, and whether there are more pages
+        """
+        match = _match_expression(text)
+        if not (self.searchable and match):
+            return [], False
+        query = ("SELECT m.id, m.peer, m.at, m.outgoing, m.content, "
+                 "snippet(messages_text, 0, '[', ']', '...', 16) "
+                 "FROM messages_text JOIN messages AS m ON m.id = messages_text.rowid "
+                 "WHERE messages_text MATCH ?")
+        arguments = [match]
+        if peer_id is not None:
+            query += " AND m.peer = ?"
+            arguments.append(peer_id)
+        query += " ORDER BY rank LIMIT ? OFFSET ?"
+        arguments += [limit + 1, page * limit]
+        with self.__read_lock:
+            rows = self.__reader.execute(query, arguments).fetchall()
+        results = [
+            {'id': _id, 'peer': peer, 'at': at, 'outgoing': bool(outgoing), 'content': content, 'snippet': snippet}
+            for _id, peer, at, outgoing, content, snippet in rows[:limit]
+        ]
+        return results, len(rows) > limit
+
+    def __write_loop(self, writer: sqlite3.Connection):
+        while True:
+            with self.__changed:
+                while not (self.__pending or self.__closed):
+                    self.__changed.wait()
+                rows = [self.__pending.popleft() for _ in range(min(len(self.__pending), FLUSH_LIMIT))]
+                closed = self.__closed and not self.__pending
+            if rows:
+                try:
+                    with writer:  # one transaction
+                        writer.executemany(
+                            "INSERT INTO messages (peer, at, outgoing, content) VALUES (?, ?, ?, ?)", rows)
+                except sqlite3.Error as e:
+                    error_log(f"::could not record {len(rows)} messages at {func_str(self.__write_loop)} exp: {e}")
+            if closed:
+                break
+        writer.close()
+
+    def close(self):
+        """writes what is still queued and closes database"""
+        with self.__changed:
+            self.__closed = True
+            self.__changed.notify()
+        self.thread.join()
+        with self.__read_lock:
+            self.__reader.close()
+
+    def __repr__(self):
+        return f"MessageStore({self.path}, queued={len(self.__pending)})"
+
+
+def _match_expression(text) -> str:
+    """user's text as an FTS5 query, every word quoted so nothing in it is taken for query syntax"""
+    words = ['"' + word.replace('"', '""') + '"' for word in str(text).split()]
+    if words:
+        words[-1] += '*'
+    return ' '.join(words)
+
+
+_store: Optional[MessageStore] = None
+_store_lock = threading.Lock()
+
+
+def message_store() -> MessageStore:
+    """store of this app, opened the first time it is asked for"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            os.makedirs(const.PATH_HISTORY, exist_ok=True)
+            _store = MessageStore(os.path.join(const.PATH_HISTORY, 'messages.db'))
+        return _store
+
+
+def record(peer_id, content, outgoing: bool):
+    """keeps a text message exchanged with :param peer_id:, anything that is not text is not a chat message"""
+    if not isinstance(content, str):
+        return
+    try:
+        message_store().record(peer_id, content, outgoing)
+    except (OSError, sqlite3.Error) as e:
+        error_log(f"::history not available at {func_str(record)} exp: {e}")
+
+
+def close_store():
+    global _store
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+            _store = None
@@ -0,0 +1,336 @@
+"""
+Reliable one-to-many file transfer over UDP multicast (ipv4),
+sender transmits every packet once to a multicast group and receivers ask for what they missed with NAKs,
+repairs go to the whole group so a packet lost by many receivers is sent again only once.
+
+Files are laid back to back into a single stream cut into `payload` sized packets,
+receivers write packets in place (files are pre-sized) so they can arrive in any order.
+Setting up (files, group, repair address) goes through the usual control connection, see
+`MulticastSender.handshake_content`
+
+packets (all big endian) :
+    DATA    sender -> group      type(B) transfer(I) seq(I) + payload
+    FIN     sender -> group      type(B) transfer(I) packet count(I)
+    READY   receiver -> sender   type(B) transfer(I)
+    DONE    receiver -> sender   type(B) transfer(I)
+    NAK     receiver -> sender   type(B) transfer(I) range count(H) + (first seq(I), count(I)) * range count
+"""
+import bisect
+from typing import Optional
+
+from src.core import *
+from src.avails.fileobject import _FileItem
+
+MULTICAST_GROUP = '239.255.80.67'
+MULTICAST_PAYLOAD = 1400  # stays under ethernet mtu with ip and udp headers
+MULTICAST_RATE = 40 * 1024 * 1024  # bytes per sec, sender paces at this rate
+MULTICAST_TTL = 1  # stays within the subnet
+RECEIVE_BUFFER = 4 * 1024 * 1024
+PACE_GRANULARITY = 0.001  # sec, sender gets ahead of pace by atmost this much before waiting
+NAK_INTERVAL = 0.05  # sec, between NAKs of a receiver
+MAX_NAK_RANGES = 128
+FIN_INTERVAL = 0.2  # sec
+JOIN_TIMEOUT = 5  # sec, sender waits this long for receivers to join the group
+IDLE_TIMEOUT = 10  # sec, either side gives up after hearing nothing for this long
+LINGER = 1  # sec, receiver stays after completion to answer FINs (in case it's DONE got lost)
+
+DATA, FIN, READY, DONE, NAK = range(1, 6)
+_DATA = struct.Struct('!BII')
+_FIN = struct.Struct('!BII')
+_CONTROL = struct.Struct('!BI')
+_NAK = struct.Struct('!BIH')
+_RANGE = struct.Struct('!II')
+
+
+class _StreamLayout:
+    """maps packets of the stream onto files, a packet can span the end of one file and start of the next"""
+    __slots__ = 'paths', 'sizes', 'starts', 'total', 'payload', 'packets', '__handles', '__mode'
+
+    def __init__(self, paths: list[str], sizes: list[int], payload, mode):
+        self.paths, self.sizes, self.payload = paths, sizes, payload
+        self.starts = [0]
+        for size in sizes:
+            self.starts.append(self.starts[-1] + size)
+        self.total = self.starts.pop()
+        self.packets = -(-self.total // payload)
+        self.__handles = {}
+        self.__mode = mode
+
+    def __spans(self, seq):
+        """yields (file index, offset in file, length) covered by packet `seq`"""
+        position = seq * self.payload
+        end = min(position + self.payload, self.total)
+        index = bisect.bisect_right(self.starts, position) - 1
+        while position < end:
+            while self.sizes[index] == 0 or position >= self.starts[index] + self.sizes[index]:
+                index += 1
+            offset = position - self.starts[index]
+            length = min(end - position, self.sizes[index] - offset)
+            yield index, offset, length
+            position += length
+
+    def __file(self, index):
+        if index not in self.__handles:
+            self.__handles[index] = open(self.paths[index], self.__mode)
+        return self.__handles[index]
+
+    def read(self, seq) -> bytes:
+        chunks = []
+        for index, offset, length in self.__spans(seq):
+            file = self.__file(index)
+            file.seek(offset)
+            chunks.append(file.read(length))
+        return b''.join(chunks)
+
+    def write(self, seq, data):
+        data = memoryview(data)
+        for index, offset, length in self.__spans(seq):
+            file = self.__file(index)
+            file.seek(offset)
+            file.write(data[:length])
+            data = data[length:]
+
+    def allocate(self):
+        """creates destination files at their full size, so packets can be written in any order"""
+        for index, size in enumerate(self.sizes):
+            self.__file(index).truncate(size)
+
+    def close(self):
+        for handle in self.__handles.values():
+            handle.close()
+        self.__handles.clear()
+
+
+def _free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('', 0))
+        return sock.getsockname()[1]
+
+
+class MulticastSender:
+    __slots__ = ('transfer_id', 'group', 'layout', 'controller', 'rate', '__data_sock', '__repair_sock', '__repairs',
+                 '__last_heard')
+
+    def __init__(self, file_items: list[_FileItem], *, transfer_id, interface, group=(MULTICAST_GROUP, None),
+                 payload=MULTICAST_PAYLOAD, rate=MULTICAST_RATE):
+        """
+        :param transfer_id: receivers drop packets of other transfers sharing the group
+        :param interface: ip of the interface to send from and to take NAKs on
+        :param group: multicast ip and port, a free port is picked if port is None
+        """
+        self.transfer_id = transfer_id
+        self.layout = _StreamLayout([x.path for x in file_items], [x.size for x in file_items], payload, 'rb')
+        self.controller = ThreadActuator(None)
+        self.rate = rate
+        self.__repair_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__repair_sock.bind((interface, 0))
+        self.group = group[0], group[1] or _free_udp_port()
+        self.__data_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__data_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, MULTICAST_TTL)
+        self.__data_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)  # peers on this host too
+        self.__data_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+        self.__repairs: set[int] = set()
+        self.__last_heard = time.monotonic()
+
+    def handshake_content(self, names: list[str]) -> dict:
+        return {
+            'transfer_id': self.transfer_id,
+            'group': self.group,
+            'repair': self.__repair_sock.getsockname()[:2],
+            'payload': self.layout.payload,
+            'files': list(zip(names, self.layout.sizes)),
+        }
+
+    def send(self, receivers: int) -> int:
+        """
+        Blocks until every receiver has all the packets, or none of them is heard for `IDLE_TIMEOUT`
+        :param receivers: number of receivers handshake was sent to
+        :returns number of receivers that completed:
+        """
+        ready, done = set(), set()
+        try:
+            self.__wait(lambda: len(ready) >= receivers, JOIN_TIMEOUT, ready, done)
+            pace, packet_time = time.monotonic(), self.layout.payload / self.rate
+            for seq in range(self.layout.packets):
+                if self.controller.to_stop:
+                    return len(done)
+                self.__send_data(seq)
+                pace += packet_time
+                if (delay := pace - time.monotonic()) > PACE_GRANULARITY:
+                    self.__serve(ready, done, delay)  # waiting out the pace, handling NAKs meanwhile
+            while len(done) < receivers and not self.controller.to_stop:
+                self.__data_sock.sendto(_FIN.pack(FIN, self.transfer_id, self.layout.packets), self.group)
+                if not self.__wait(lambda: len(done) >= receivers, FIN_INTERVAL, ready, done) and \
+                        not self.__heard_within(IDLE_TIMEOUT):
+                    break
+            return len(done)
+        finally:
+            self.layout.close()
+            self.__data_sock.close()
+            self.__repair_sock.close()
+
+    def __send_data(self, seq):
+        self.__data_sock.sendto(_DATA.pack(DATA, self.transfer_id, seq) + self.layout.read(seq), self.group)
+
+    def __heard_within(self, timeout):
+        return time.monotonic() - self.__last_heard < timeout
+
+    def __wait(self, condition, timeout, ready, done) -> bool:
+        deadline = time.monotonic() + timeout
+        while not condition() and (remaining := deadline - time.monotonic()) > 0:
+            self.__serve(ready, done, remaining)
+        return condition()
+
+    def __serve(self, ready, done, timeout):
+        """takes in control packets for upto `timeout` sec, and sends repairs asked for"""
+        reads, _, _ = select.select([self.__repair_sock, self.controller], [], [], timeout)
+        while self.__repair_sock in reads:
+            packet, address = self.__repair_sock.recvfrom(65535)
+            self.__on_control(packet, address, ready, done)
+            reads, _, _ = select.select([self.__repair_sock], [], [], 0)
+        for seq in sorted(self.__repairs):
+            self.__send_data(seq)
+        self.__repairs.clear()
+
+    def __on_control(self, packet, address, ready, done):
+        if len(packet) < _CONTROL.size:
+            return
+        kind, transfer_id = _CONTROL.unpack_from(packet)
+        if transfer_id != self.transfer_id:
+            return
+        self.__last_heard = time.monotonic()
+        if kind == READY:
+            ready.add(address)
+        elif kind == DONE:
+            ready.add(address)
+            done.add(address)
+        elif kind == NAK and len(packet) >= _NAK.size:
+            count = _NAK.unpack_from(packet)[2]
+            for i in range(min(count, (len(packet) - _NAK.size) // _RANGE.size)):
+                first, length = _RANGE.unpack_from(packet, _NAK.size + i * _RANGE.size)
+                self.__repairs.update(range(first, min(first + length, self.layout.packets)))
+
+    def break_loop(self):
+        self.controller.signal_stopping()
+
+    def __repr__(self):
+        return f"MulticastSender(group={self.group}, packets={self.layout.packets}, transfer={self.transfer_id})"
+
+
+class MulticastReceiver:
+    __slots__ = ('transfer_id', 'group', 'repair', 'layout', 'controller', '__have', '__received', '__sock',
+                 '__control_sock')
+
+    def __init__(self, content: dict, paths: list[str], *, interface, control_flag=None):
+        """
+        :param content: what sender's `MulticastSender.handshake_content` gave
+        :param paths: where each file of the transfer goes, in order
+        :param interface: ip of the interface to join the group on
+        """
+        self.transfer_id = content['transfer_id']
+        self.group = tuple(content['group'])
+        self.repair = tuple(content['repair'])
+        self.layout = _StreamLayout(paths, [size for _, size in content['files']], content['payload'], 'wb+')
+        self.controller = control_flag or ThreadActuator(None)
+        self.__have = bytearray(self.layout.packets)
+        self.__received = 0
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # many receivers can share the group port on one host
+        self.__sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            self.__sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.__sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+        self.__sock.bind(('', self.group[1]))
+        membership = socket.inet_aton(self.group[0]) + socket.inet_aton(interface)
+        self.__sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        # replies go from a port of it's own, sender tells receivers apart by it
+        self.__control_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__control_sock.bind((interface, 0))
+
+    @property
+    def complete(self):
+        return self.__received == self.layout.packets
+
+    def receive(self) -> bool:
+        """
+        Blocks until every packet is received (and written) or sender is not heard for `IDLE_TIMEOUT`
+        :returns True if all files are received:
+        """
+        try:
+            self.layout.allocate()
+            self.__reply(READY)
+            fin_seen, highest, last_nak, last_heard = False, -1, 0.0, time.monotonic()
+            while not self.complete:
+                reads, _, _ = select.select([self.__sock, self.controller], [], [], NAK_INTERVAL)
+                if self.controller.to_stop:
+                    return False
+                now = time.monotonic()
+                while self.__sock in reads:
+                    kind, value = self.__on_packet(self.__sock.recv(65535))
+                    if kind == DATA:
+                        highest = max(highest, value)
+                    fin_seen = fin_seen or kind == FIN
+                    if kind:
+                        last_heard = now
+                    reads, _, _ = select.select([self.__sock], [], [], 0)
+                if self.complete:
+                    break
+                if now - last_heard > IDLE_TIMEOUT:
+                    return False
+                if highest < 0 and not fin_seen:
+                    self.__reply(READY)  # sender may not have got it yet
+                elif now - last_nak >= NAK_INTERVAL:
+                    self.__send_nak(self.layout.packets if fin_seen else highest)
+                    last_nak = now
+            self.__linger()
+            return True
+        finally:
+            self.layout.close()
+            self.__sock.close()
+            self.__control_sock.close()
+
+    def __on_packet(self, packet) -> tuple[Optional[int], int]:
+        if len(packet) < _DATA.size:
+            return None, 0
+        kind, transfer_id, value = _DATA.unpack_from(packet)
+        if transfer_id != self.transfer_id:
+            return None, 0
+        if kind == DATA and value < self.layout.packets and not self.__have[value]:
+            self.layout.write(value, memoryview(packet)[_DATA.size:])
+            self.__have[value] = 1
+            self.__received += 1
+        return kind, value
+
+    def missing_ranges(self, upto) -> list[tuple[int, int]]:
+        """ranges of packets not received, below `upto`, at most `MAX_NAK_RANGES` of them"""
+        ranges, position = [], self.__have.find(0)
+        while 0 <= position < upto and len(ranges) < MAX_NAK_RANGES:
+            end = self.__have.find(1, position, upto)
+            end = upto if end < 0 else end
+            ranges.append((position, end - position))
+            position = self.__have.find(0, end)
+        return ranges
+
+    def __send_nak(self, upto):
+        if not (ranges := self.missing_ranges(upto)):
+            return
+        packet = _NAK.pack(NAK, self.transfer_id, len(ranges)) + b''.join(_RANGE.pack(*x) for x in ranges)
+        self.__control_sock.sendto(packet, self.repair)
+
+    def __reply(self, kind):
+        self.__control_sock.sendto(_CONTROL.pack(kind, self.transfer_id), self.repair)
+
+    def __linger(self):
+        self.__reply(DONE)
+        while True:
+            reads, _, _ = select.select([self.__sock, self.controller], [], [], LINGER)
+            if self.__sock not in reads or self.controller.to_stop:
+                return
+            if self.__on_packet(self.__sock.recv(65535))[0] == FIN:
+                self.__reply(DONE)
+
+    def break_loop(self):
+        self.controller.signal_stopping()
+
+    def __repr__(self):
+        return f"MulticastReceiver(group={self.group}, received={self.__received}/{self.layout.packets})"
@@ -0,0 +1,104 @@
+"""
+This module keeps per peer history of file transfers,
+used to choose how many sockets(streams) a transfer to that peer should use,
+and whether compressing is worth it on the link to that peer
+"""
+import threading
+
+MAX_STREAMS = 8
+SMALL_TRANSFER = 16 * 1024 * 1024  # below this, setting up more sockets costs more than they save
+HIGH_RTT = 0.005  # sec, above this a single stream's window starts limiting throughput
+SMALL_FILE = 1024 * 1024
+MANY_FILES = 1000
+SMOOTHING = 0.5  # weight given to the latest observation
+
+
+class _PeerHistory:
+    __slots__ = 'rtt', 'rates'
+    __annotations__ = {
+        'rtt': float,
+        'rates': dict,
+    }
+
+    def __init__(self):
+        self.rtt = None
+        self.rates: dict[int, float] = {}  # stream count: aggregate bytes per sec
+
+    def best_stream_count(self):
+        return max(self.rates, key=self.rates.get) if self.rates else None
+
+    def __repr__(self):
+        return f"_PeerHistory(rtt={self.rtt}, rates={self.rates})"
+
+
+class PeerStats:
+    __slots__ = '__history', '__lock'
+
+    def __init__(self):
+        self.__history: dict[str, _PeerHistory] = {}
+        self.__lock = threading.Lock()
+
+    def __get(self, peer_id) -> _PeerHistory:
+        return self.__history.setdefault(peer_id, _PeerHistory())
+
+    def record_rtt(self, peer_id, rtt):
+        if rtt is None:
+            return
+        with self.__lock:
+            history = self.__get(peer_id)
+            history.rtt = rtt if history.rtt is None else history.rtt + SMOOTHING * (rtt - history.rtt)
+
+    def record_rate(self, peer_id, streams, rate):
+        """
+        :param peer_id:
+        :param streams: number of sockets used while measuring
+        :param rate: aggregate bytes per second observed
+        """
+        if streams <= 0 or rate <= 0:
+            return
+        with self.__lock:
+            rates = self.__get(peer_id).rates
+            previous = rates.get(streams)
+            rates[streams] = rate if previous is None else previous + SMOOTHING * (rate - previous)
+
+    def rate(self, peer_id, streams):
+        with self.__lock:
+            history = self.__history.get(peer_id)
+            return history.rates.get(streams) if history else None
+
+    def link_rate(self, peer_id):
+        """best aggregate bytes per second seen with this peer, None if nothing is measured yet"""
+        with self.__lock:
+            history = self.__history.get(peer_id)
+            return max(history.rates.values(), default=None) if history else None
+
+    def choose_stream_count(self, peer_id, total_size, file_count) -> int:
+        """
+        Chooses number of sockets for a transfer,
+        best stream count seen so far with this peer if there is any history,
+        else a guess from round trip time and file sizes, later corrected while the transfer runs
+
+        :param peer_id: peer to which files are being sent
+        :param total_size: (estimated) bytes to be sent
+        :param file_count: number of files to be sent
+        """
+        upper = max(1, min(MAX_STREAMS, file_count))
+        if total_size < SMALL_TRANSFER:
+            return 1
+        with self.__lock:
+            history = self.__history.get(peer_id) or _PeerHistory()
+            best = history.best_stream_count()
+            rtt = history.rtt
+        if best:
+            return min(best, upper)
+        streams = 4 if rtt is not None and rtt > HIGH_RTT else 2
+        if file_count >= MANY_FILES and total_size / file_count < SMALL_FILE:
+            streams += 1  # per file round trips get hidden behind other streams
+        return min(streams, upper)
+
+    def __repr__(self):
+        with self.__lock:
+            return f"PeerStats({self.__history})"
+
+
+peer_stats = PeerStats()
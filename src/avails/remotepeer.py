@@ -1,6 +1,6 @@
 from src.core import *
 import pickle
-from typing import Tuple
+from typing import Optional, Tuple
 
 from src.avails.constants import RP_FLAG  # control flag for this class
 from itertools import count
@@ -18,12 +18,13 @@ class RemotePeer:
         'callbacks': int,
         'req_uri': Tuple[str, int],
         'id': str,
-        'file_count': int
+        'file_count': int,
+        'host_id': Optional[str]
     }
-    __slots__ = 'username', 'uri', 'status', 'callbacks', 'req_uri', 'id', 'file_count'
+    __slots__ = 'username', 'uri', 'status', 'callbacks', 'req_uri', 'id', 'file_count', 'host_id'
 
     def __init__(self, username='admin', ip='localhost', port=8088, report=35896,
-                 status=0):
+                 status=0, host_id=None):
         self.username = username
         self.uri = (ip, port)
         self.status = status
@@ -31,13 +32,41 @@ class RemotePeer:
         self.req_uri = (ip, report)
         self.id = f'{ip}{port}'
         self.file_count = count()
+        self.host_id = host_id or None
+
+    def __getstate__(self):
+        """
+        pickled form peers exchange, only slots every version has, so peers from before `host_id`
+        can still load it (they set every slot they are given and fail on one they do not have),
+        host id rides in `callbacks`, which no version reads
+        """
+        state = {name: getattr(self, name) for name in self.__slots__ if name != 'host_id'}
+        state['callbacks'] = self.host_id
+        return None, state
+
+    def __setstate__(self, state):
+        """
+        takes what `__getstate__` makes, and what peers from before `host_id` send (host id is None then),
+        slots this version does not have are left out
+        """
+        _, slots = state if isinstance(state, tuple) else (None, state)
+        for name in self.__slots__:
+            if name in slots:
+                setattr(self, name, slots[name])
+        host_id = slots.get('host_id', slots.get('callbacks'))
+        self.host_id = host_id if isinstance(host_id, str) and host_id else None
+        self.callbacks = 0
+        if not hasattr(self, 'file_count'):
+            self.file_count = count()
 
     def send_serialized(self, _to_send: connect.Socket):
-        serialized = pickle.dumps(self)
-        _to_send.send(struct.pack('!I', len(serialized)))
-        _to_send.send(serialized)
+        connect.send_buffers(_to_send, self.serialized_frame())
         return True
 
+    def serialized_frame(self) -> tuple[bytes, bytes]:
+        serialized = pickle.dumps(self)
+        return struct.pack('!I', len(serialized)), serialized
+
     def __repr__(self):
         return f'RemotePeer({self.username}, {self.uri[0]}, {self.uri[1]}, {self.req_uri[1]}, {self.status})'
 
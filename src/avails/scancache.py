@@ -0,0 +1,159 @@
+"""
+Remembers listings of directories that were sent, so sending the same tree again does not walk all of it.
+A directory's listing (files with their sizes, sub directories) is reused as long as the directory's mtime
+did not change, which costs one stat per directory instead of a listing and a stat per file.
+
+Adding, removing or renaming an entry changes it's parent's mtime, editing a file in place does not,
+so sizes that come out of the cache can be stale, senders stat a file again right before sending it.
+
+A listing taken within `RACY_WINDOW` of the directory's mtime is not trusted
+(entries added later in that same mtime tick would not change the mtime again).
+
+sha256 of files (relative path) are kept too, for telling whether a file changed (see `dirsync.diff`),
+a digest is reused as long as file's size, mtime and inode are what they were when it was hashed,
+one hashed within `RACY_WINDOW` of the file's mtime is not trusted, same as listings.
+
+cache of a root is pickled under `const.PATH_CACHE` once a walk over it is over (see `begin`, `save`),
+directories (and digests) that did not show up in walks since last save are dropped from it,
+only after complete walks and once no other walk over the root is going on.
+"""
+import hashlib
+import pickle
+from typing import Optional
+
+from src.core import *
+
+type Listing = tuple[list[tuple[str, int]], list[str], bool]  # (files as (name, size), sub directories, empty)
+type Digest = tuple[int, int, int, int, bytes]  # (size, mtime_ns, inode, hashed at (ns), sha256)
+
+CACHE_VERSION = 2
+RACY_WINDOW = 2 * 10 ** 9  # ns
+
+
+class ScanCache:
+    __annotations__ = {
+        'root': str,
+        'path': str,
+    }
+    __slots__ = ('root', 'path', '__directories', '__digests', '__visited', '__hashed', '__dirty', '__walks',
+                 '__complete', '__lock', '__save_lock')
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        name = hashlib.sha256(self.root.encode(const.FORMAT)).hexdigest()[:32]
+        self.path = os.path.join(const.PATH_CACHE, f"{name}.scan")
+        # relative path : (mtime_ns, listed at (ns), listing)
+        self.__directories: dict[str, tuple[int, int, Listing]]
+        self.__digests: dict[str, Digest]  # relative path of a file : what it was when hashed
+        self.__directories, self.__digests = self.__load()
+        self.__visited = set()
+        self.__hashed = set()
+        self.__dirty = False
+        self.__walks = 0  # walks begun and not saved yet
+        self.__complete = True  # whether every walk since last save went till the end
+        self.__lock = threading.Lock()
+        self.__save_lock = threading.Lock()  # one write at a time, each of the latest state
+
+    def __load(self):
+        try:
+            with open(self.path, 'rb') as file:
+                version, root, *tables = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError, TypeError) as e:
+            if not isinstance(e, FileNotFoundError):
+                error_log(f"::dropping scan cache of {self.root} at {func_str(self.__load)} exp: {e}")
+            return {}, {}
+        return tables if version == CACHE_VERSION and root == self.root else ({}, {})
+
+    def begin(self):
+        """a walk over root starts, it has to end with `save`"""
+        with self.__lock:
+            self.__walks += 1
+
+    def listing(self, relative, mtime_ns) -> Optional[Listing]:
+        """:returns: cached listing of :param relative: directory if it is still valid for :param mtime_ns:"""
+        with self.__lock:
+            self.__visited.add(relative)
+            cached = self.__directories.get(relative)
+        if cached is None or cached[0] != mtime_ns or cached[1] - mtime_ns < RACY_WINDOW:
+            return None
+        return cached[2]
+
+    def store(self, relative, mtime_ns, listed_at, listing: Listing):
+        """:param mtime_ns: has to be taken before listing the directory, or a change in between goes unnoticed"""
+        with self.__lock:
+            self.__visited.add(relative)
+            self.__directories[relative] = mtime_ns, listed_at, listing
+            self.__dirty = True
+
+    def digest(self, relative, size, mtime_ns, inode) -> Optional[bytes]:
+        """:returns: sha256 of :param relative: file if it was hashed as it is now (size, mtime, inode)"""
+        with self.__lock:
+            self.__hashed.add(relative)
+            cached = self.__digests.get(relative)
+        if cached is None or cached[:3] != (size, mtime_ns, inode) or cached[3] - mtime_ns < RACY_WINDOW:
+            return None
+        return cached[4]
+
+    def store_digest(self, relative, size, mtime_ns, inode, hashed_at, digest: bytes):
+        """:param size: :param mtime_ns: :param inode: have to be taken before hashing, like for `store`"""
+        with self.__lock:
+            self.__hashed.add(relative)
+            self.__digests[relative] = size, mtime_ns, inode, hashed_at, digest
+            self.__dirty = True
+
+    def save(self, complete=True):
+        """
+        ends a walk begun with `begin`, writes cache next to the old one and swaps it in,
+        walks going on over same root at the same time all add to this one cache, so nothing a walk found is lost
+        :param complete: whether walk went till the end, what a cut short walk did not visit is not dropped
+        """
+        with self.__save_lock:
+            with self.__lock:
+                self.__walks = max(self.__walks - 1, 0)
+                self.__complete = self.__complete and complete
+                if not self.__walks:
+                    if self.__complete:
+                        self.__dirty |= self.__prune()
+                    self.__visited, self.__hashed, self.__complete = set(), set(), True
+                if not self.__dirty:
+                    return
+                directories, digests, self.__dirty = dict(self.__directories), dict(self.__digests), False
+            try:
+                os.makedirs(const.PATH_CACHE, exist_ok=True)
+                with open(self.path + '.new', 'wb') as file:
+                    pickle.dump((CACHE_VERSION, self.root, directories, digests), file,
+                                protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(self.path + '.new', self.path)
+            except OSError as e:
+                error_log(f"::could not save scan cache of {self.root} at {func_str(self.save)} exp: {e}")
+
+    def __prune(self) -> bool:
+        """
+        drops what walks since last save did not come across, a table no walk used (a plain send does not hash,
+        a sync does not list) is left as it is. :returns: whether anything was dropped
+        """
+        before = len(self.__directories), len(self.__digests)
+        if self.__visited:
+            self.__directories = {x: y for x, y in self.__directories.items() if x in self.__visited}
+        if self.__hashed:
+            self.__digests = {x: y for x, y in self.__digests.items() if x in self.__hashed}
+        return before != (len(self.__directories), len(self.__digests))
+
+    def __len__(self):
+        return len(self.__directories)
+
+    def __repr__(self):
+        return f"ScanCache({self.root}, directories={len(self.__directories)}, digests={len(self.__digests)})"
+
+
+_caches: dict[str, ScanCache] = {}
+_caches_lock = threading.Lock()
+
+
+def scan_cache_for(root) -> ScanCache:
+    """same cache object for a root as long as the app runs, loaded from disk the first time"""
+    root = os.path.abspath(root)
+    with _caches_lock:
+        if root not in _caches:
+            _caches[root] = ScanCache(root)
+        return _caches[root]
@@ -0,0 +1,323 @@
+"""
+Downloading a file from every peer that holds it (or part of it) at once.
+A file is identified by hash of it's `Manifest` (size, piece size and sha256 of every piece), so same content
+shared under different names is the same file.
+Pieces are picked rarest first among the peers that have them, once every missing piece is asked for
+(endgame) remaining ones are asked from more than one peer and whichever comes first is kept.
+Every piece is verified against the manifest before it is written in place
+
+piece connection (all big endian) :
+    downloader -> holder    index(I)                        asks for a piece, upto `PIPELINE` kept outstanding
+    holder -> downloader    index(I) length(I) + data       length 0 if holder does not have it
+"""
+import base64
+import hashlib
+import random
+from collections import Counter, deque
+from typing import Optional
+
+from src.core import *
+
+PIECE_MIN = 256 * 1024
+MAX_PIECES = 4096  # piece size grows so that a manifest stays small enough for a control message
+PIPELINE = 4  # requests kept outstanding per peer, hides the round trip between pieces
+PIECE_TIMEOUT = 30  # sec
+MAX_STRIKES = 3  # pieces failing verification, after which a peer is not asked anymore
+
+_PIECE = struct.Struct('!II')
+_REQUEST = struct.Struct('!I')
+
+
+def piece_size_for(size) -> int:
+    piece_size = PIECE_MIN
+    while piece_size * MAX_PIECES < size:
+        piece_size *= 2
+    return piece_size
+
+
+class Manifest:
+    __slots__ = 'name', 'size', 'piece_size', 'hashes', 'content_id'
+    __annotations__ = {
+        'name': str,
+        'size': int,
+        'piece_size': int,
+        'hashes': list,
+        'content_id': str,
+    }
+
+    def __init__(self, name, size, piece_size, hashes: list[bytes]):
+        self.name = name
+        self.size = size
+        self.piece_size = piece_size
+        self.hashes = hashes
+        digest = hashlib.sha256(struct.pack('!QI', size, piece_size))
+        for piece_hash in hashes:
+            digest.update(piece_hash)
+        self.content_id = digest.hexdigest()
+
+    @classmethod
+    def from_file(cls, path, name=None) -> 'Manifest':
+        size = os.path.getsize(path)
+        piece_size = piece_size_for(size)
+        hashes = []
+        with open(path, 'rb') as file:
+            while piece := file.read(piece_size):
+                hashes.append(hashlib.sha256(piece).digest())
+        return cls(name or os.path.basename(path), size, piece_size, hashes)
+
+    @classmethod
+    def from_dict(cls, content: dict, content_id) -> Optional['Manifest']:
+        """:returns None if content does not hash to :param content_id: or is malformed:"""
+        try:
+            raw = bytes.fromhex(content['hashes'])
+            hashes = [raw[i:i + 32] for i in range(0, len(raw), 32)]
+            manifest = cls(content['name'], int(content['size']), int(content['piece_size']), hashes)
+        except (KeyError, ValueError, TypeError):
+            return None
+        if manifest.content_id != content_id or len(hashes) != manifest.piece_count:
+            return None
+        return manifest
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'size': self.size, 'piece_size': self.piece_size,
+                'hashes': b''.join(self.hashes).hex()}
+
+    @property
+    def piece_count(self):
+        return -(-self.size // self.piece_size)
+
+    def piece_length(self, index):
+        return min(self.piece_size, self.size - index * self.piece_size)
+
+    def verify(self, index, data) -> bool:
+        return len(data) == self.piece_length(index) and hashlib.sha256(data).digest() == self.hashes[index]
+
+    def __repr__(self):
+        return f"Manifest({self.name[:20]}, size={self.size}, pieces={self.piece_count}, id={self.content_id[:12]})"
+
+
+def pack_bits(have) -> str:
+    packed = bytearray((len(have) + 7) // 8)
+    for index, present in enumerate(have):
+        if present:
+            packed[index >> 3] |= 0x80 >> (index & 7)
+    return base64.b64encode(packed).decode()
+
+
+def unpack_bits(packed: str, count) -> bytearray:
+    raw = base64.b64decode(packed)
+    return bytearray((raw[i >> 3] >> (7 - (i & 7))) & 1 if i >> 3 < len(raw) else 0 for i in range(count))
+
+
+def _recv_exact(sock, size) -> Optional[bytearray]:
+    buffer = bytearray(size)
+    view, received = memoryview(buffer), 0
+    while received < size:
+        got = sock.recv_into(view[received:])
+        if not got:
+            return None
+        received += got
+    return buffer
+
+
+class SwarmDownload:
+    """
+    One file being pulled from many peers, a thread per peer (source) keeps `PIPELINE` requests outstanding.
+    Can be kept in `FileDict` like a file pool, it has an `id` and `break_loop`
+    """
+    __slots__ = ('manifest', 'path', 'id', 'controller', 'have', '__in_flight', '__availability', '__sources',
+                 '__strikes', '__cond', '__file', '__remaining', '__live')
+
+    def __init__(self, manifest: Manifest, path, *, _id):
+        self.manifest = manifest
+        self.path = path
+        self.id = _id
+        self.controller = ThreadActuator(None)
+        self.have = bytearray(manifest.piece_count)  # also served to others while downloading
+        self.__remaining = manifest.piece_count
+        self.__in_flight: Counter[int] = Counter()  # piece: number of sources asked
+        self.__availability = [0] * manifest.piece_count
+        self.__sources: set[str] = set()
+        self.__live = 0  # sources still being pulled from
+        self.__strikes: Counter[str] = Counter()
+        self.__cond = threading.Condition()
+        self.__file = open(path, 'wb+')
+        self.__file.truncate(manifest.size)
+
+    @property
+    def complete(self):
+        return self.__remaining == 0
+
+    def add_source(self, key, have: bytearray, sock: socket.socket) -> bool:
+        """starts pulling pieces from one more peer, :param have: pieces that peer said it has"""
+        with self.__cond:
+            if key in self.__sources or self.complete or self.controller.to_stop:
+                return False
+            for index, present in enumerate(have):
+                self.__availability[index] += present
+            self.__sources.add(key)
+            self.__live += 1
+        threading.Thread(target=self.__source_loop, args=(key, have, sock), name='peer-connect-swarm',
+                         daemon=True).start()
+        return True
+
+    @property
+    def sources(self):
+        """number of peers pieces are being pulled from now"""
+        return self.__live
+
+    def wait(self, timeout=None) -> bool:
+        """
+        Blocks until the file is complete or :param timeout: passes
+        :returns True if complete:
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.__cond:
+            while not (self.complete or self.controller.to_stop):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self.__cond.wait(remaining)
+            return self.complete
+
+    def __pick(self, source_have, outstanding) -> Optional[int]:
+        """rarest missing piece this source has, in endgame a piece already asked from others (least asked)"""
+        best, best_key = None, None
+        for index in range(len(self.have)):
+            if self.have[index] or not source_have[index] or self.__in_flight[index]:
+                continue
+            key = (self.__availability[index], random.random())
+            if best_key is None or key < best_key:
+                best, best_key = index, key
+        if best is None and sum(1 for x in self.__in_flight.values() if x) >= self.__remaining:
+            candidates = [index for index, asked in self.__in_flight.items()
+                          if asked and not self.have[index] and source_have[index] and index not in outstanding]
+            best = min(candidates, key=lambda x: self.__in_flight[x], default=None)
+        if best is not None:
+            self.__in_flight[best] += 1
+        return best
+
+    def __release(self, indexes):
+        for index in indexes:
+            self.__in_flight[index] -= 1
+            if self.__in_flight[index] <= 0:
+                del self.__in_flight[index]
+        self.__cond.notify_all()
+
+    def __source_loop(self, key, source_have, sock: socket.socket):
+        outstanding: deque[int] = deque()
+        try:
+            with sock:
+                sock.settimeout(PIECE_TIMEOUT)
+                while not (self.complete or self.controller.to_stop) and self.__strikes[key] < MAX_STRIKES:
+                    requests = []
+                    with self.__cond:
+                        while len(outstanding) < PIPELINE and (index := self.__pick(source_have, outstanding)) is not None:
+                            outstanding.append(index)
+                            requests.append(_REQUEST.pack(index))
+                        if not outstanding:
+                            if not any(not self.have[i] and source_have[i] for i in range(len(self.have))):
+                                return  # nothing left this source can give
+                            self.__cond.wait(1)  # pieces asked from others may fail and come back
+                            continue
+                    if requests:  # written outside the lock, a slow source holds up only itself
+                        sock.sendall(b''.join(requests))
+                    header = _recv_exact(sock, _PIECE.size)
+                    if header is None:
+                        return
+                    index, length = _PIECE.unpack(header)
+                    expected = outstanding[0]
+                    if index != expected or length not in (0, self.manifest.piece_length(expected)):
+                        error_log(f"::swarm source {key} answered piece {index} ({length} bytes) for {expected}"
+                                  f" at {func_str(SwarmDownload.__source_loop)}")
+                        return
+                    data = _recv_exact(sock, length) if length else b''
+                    if data is None:
+                        return
+                    outstanding.popleft()
+                    with self.__cond:
+                        self.__release([index])
+                        if length == 0:
+                            if source_have[index]:  # source no more has it (or never did)
+                                source_have[index] = 0
+                                self.__availability[index] -= 1
+                            continue
+                    self.__store(key, index, data)
+        except OSError as e:
+            error_log(f"::swarm source {key} failed at {func_str(SwarmDownload.__source_loop)} exp: {e}")
+        finally:
+            with self.__cond:
+                self.__release(outstanding)
+                for index, present in enumerate(source_have):
+                    self.__availability[index] -= present
+                self.__live -= 1
+                self.__cond.notify_all()
+
+    def __store(self, key, index, data):
+        if self.have[index]:
+            return  # endgame duplicate
+        if not self.manifest.verify(index, data):
+            with self.__cond:
+                self.__strikes[key] += 1
+            error_log(f"::piece {index} from {key} failed verification at {func_str(SwarmDownload.__store)}")
+            return
+        with self.__cond:
+            if self.have[index] or self.__file.closed:  # closed, download was given up
+                return
+            self.__file.seek(index * self.manifest.piece_size)
+            self.__file.write(data)
+            self.have[index] = 1
+            self.__remaining -= 1
+            if self.complete:
+                self.__file.close()
+            self.__cond.notify_all()
+
+    def read_piece(self, index) -> Optional[bytes]:
+        """for serving this download's pieces to others while it is still going on"""
+        with self.__cond:
+            if not self.have[index] or self.__file.closed:
+                return None
+            self.__file.seek(index * self.manifest.piece_size)
+            return self.__file.read(self.manifest.piece_length(index))
+
+    def close(self):
+        with self.__cond:
+            if not self.__file.closed:
+                self.__file.close()
+
+    def break_loop(self):
+        self.controller.signal_stopping()
+        with self.__cond:
+            self.__cond.notify_all()
+
+    def __repr__(self):
+        return f"SwarmDownload({self.manifest}, have={sum(self.have)}/{len(self.have)}, sources={len(self.__sources)})"
+
+
+def serve_pieces(sock: socket.socket, manifest: Manifest, read_piece):
+    """
+    Holder side of a piece connection, answers piece requests until downloader closes the connection
+    :param read_piece: gives piece data for an index, None if it is not available
+    """
+    with sock:
+        sock.settimeout(PIECE_TIMEOUT)
+        while raw := _recv_exact(sock, _REQUEST.size):
+            index = _REQUEST.unpack(raw)[0]
+            data = read_piece(index) if index < manifest.piece_count else None
+            if data is None:
+                sock.sendall(_PIECE.pack(index, 0))
+                continue
+            sock.sendall(_PIECE.pack(index, len(data)))
+            sock.sendall(data)
+
+
+def file_piece_reader(path, manifest: Manifest):
+    """read_piece for a complete file on disk, see `serve_pieces`"""
+    file = open(path, 'rb')
+
+    def read_piece(index):
+        file.seek(index * manifest.piece_size)
+        data = file.read(manifest.piece_length(index))
+        return data if len(data) == manifest.piece_length(index) else None
+
+    return read_piece, file.close
@@ -1,7 +1,9 @@
+import zlib
 from collections import defaultdict
 
 from src.core import *
-from typing import Union
+from typing import Optional, Union
+from src.avails import codec
 from src.avails.constants import PEER_TEXT_FLAG, DATA_WEAVER_FLAG
 from src.managers.thread_manager import thread_handler, TEXT
 
@@ -9,7 +11,75 @@ p_controller = ThreadActuator(None, control_flag=PEER_TEXT_FLAG)
 d_controller = ThreadActuator(None, control_flag=DATA_WEAVER_FLAG)
 thread_handler.register_control(p_controller, which=TEXT)
 thread_handler.register_control(d_controller, which=TEXT)
-TIMEOUT = 4
+TIMEOUT = 4  # sec, of no data arriving before a read gives up
+COMPRESS_THRESHOLD = 32 * 1024  # bytes, smaller texts always go raw
+MAX_INFLATED = 256 * 1024 * 1024  # bytes, largest text a compressed frame is allowed to claim
+MAX_FRAME = 64 * 1024 * 1024  # bytes, longest frame read, a longer length header is taken for a broken stream
+COMPRESSED = 1 << 31  # flag in length header
+_INFLATED_SIZE = struct.Struct('!I')
+
+
+def inflate_bounded(data: bytes, size) -> Optional[bytes]:
+    """
+    inflates :param data: that claims to be :param size: bytes, never producing more than that,
+    :returns: None if it claims more than `MAX_INFLATED` or does not inflate to exactly it's claim
+    """
+    if size > MAX_INFLATED:
+        return None
+    decompressor = zlib.decompressobj()
+    try:
+        inflated = decompressor.decompress(data, size + 1)  # one more, to know it was more
+    except zlib.error:
+        return None
+    if len(inflated) != size or not decompressor.eof:
+        return None
+    return inflated
+
+
+def _wait_readable(sock: socket.socket, controller: ThreadActuator, timeout) -> bool:
+    """:returns: True once :param sock: has something to read, False after :param timeout: or on controller's stop"""
+    deadline = time.monotonic() + timeout
+    while not controller.to_stop:
+        readable, _, _ = select.select([sock, controller], [], [], max(deadline - time.monotonic(), 0))
+        if sock in readable:
+            return True
+        if not readable:
+            return False
+    return False
+
+
+def recv_exact(sock: socket.socket, size, controller: ThreadActuator, timeout=TIMEOUT) -> Optional[bytearray]:
+    """
+    Reads exactly :param size: bytes into one buffer (recv_into, as much as available at a time),
+    waits on the socket (and :param controller:) only when nothing is there to read yet,
+    so a message that already arrived costs no select and a slow peer costs no spinning.
+    Socket's blocking mode is never touched (other threads send on it meanwhile), reads that should not wait
+    use MSG_DONTWAIT, where that is not there (or socket has a timeout) every read waits for data first
+
+    :returns: None once controller says stop, when nothing arrives for :param timeout: secs
+              or if peer closes the connection part way through
+    :raises ConnectionResetError: if peer closed the connection before anything was read
+    """
+    dont_wait = getattr(socket, 'MSG_DONTWAIT', 0) if sock.gettimeout() is None else 0
+    buffer = bytearray(size)
+    view, received = memoryview(buffer), 0
+    while received < size:
+        if controller.to_stop is True:
+            return None
+        if not dont_wait and not _wait_readable(sock, controller, timeout):
+            return None
+        try:
+            got = sock.recv_into(view[received:], 0, dont_wait)
+        except BlockingIOError:
+            if not _wait_readable(sock, controller, timeout):
+                return None
+            continue
+        if not got:
+            if received == 0:
+                raise ConnectionResetError("peer closed the connection")
+            return None
+        received += got
+    return buffer
 
 
 class SimplePeerText:
@@ -31,14 +101,13 @@ class SimplePeerText:
         'controller': ThreadActuator,
         'id': str,
     }
-    __slots__ = 'raw_text', 'text_len_encoded', 'sock', 'id', 'chunk_size', 'controller',
+    __slots__ = 'raw_text', 'text_len_encoded', 'sock', 'id', 'controller',
 
-    def __init__(self, refer_sock, text=b'', *, chunk_size=512, controller=p_controller):
+    def __init__(self, refer_sock, text=b'', *, controller=p_controller):
         self.raw_text = text
         self.text_len_encoded = struct.pack('!I', len(self.raw_text))
         self.controller = controller
         self.sock = refer_sock
-        self.chunk_size = chunk_size
 
     def send(self, *, require_confirmation=True) -> bool:
         """
@@ -52,12 +121,24 @@ class SimplePeerText:
         - bool: True if the text was successfully sent; False otherwise.
 
         """
-        self.sock.send(self.text_len_encoded)
-        self.sock.sendall(self.raw_text)
+        connect.send_buffers(self.sock, self.frame())
         # if require_confirmation:
         #     return self.__recv_header()
         return True
 
+    def frame(self) -> tuple[bytes, ...]:
+        """
+        buffers the text goes as, to cork it with other frames in one `connect.send_buffers`,
+        a text of atleast `COMPRESS_THRESHOLD` is deflated if other end reads compressed texts (see `codec`)
+        and it gets smaller, then it's length has `COMPRESSED` flag set and inflated size comes before it
+        """
+        if len(self.raw_text) >= COMPRESS_THRESHOLD and codec.reads_compressed(self.sock):
+            deflated = zlib.compress(self.raw_text)
+            if len(deflated) + _INFLATED_SIZE.size < len(self.raw_text):
+                length = (len(deflated) + _INFLATED_SIZE.size) | COMPRESSED
+                return struct.pack('!I', length), _INFLATED_SIZE.pack(len(self.raw_text)), deflated
+        return self.text_len_encoded, self.raw_text
+
     def receive(self, cmp_string: Union[str, bytes] = '', *, require_confirmation=True) -> Union[bool, bytes]:
         """
         Receive text over the socket.
@@ -71,36 +152,34 @@ class SimplePeerText:
         - [bool, bytes]: If cmp_string is provided, returns True if received text matches cmp_string,
                         otherwise returns the received text as bytes.
         """
-        readable, _, _ = select.select([self.sock, self.controller], [], [], TIMEOUT)
-        if self.controller.to_stop or self.sock not in readable:
+        raw_length = recv_exact(self.sock, 4, self.controller)
+        if raw_length is None:
             return b''
-
-        text_length = struct.unpack('!I', self.sock.recv(4))[0]
-
-        received_data = bytearray()
-        try:
-            self.sock.setblocking(False)
-            safe_stop = self.controller
-            recv = self.sock.recv
-            while text_length > 0:
-                if safe_stop.to_stop is True:
-                    return b''
-                try:
-                    chunk = recv(min(self.chunk_size, text_length))
-                except BlockingIOError:
-                    continue
-                if not chunk:
-                    break
-                text_length -= len(chunk)
-                received_data.extend(chunk)
-        finally:
-            self.sock.setblocking(True)
-
+        text_length = struct.unpack('!I', raw_length)[0]
+        compressed = text_length & COMPRESSED
+        text_length &= ~COMPRESSED
+        if text_length > MAX_FRAME:  # nothing sane sends this, rest of the stream can't be trusted either
+            error_log(f"::frame of {text_length} bytes from {self.sock} at {func_str(SimplePeerText.receive)}")
+            raise ConnectionResetError(f"frame longer than {MAX_FRAME} bytes")
+
+        received_data = recv_exact(self.sock, text_length, self.controller)
+        if received_data is None:
+            self.raw_text = b''
+            if not self.controller.to_stop:
+                self.sock.send(struct.pack('!I', 0))
+            return b''
+        if compressed:
+            if len(received_data) >= _INFLATED_SIZE.size:
+                size = _INFLATED_SIZE.unpack_from(received_data)[0]
+                received_data = inflate_bounded(memoryview(received_data)[_INFLATED_SIZE.size:], size)
+            else:
+                received_data = None
+            if received_data is None:
+                self.raw_text = b''
+                error_log(f"::bad compressed text from {self.sock} at {func_str(SimplePeerText.receive)}")
+                return b''
         self.raw_text = bytes(received_data)
 
-        if text_length > 0:
-            self.sock.send(struct.pack('!I', 0))
-            return b''
         # if require_confirmation:
         #    self.__send_header()
 
@@ -157,7 +236,6 @@ class SimplePeerText:
     def __repr__(self):
         return (f"SimplePeerText(refer_sock='{self.sock.__repr__}',"
                 f" text='{self.raw_text}',"
-                f" chunk_size={self.chunk_size},"
                 f" controller={self.controller})")
 
     def __len__(self):
@@ -230,7 +308,7 @@ class DataWeaver:
 
     def send(self, receiver_sock, controller=d_controller):
         """
-        Sends data as json string to the provided socket,
+        Sends data to the provided socket, in the codec negotiated for it (json if none was, see `codec`),
         This function is written on top of :class: `SimplePeerText`'s send function
         Args:
             :param controller: an optional controller to pass into SimplePeerText
@@ -239,7 +317,16 @@ class DataWeaver:
         Returns:
             :returns True if sends text successfully else False:
         """
-        return SimplePeerText(receiver_sock, self.dump().encode(const.FORMAT), controller=controller).send()
+        return SimplePeerText(receiver_sock, self.encode(receiver_sock), controller=controller).send()
+
+    def encode(self, receiver_sock) -> bytes:
+        """data as it goes to :param receiver_sock:, to cork it with others (see `SimplePeerText.frame`)"""
+        with self.data_lock:
+            return codec.codec_for(receiver_sock).encode(self.__data)
+
+    def to_dict(self) -> dict:
+        with self.data_lock:
+            return {'header': self.__data['header'], 'content': self.__data['content'], 'id': self.__data['id']}
 
     def receive(self, sender_sock, controller=d_controller):
         """
@@ -252,8 +339,7 @@ class DataWeaver:
             The updated TextObject instance
         """
         text_string = SimplePeerText(sender_sock, controller=controller)
-        text_string.receive()
-        self.__set_values(json.loads(str(text_string)))
+        self.__set_values(codec.decode(text_string.receive()))
         return self
 
     def __set_values(self, data_value: dict):
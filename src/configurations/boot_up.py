@@ -5,6 +5,7 @@ import subprocess
 import urllib.request
 import ipaddress
 import random
+import uuid
 
 import src.avails.connect
 from src.avails.connect import is_port_empty
@@ -24,6 +25,7 @@ def initiate():
 
     set_constants(config_map)
     const.THIS_IP = get_ip()
+    const.HOST_ID = get_host_id()
     const.IP_VERSION = (socket.AF_INET6
                         if ipaddress.ip_address(const.THIS_IP).version == 6
                         else socket.AF_INET)
@@ -162,8 +164,31 @@ def get_v6_from_api64():
     return config_ip
 
 
+def get_host_id() -> str:
+    """
+    An id which is same for every instance running on this machine, peers compare it to find
+    whether they share the host (and it's filesystem)
+    """
+    for machine_id_file in ('/etc/machine-id', '/var/lib/dbus/machine-id'):
+        try:
+            with open(machine_id_file) as file:
+                if machine_id := file.read().strip():
+                    return machine_id
+        except OSError:
+            pass
+    if const.WINDOWS:
+        import winreg
+        try:
+            with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, r"SOFTWARE\Microsoft\Cryptography") as key:
+                return winreg.QueryValueEx(key, 'MachineGuid')[0]
+        except OSError:
+            pass
+    return f"{soc.gethostname()}-{uuid.getnode():012x}"
+
+
 def initiate_this_object():
-    const.THIS_OBJECT = RemotePeer(const.USERNAME, const.THIS_IP, const.PORT_THIS, report=const.PORT_REQ, status=1)
+    const.THIS_OBJECT = RemotePeer(const.USERNAME, const.THIS_IP, const.PORT_THIS, report=const.PORT_REQ, status=1,
+                                   host_id=const.HOST_ID)
 
 
 def clear_logs():
@@ -76,6 +76,8 @@ def set_paths():
     const.PATH_CURRENT = os.path.join(os.getcwd())
     const.PATH_PROFILES = os.path.join(const.PATH_CURRENT, 'profiles')
     const.PATH_LOG = os.path.join(const.PATH_CURRENT, 'logs')
+    const.PATH_CACHE = os.path.join(const.PATH_CURRENT, 'cache')
+    const.PATH_HISTORY = os.path.join(const.PATH_CURRENT, 'history')
     const.PATH_PAGE = os.path.join(const.PATH_CURRENT, 'src', 'webpage')
     const.PATH_CONFIG = os.path.join(const.PATH_CURRENT, 'src', 'configurations', const.DEFAULT_CONFIG_FILE)
     downloads_path = os.path.join(os.path.expanduser('~'), 'Downloads')
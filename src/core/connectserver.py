@@ -7,6 +7,7 @@ from src.avails.connect import REQ_URI_CONNECT
 from src.core import *
 from src.core import requests_handler
 from src.avails.textobject import SimplePeerText
+from src.avails import codec
 from src.avails.remotepeer import RemotePeer
 from src.managers.thread_manager import ACTUATOR_CONNECT_SERVER as _controller
 
@@ -56,7 +57,7 @@ def list_error_handler():
     req_peer = next(peer_list)
     conn = src.avails.connect.connect_to_peer(_peer_obj=req_peer, to_which=REQ_URI_CONNECT)
     with conn:
-        SimplePeerText(text=const.REQ_FOR_LIST, refer_sock=conn).send()
+        SimplePeerText(text=codec.request_header(const.REQ_FOR_LIST, req_peer.id), refer_sock=conn).send()
         select.select([conn, _controller], [], [], 100)
         list_len = struct.unpack('!Q', conn.recv(8))[0]
         get_initial_list(list_len, conn)
@@ -65,7 +66,8 @@ def list_error_handler():
 def list_from_forward_control(list_owner: RemotePeer):
     # socket.create_connection()
     with src.avails.connect.connect_to_peer(list_owner, to_which=REQ_URI_CONNECT) as list_connection_socket:
-        if SimplePeerText(list_connection_socket, const.REQ_FOR_LIST, controller=_controller).send():
+        header = codec.request_header(const.REQ_FOR_LIST, list_owner.id)
+        if SimplePeerText(list_connection_socket, header, controller=_controller).send():
             get_list_from(list_connection_socket)
 
 
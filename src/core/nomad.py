@@ -4,9 +4,9 @@ from types import ModuleType
 
 import src.avails.connect
 from ..core import *
-from ..avails import useables as use
+from ..avails import useables as use, codec, history
 
-from ..managers import directorymanager, filemanager
+from ..managers import directorymanager, filemanager, swarmmanager
 from ..managers.thread_manager import thread_handler, NOMADS
 from ..webpage_handlers import handle_data
 from ..avails.textobject import DataWeaver, SimplePeerText
@@ -18,21 +18,35 @@ class Nomad(object):
         'address': tuple,
         '__control_flag': threading.Event,
         'main_socket': socket.socket,
+        'local_socket': socket.socket,
         'controller':ThreadActuator,
         'currently_in_connection':defaultdict,
         'RecentConnections': ModuleType,
     }
-    __slots__ = 'address', 'controller', 'selector', 'main_socket', 'currently_in_connection', 'RecentConnections', 'socket_handler'
+    __slots__ = ('address', 'controller', 'selector', 'main_socket', 'local_socket', 'currently_in_connection',
+                 'RecentConnections', 'socket_handler')
 
     def __init__(self, ip='localhost', port=8088):
         self.address = (ip, port)
         self.controller = ThreadActuator(None)
         use.echo_print("::Initiating Nomad Object", self.address)
         self.main_socket = connect.create_server(self.address, family=const.IP_VERSION, backlog=5)
+        self.local_socket = self.__make_local_socket()
         self.currently_in_connection = defaultdict(int)
         self.RecentConnections = getattr(import_module('src.core.senders'), 'RecentConnections')
         self.socket_handler = SocketLoop()
 
+    @staticmethod
+    def __make_local_socket():
+        """peers running on this machine connect here (unix domain socket) instead of :attr:`main_socket`"""
+        if not hasattr(socket, 'AF_UNIX'):
+            return None
+        try:
+            return connect.create_local_server(connect.local_socket_path(const.THIS_OBJECT.id))
+        except OSError as e:
+            error_log(f"Socket error: at {func_str(Nomad.__make_local_socket)} exp:{e}")
+            return None
+
     def __resetSocket(self):
         self.main_socket = connect.create_server(self.address, family=const.IP_VERSION,backlog=5)
 
@@ -53,20 +67,21 @@ class Nomad(object):
             use.echo_print("verified peer", _id)  # debug
             return _id
 
-    def __accept_connection(self):
+    def __accept_connection(self, server_socket):
         initial_conn = None
         try:
-            initial_conn, _ = self.main_socket.accept()
+            initial_conn, _ = server_socket.accept()
             use.echo_print(f"New connection from {_}")
             peer_id = self.verify(initial_conn)
             if peer_id:
                 self.socket_handler.register_sock(initial_conn, peer_id)
                 self.RecentConnections.addSocket(peer_id, initial_conn)
+                self.RecentConnections.offer_codecs(initial_conn)
             else:
                 initial_conn.close()
         except (socket.error, OSError) as e:
             error_log(f"Socket error: at {func_str(Nomad.__accept_connection)} exp:{e}")
-            initial_conn.close()
+            initial_conn.close() if initial_conn else None
 
     def initiate(self):
         self.main_socket.listen(3)
@@ -75,6 +90,8 @@ class Nomad(object):
         threading.Thread(target=self.socket_handler.start_loop).start()
         with self.main_socket:
             reads_list = [self.main_socket, self.controller.reader]
+            if self.local_socket:
+                reads_list.append(self.local_socket)
             while True:
                 reads, _, _ = select.select(reads_list, [], [])
                 if self.controller.to_stop is True:
@@ -82,12 +99,20 @@ class Nomad(object):
                     return
                 if len(self.currently_in_connection) > 10:
                     time.sleep(10)  # limiting rate just in case of more no. of different connections
-                self.__accept_connection()
+                for server_socket in reads:
+                    if server_socket is not self.controller.reader:
+                        self.__accept_connection(server_socket)
 
     def end(self):
         self.socket_handler.end_loop()
         self.controller.signal_stopping()
         self.currently_in_connection.fromkeys(self.currently_in_connection, 0)
+        if self.local_socket:
+            self.local_socket.close()
+            try:
+                os.unlink(connect.local_socket_path(const.THIS_OBJECT.id))
+            except OSError:
+                pass
         # self.main_socket.close() if self.main_socket else None
 
     def __repr__(self):
@@ -99,6 +124,22 @@ class Nomad(object):
     #     self.socket_handler.end_loop()
 
 
+threaded_handlers = {  # header: function started in a thread of it's own with the message
+    const.CMD_RECV_FILE: filemanager.file_receiver,
+    const.CMD_RECV_LOCAL_FILE: filemanager.local_file_receiver,
+    const.CMD_RECV_MULTICAST: filemanager.multicast_receiver,
+    const.CMD_SWARM_QUERY: swarmmanager.answer_query,
+    const.CMD_SWARM_HAVE: swarmmanager.add_source,
+    const.CMD_SWARM_SERVE: swarmmanager.serve_swarm,
+    const.CMD_RECV_FILE_AGAIN: filemanager.re_receive_file,
+    const.CMD_RECV_DIR: directorymanager.directoryReceiver,
+}
+
+
+# what decoding a frame (see `codec.decode`) or a batch in it raises when peer sent something broken
+MALFORMED_ERRORS = (ValueError, struct.error, IndexError, KeyError, TypeError)
+
+
 class SocketLoop(selectors.DefaultSelector):
     # TODO: ADD SOCKET EXPIRY TIMER THREAD
     def __init__(self):
@@ -109,7 +150,8 @@ class SocketLoop(selectors.DefaultSelector):
         self.threads = []
         self.register(self._controller, selectors.EVENT_READ)
         self.currently_in_connection = defaultdict(int)
-        self.RecentConnections = getattr(import_module('src.core.senders'), 'RecentConnections')
+        self.senders = import_module('src.core.senders')
+        self.RecentConnections = getattr(self.senders, 'RecentConnections')
         self.connections = SocketStore()
 
     def register_sock(self, sock_desc, peer_id):
@@ -154,22 +196,42 @@ class SocketLoop(selectors.DefaultSelector):
                 return
             _data = DataWeaver().receive(_conn)
             # use.echo_print('data from peer :\n', _data)  # debug
+            if _data.header == const.CMD_BATCH or _data.header == const.CMD_SEQUENCED:
+                if _data.header == const.CMD_SEQUENCED:
+                    messages = self.senders.receive_sequenced(peer_id, _data.content)  # acks too, drops repeats
+                else:
+                    messages = _data.content
+                received = [DataWeaver(header=message['header'], content=message['content'], _id=message['id'])
+                            for message in messages]
+            else:
+                received = [_data]
         except (ConnectionResetError, socket.error) as e:
             self.unregister(_conn)
             use.echo_print(f"::Connection error: at {func_str(SocketLoop.connect_new)} exp:{e}", _conn)
             return
         except TimeoutError:
             return
+        except MALFORMED_ERRORS as e:
+            # a frame this end can't read, what follows on this socket can't be trusted either,
+            # only this peer's connection goes, loop carries on with the rest
+            self.unregister(_conn)
+            _conn.close()
+            error_log(f"::malformed message from {peer_id} at {func_str(SocketLoop.connect_new)} exp:{e!r}")
+            return
+
+        for data in received:
+            self.dispatch(_conn, peer_id, data)
 
-        if _data.header == const.CMD_TEXT:
+    def dispatch(self, _conn, peer_id, _data: DataWeaver):
+        header = _data.header  # table's own object for opcode frames (see `codec`), compares by identity
+        if header == const.CMD_TEXT:
+            history.record(_data.id, _data.content, outgoing=False)
             asyncio.run(handle_data.feed_user_data_to_page(_data.content, _data.id))
-        elif _data.header == const.CMD_RECV_FILE:
-            self.start_thread(filemanager.file_receiver, _data)
-        elif _data.header == const.CMD_RECV_FILE_AGAIN:
-            self.start_thread(filemanager.re_receive_file, _data)
-        elif _data.header == const.CMD_RECV_DIR:
-            self.start_thread(directorymanager.directoryReceiver,_data)
-        elif _data.header == const.CMD_CLOSING_HEADER:
+        elif (handler := threaded_handlers.get(header)) is not None:
+            self.start_thread(handler, _data)
+        elif header == const.CMD_CODEC_OFFER:
+            codec.accept(_conn, _data.content, peer_id)
+        elif header == const.CMD_CLOSING_HEADER:
             self.disconnect_user(_conn, self._controller, peer_id)
             return
 
@@ -5,7 +5,7 @@ from collections import deque
 import src.avails.connect
 from src.avails.remotepeer import RemotePeer
 from src.core import *
-from src.avails import useables as use
+from src.avails import useables as use, codec
 from src.avails.connect import REQ_URI_CONNECT
 from src.managers.thread_manager import thread_handler, REQUESTS
 from src.webpage_handlers import handle_data
@@ -115,7 +115,7 @@ function_map = {
 
 
 def resolve_data(_conn):
-    data = SimplePeerText(_conn, controller=_controller).receive()
+    data = codec.resolve_request(SimplePeerText(_conn, controller=_controller).receive())
     use.echo_print(f"::Received {data} from {_conn.getpeername()}")
     # except (socket.error, OSError) as e:
     #     error_log(f"Socket error at {func_str(controlconnection)} exp:{e} peer:{connection.getpeername()}")
@@ -142,7 +142,7 @@ def sync_users_with_server(_conn):
 def ping_user(remote_peer: RemotePeer):
     try:
         with src.avails.connect.connect_to_peer(remote_peer, to_which=REQ_URI_CONNECT, timeout=5) as _conn:
-            return SimplePeerText(_conn, const.ACTIVE_PING).send()
+            return SimplePeerText(_conn, codec.request_header(const.ACTIVE_PING, remote_peer.id)).send()
     except socket.error as e:
         error_log(f"Error pinging user at {func_str(ping_user)} exp :  {e}")
         return False
@@ -153,8 +153,9 @@ def signal_status(queue_in: Queue[RemotePeer]):
         peer_object = queue_in.get()
         try:
             with src.avails.connect.connect_to_peer(peer_object, to_which=REQ_URI_CONNECT, timeout=5) as _conn:
-                SimplePeerText(_conn, const.I_AM_ACTIVE).send(require_confirmation=False)
-                const.THIS_OBJECT.send_serialized(_conn)
+                header = codec.request_header(const.I_AM_ACTIVE, peer_object.id)
+                connect.send_buffers(_conn, (*SimplePeerText(_conn, header).frame(),
+                                             *const.THIS_OBJECT.serialized_frame()))
         except socket.error:
             use.echo_print(f"Error sending status({const.THIS_OBJECT.status}) at {func_str(signal_status)}", peer_object)
             peer_object.status = 0  # this makes that user as not active
@@ -187,8 +188,9 @@ def notify_leaving_status_to_users():
         use.echo_print("::Notifying leaving ", peer.uri, peer.username)
         try:
             with src.avails.connect.connect_to_peer(peer, to_which=REQ_URI_CONNECT, timeout=5) as _conn:
-                SimplePeerText(_conn, const.I_AM_ACTIVE).send(require_confirmation=False)
-                const.THIS_OBJECT.send_serialized(_conn)
+                header = codec.request_header(const.I_AM_ACTIVE, peer.id)
+                connect.send_buffers(_conn, (*SimplePeerText(_conn, header).frame(),
+                                             *const.THIS_OBJECT.serialized_frame()))
         except socket.error:
             use.echo_print(f"Error sending leaving status at {func_str(signal_status)}")
 
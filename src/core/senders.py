@@ -1,17 +1,19 @@
+import importlib
 from typing import Optional
 
 import src.avails.connect
 import src.avails.useables
 from src.core import *
 from src.avails.textobject import DataWeaver, SimplePeerText
-from src.avails import constants as const, useables as use
+from src.avails import constants as const, useables as use, codec, history
 from src.avails.connect import BASIC_URI_CONNECT
 from src.avails.remotepeer import RemotePeer
 from src.avails.useables import echo_print
 from src.managers import filemanager
 from src.managers import directorymanager
+from src.managers import swarmmanager
 
-from collections import OrderedDict
+from collections import OrderedDict, deque
 
 
 class SocketCache:
@@ -62,12 +64,19 @@ class RecentConnections:
         SimplePeerText(connection_socket, text=const.CMD_VERIFY_HEADER).send()
         print("sent header")
         SimplePeerText(connection_socket, text=const.THIS_OBJECT.id.__str__().encode(const.FORMAT)).send()
+        cls.offer_codecs(connection_socket)
         # DataWeaver(header=const.CMD_VERIFY_HEADER,content="",_id=const.THIS_OBJECT.id).send(connection_socket)
         print("Sent verification to ", connection_socket.getpeername())
         # except json.JSONDecoder:
         #     return False
         return True
 
+    @classmethod
+    def offer_codecs(cls, connection_socket):
+        """tells the other end which codecs (and batches, compressions) this end reads, other end does the same"""
+        DataWeaver(header=const.CMD_CODEC_OFFER, content=codec.offer(),
+                   _id=const.THIS_OBJECT.id).send(connection_socket)
+
     @classmethod
     def add_connection(cls, peer_obj: RemotePeer):
         connection_socket = connect.connect_to_peer(_peer_obj=peer_obj, to_which=BASIC_URI_CONNECT)
@@ -80,17 +89,26 @@ class RecentConnections:
 
     @classmethod
     def connect_peer(cls, peer_obj: RemotePeer):
+        if (connection_socket := cls.socket_for(peer_obj)) is not None:
+            cls.current_connected = connection_socket
+
+    @classmethod
+    def socket_for(cls, peer_obj: RemotePeer) -> Optional[connect.Socket]:
+        """
+        connected socket to :param peer_obj:, connecting (again) if there is none,
+        unlike `connect_peer` it does not change `current_connected`
+        """
         if peer_obj.id not in cls.connected_sockets:
             try:
-                cls.current_connected = cls.add_connection(peer_obj)
-                cls.verifier(cls.current_connected)
-                const.HOST_OBJ.socket_handler.register_sock(cls.current_connected, peer_obj.id)
-                print("cache miss --current : ", peer_obj.username, cls.current_connected.getpeername()[:2],
-                      cls.current_connected.getsockname()[:2])
+                connection_socket = cls.add_connection(peer_obj)
+                cls.verifier(connection_socket)
+                const.HOST_OBJ.socket_handler.register_sock(connection_socket, peer_obj.id)
+                print("cache miss --current : ", peer_obj.username, connection_socket.getpeername()[:2],
+                      connection_socket.getsockname()[:2])
+                return connection_socket
             except (socket.error, ConnectionResetError):
                 use.echo_print(f"handle signal to page, that we can't reach {peer_obj.username}, or he is offline")
-                pass
-            return
+                return None
 
         supposed_to_be_connected_socket = cls.connected_sockets.get_socket(peer_id=peer_obj.id)
         if src.avails.connect.is_socket_connected(supposed_to_be_connected_socket):
@@ -98,13 +116,12 @@ class RecentConnections:
             # unexpected errors or disconnections, usually that means
             # all the sending operations run at-most 2 times to check again
             # for connection
-            cls.current_connected = supposed_to_be_connected_socket
             pr_str = f"cache hit !{f"{peer_obj.username[:10]}..." if len(peer_obj.username) > 10 else peer_obj.username}! and socket is connected"
             use.echo_print(pr_str, supposed_to_be_connected_socket.getpeername())
-        else:
-            cls.connected_sockets.remove(peer_id=peer_obj.id)
-            use.echo_print("cache hit !! socket not connected trying to reconnect")
-            cls.connect_peer(peer_obj)
+            return supposed_to_be_connected_socket
+        cls.connected_sockets.remove(peer_id=peer_obj.id)
+        use.echo_print("cache hit !! socket not connected trying to reconnect")
+        return cls.socket_for(peer_obj)
 
     @classmethod
     def force_remove(cls, peer_id: str):
@@ -113,40 +130,310 @@ class RecentConnections:
     @classmethod
     def end(cls):
         use.echo_print("::Cleared senders")
+        close_outboxes()
         cls.connected_sockets.clear()
 
 
-retry_count = 0
+OUTBOX_LIMIT = 256  # messages waiting for a peer before page is told to hold back
+RETRY_LIMIT = 3
+RETRY_GAP = 1  # sec, grows with every attempt
+COALESCE_WINDOW = 0.0015  # sec, longest a message of a burst waits for others to go with it
+BATCH_LIMIT = 64
+BATCH_BYTES = 32 * 1024
+WINDOW = 512  # messages sent but not acknowledged yet, writer waits for acks beyond this
+ACK_DELAY = 0.02  # sec, an ack waits this long for a message to ride along with
+RETRANSMIT_TIMEOUT = 5  # sec, without any ack, messages not acknowledged are sent again
+SESSION = os.urandom(8).hex()  # sequence numbers are of this run, peers start over when it changes
 
 
-@RecentConnections
-def sendMessage(data: DataWeaver, sock: socket = None):
+class PeerOutbox:
     """
-    A Wrapper function to function at {nomad.send()}
-    Provides Error Handling And Ensures robustness of sending data.
-    What is going on here ?
-    the thing with the decorator is different here, look into decorator's doc string for further reference
+    Messages to one peer, written in order by a thread of it's own,
+    so a peer that is slow or unreachable holds up only messages to it.
+    Once `OUTBOX_LIMIT` messages are waiting, further ones are refused and page is told to hold back,
+    it is told to go on once half of them are written.
+
+    A message found alone in the outbox goes at once, when others are waiting behind it (a burst)
+    writer gathers upto `BATCH_LIMIT` messages (or `BATCH_BYTES` of text) for upto `COALESCE_WINDOW`,
+    they go as one `CMD_BATCH` message if peer reads batches, otherwise as frames corked in one write.
+
+    To peers that read sequenced messages, messages go in `CMD_SEQUENCED` envelopes instead,
+    numbered in order of this `SESSION`, each envelope carries a cumulative ack of what came from that peer
+    (an ack with nothing to ride along with goes alone after `ACK_DELAY`).
+    upto `WINDOW` messages are kept till they are acknowledged, they are all sent again whenever they are written
+    to a socket other than the one last written to (a reconnect) or once `RETRANSMIT_TIMEOUT` passes without
+    the ack moving. Receiving end takes messages only in order, drops what it already got and what comes after
+    a gap (it's ack stays at the gap, so they come again), so every message is taken exactly once.
+    Window lives here, so an outbox is never replaced while app runs (see `outbox_for`)
+    """
+    __annotations__ = {
+        'peer_id': str,
+        'thread': threading.Thread,
+        'accepting': bool,
+    }
+    __slots__ = ('peer_id', 'thread', 'accepting', '__pending', '__changed', '__closed', '__next_seq',
+                 '__unacked', '__sent_at', '__sequenced', '__peer_session', '__expected', '__ack_at', '__last_sock')
+
+    def __init__(self, peer_id):
+        self.peer_id = peer_id
+        self.accepting = True
+        self.__pending: deque[DataWeaver] = deque()
+        self.__changed = threading.Condition()
+        self.__closed = False
+        self.__next_seq = 0
+        self.__unacked: deque[tuple[int, dict]] = deque()  # (seq, message)
+        self.__sent_at = None  # time unacknowledged messages were last sent
+        self.__sequenced = False  # whether peer was found to read sequenced messages
+        self.__peer_session = None
+        self.__expected = 0  # seq of next message from peer
+        self.__ack_at = None  # time an ack to peer is due, if one is
+        self.__last_sock = None  # socket sequenced messages were last written to
+        self.thread = threading.Thread(target=self.__write_loop, name=f"outbox-{peer_id}", daemon=True)
+        self.thread.start()
+
+    def put(self, data: DataWeaver) -> bool:
+        with self.__changed:
+            full = len(self.__pending) >= OUTBOX_LIMIT
+            if not full:
+                self.__pending.append(data)
+                self.__changed.notify()
+        if full:
+            self.__signal_page(accepting=False)
+            self.__signal_refused([data])
+        return not full
+
+    def received(self, content: dict) -> list[dict]:
+        """
+        takes in a `CMD_SEQUENCED` envelope from peer, it's ack frees window of this end
+        :returns: messages in it that were not received before
+        """
+        with self.__changed:
+            ack = content.get('ack')
+            if ack and ack['session'] == SESSION and self.__unacked and self.__unacked[0][0] < ack['next']:
+                while self.__unacked and self.__unacked[0][0] < ack['next']:
+                    self.__unacked.popleft()
+                # only an ack that moves puts off retransmitting, a repeated one means something went missing
+                self.__sent_at = time.monotonic() if self.__unacked else None
+                self.__changed.notify()
+            messages, first = content['messages'], content['seq']
+            if not messages:
+                return []
+            if content['session'] != self.__peer_session:  # peer's first envelope, or peer restarted
+                self.__peer_session, self.__expected = content['session'], 0  # numbering starts at 0 every session
+            if first > self.__expected:
+                # taken later when they are sent again along with what is missing, ack stays where it is till then
+                use.echo_print(f"::messages {self.__expected} to {first} from {self.peer_id} are missing")
+                fresh = []
+            else:
+                fresh = messages[self.__expected - first:]
+                self.__expected = max(self.__expected, first + len(messages))
+            if self.__ack_at is None:
+                self.__ack_at = time.monotonic() + ACK_DELAY
+                self.__changed.notify()
+            return fresh
+
+    def close(self):
+        with self.__changed:
+            self.__closed = True
+            self.__pending.clear()
+            self.__changed.notify()
+
+    def __can_send(self):
+        return self.__pending and len(self.__unacked) < WINDOW
+
+    def __timers(self):
+        timers = []
+        if self.__ack_at is not None:
+            timers.append(self.__ack_at)
+        if self.__unacked and self.__sent_at is not None:
+            timers.append(self.__sent_at + RETRANSMIT_TIMEOUT)
+        return timers
+
+    def __write_loop(self):
+        while True:
+            with self.__changed:
+                while not (self.__closed or self.__can_send()):
+                    timers = self.__timers()
+                    if timers and min(timers) <= time.monotonic():
+                        break
+                    self.__changed.wait(min(timers) - time.monotonic() if timers else None)
+                if self.__closed:
+                    return
+                batch = self.__take() if self.__can_send() else []
+                now = time.monotonic()
+                retransmit = bool(self.__unacked) and self.__sent_at is not None and (
+                        now >= self.__sent_at + RETRANSMIT_TIMEOUT)
+                ack_due = self.__ack_at is not None and now >= self.__ack_at
+            if batch or retransmit:
+                self.__send(batch)
+            elif ack_due:
+                self.__send_ack()
+            if not self.accepting and len(self.__pending) <= OUTBOX_LIMIT // 2:
+                self.__signal_page(accepting=True)
+
+    def __take(self) -> list[DataWeaver]:
+        """pending messages to be written together, waits a little for more of them if a burst is on"""
+        room = min(BATCH_LIMIT, WINDOW - len(self.__unacked))
+        if len(self.__pending) > 1:
+            deadline = time.monotonic() + COALESCE_WINDOW
+            while len(self.__pending) < room and (remaining := deadline - time.monotonic()) > 0:
+                self.__changed.wait(remaining)
+        batch, size = [], 0
+        while self.__pending and len(batch) < room and size < BATCH_BYTES:
+            data = self.__pending.popleft()
+            batch.append(data)
+            size += len(data.content) if isinstance(data.content, str) else 0
+        return batch
+
+    @staticmethod
+    def __write(sock, batch: list[DataWeaver]):
+        if len(batch) == 1:
+            batch[0].send(sock)
+        elif codec.reads_batches(sock):
+            DataWeaver(header=const.CMD_BATCH, content=[data.to_dict() for data in batch],
+                       _id=const.THIS_OBJECT.id).send(sock)
+        else:
+            frames = (SimplePeerText(sock, data.encode(sock)).frame() for data in batch)
+            connect.send_buffers(sock, [part for frame in frames for part in frame])
+
+    def __envelope(self, seq, messages: list[dict]) -> DataWeaver:
+        """called holding lock, takes due ack along"""
+        ack = {'session': self.__peer_session, 'next': self.__expected} if self.__peer_session else None
+        self.__ack_at = None
+        return DataWeaver(header=const.CMD_SEQUENCED, _id=const.THIS_OBJECT.id,
+                          content={'session': SESSION, 'seq': seq, 'messages': messages, 'ack': ack})
+
+    def __write_sequenced(self, sock, first_seq=None):
+        """writes messages not acknowledged yet, from :param first_seq: (every one of them if None)"""
+        with self.__changed:
+            unacked = [entry for entry in self.__unacked if first_seq is None or entry[0] >= first_seq]
+            envelopes = [
+                self.__envelope(unacked[i][0], [message for _, message in unacked[i:i + BATCH_LIMIT]])
+                for i in range(0, len(unacked), BATCH_LIMIT)
+            ]
+            if first_seq is None or self.__sent_at is None:  # new messages do not put off retransmitting old ones
+                self.__sent_at = time.monotonic()
+        frames = (SimplePeerText(sock, envelope.encode(sock)).frame() for envelope in envelopes)
+        connect.send_buffers(sock, [part for frame in frames for part in frame])
+
+    def __number(self, batch: list[DataWeaver]) -> int:
+        """puts :param batch: into window, :returns: seq of it's first message"""
+        with self.__changed:
+            first_seq = self.__next_seq
+            for data in batch:
+                self.__unacked.append((self.__next_seq, data.to_dict()))
+                self.__next_seq += 1
+            return first_seq
+
+    def __send(self, batch: list[DataWeaver]):
+        """writes :param batch: (and messages due for retransmission), reconnecting upto `RETRY_LIMIT` times"""
+        # once peer is known to read sequenced messages, they are kept in window even if peer can not be reached now
+        first_seq = self.__number(batch) if batch and self.__sequenced else None
+        lost = bool(batch) and first_seq is None
+        for attempt in range(1, RETRY_LIMIT + 1):
+            if self.peer_id not in peer_list:
+                break
+            sock = RecentConnections.socket_for(peer_list.get_peer(self.peer_id))
+            if sock is not None:
+                try:
+                    if first_seq is None and batch and codec.reads_sequenced(sock):
+                        self.__sequenced = True
+                        first_seq = self.__number(batch)
+                        lost = False  # kept in window from here on, retransmission takes care of it
+                    if self.__sequenced:
+                        # everything unacknowledged is resent on retransmit, and over a socket other than
+                        # the last one (what went over that one may never have arrived)
+                        self.__write_sequenced(sock, first_seq if sock is self.__last_sock else None)
+                        self.__last_sock = sock
+                    elif batch:
+                        self.__write(sock, batch)
+                    echo_print(f"sent {len(batch)} message(s) to ", sock.getpeername())
+                    return
+                except (socket.error, OSError) as exp:
+                    error_log(f"got error at {func_str(self.__send)} :{exp}")
+                    RecentConnections.force_remove(self.peer_id)
+            if attempt < RETRY_LIMIT:
+                time.sleep(RETRY_GAP * attempt)
+        with self.__changed:
+            self.__sent_at = time.monotonic() if self.__unacked else None
+        if lost:
+            use.echo_print("::could not send message to", self.peer_id)
+            self.__signal_refused(batch)
+
+    def __send_ack(self):
+        sock = RecentConnections.connected_sockets.get_socket(self.peer_id)
+        with self.__changed:
+            envelope = self.__envelope(self.__next_seq, [])
+        if sock is None:
+            return
+        try:
+            envelope.send(sock)
+        except (socket.error, OSError) as exp:
+            error_log(f"got error at {func_str(self.__send_ack)} :{exp}")
+
+    def __signal_page(self, accepting):
+        with self.__changed:
+            if self.accepting == accepting:
+                return
+            self.accepting = accepting
+        handle_data = importlib.import_module('src.webpage_handlers.handle_data')
+        asyncio.run_coroutine_threadsafe(handle_data.feed_outbox_status_to_page(self.peer_id, accepting),
+                                         handle_data.loop)
+
+    def __signal_refused(self, messages: list[DataWeaver]):
+        """tells page which of it's messages were not taken (outbox full) or could not be sent"""
+        handle_data = importlib.import_module('src.webpage_handlers.handle_data')
+        for data in messages:
+            asyncio.run_coroutine_threadsafe(handle_data.feed_refused_message_to_page(self.peer_id, data.content),
+                                             handle_data.loop)
+
+    def __repr__(self):
+        return (f"PeerOutbox({self.peer_id}, waiting={len(self.__pending)}, "
+                f"unacked={len(self.__unacked)}, accepting={self.accepting})")
+
+
+_outboxes: dict[str, PeerOutbox] = {}
+_outboxes_lock = threading.Lock()
+
+
+def close_outboxes():
+    """only when app ends, whatever is still unacknowledged goes with it"""
+    with _outboxes_lock:
+        for outbox in _outboxes.values():
+            outbox.close()
+        _outboxes.clear()
+
+
+def outbox_for(peer_id) -> PeerOutbox:
+    """
+    one outbox per peer for the whole run, made the first time it is asked for,
+    reconnecting to peer only changes the socket it writes to (see `RecentConnections.socket_for`),
+    it's window is written whole to a new socket (see `PeerOutbox`)
+    """
+    with _outboxes_lock:
+        if peer_id not in _outboxes:
+            _outboxes[peer_id] = PeerOutbox(peer_id)
+        return _outboxes[peer_id]
+
+
+def receive_sequenced(peer_id, content: dict) -> list[dict]:
+    """:returns: messages of a `CMD_SEQUENCED` envelope from :param peer_id: that were not received before"""
+    return outbox_for(peer_id).received(content)
+
+
+def sendMessage(data: DataWeaver):
+    """
+    Queues message to the peer of `data.id` (page puts receiver's id there) and returns,
+    message is written by that peer's `PeerOutbox`, which also retries and reconnects
     :param data:
-    :param sock:
-    :return bool:p
+    :return bool: False if that peer's outbox is full (page is told to hold back)
     """
-    back_up_id = data.id  # back up the id, to be used in case of error
-    try:
-        data['id'] = const.THIS_OBJECT.id  # Changing the id to this peer's id
-        data.send(sock)
-        echo_print("sent message to ", sock.getpeername())
-        return
-    except (socket.error, OSError) as exp:
-        print(f"got error at {func_str(sendMessage)} :{exp}", sock)
-        error_log(f"got error at handle/send_message :{exp}")
-        global retry_count
-        retry_count += 1
-        RecentConnections.force_remove(back_up_id)
-    if retry_count < 3:
-        RecentConnections.connect_peer(peer_list.get_peer(back_up_id))  # retrying to connect
-        sendMessage(data)  # sending message
-    else:
-        retry_count = 0
+    peer_id = data.id
+    data['id'] = const.THIS_OBJECT.id  # Changing the id to this peer's id
+    if not outbox_for(peer_id).put(data):
+        return False
+    history.record(peer_id, data.content, outgoing=True)
+    return True
 
 
 @RecentConnections
@@ -177,3 +464,29 @@ def sendFileAgain(_path: DataWeaver, sock=None):
 @RecentConnections
 def sendDir(_path, sock=None):
     use.start_thread(_target=directorymanager.directorySender, _args=(_path, sock))
+
+
+def sendFileToMany(_path: DataWeaver):
+    """
+    A Wrapper function to function at {filemanager.fanOutSender()}
+    not wrapped with RecentConnections as it connects to every peer in `_path.content['peers']` by itself
+    """
+    use.start_thread(_target=filemanager.fanOutSender, _args=(_path,))
+
+
+def sendFileMulticast(_path: DataWeaver):
+    """
+    A Wrapper function to function at {filemanager.multicastSender()}
+    not wrapped with RecentConnections as it reaches every peer in `_path.content['peers']` (or every peer known)
+    """
+    use.start_thread(_target=filemanager.multicastSender, _args=(_path,))
+
+
+def shareWithSwarm(_path: DataWeaver):
+    """A Wrapper function to function at {swarmmanager.share_files()}"""
+    use.start_thread(_target=swarmmanager.share_files, _args=(_path,))
+
+
+def downloadFromSwarm(_path: DataWeaver):
+    """A Wrapper function to function at {swarmmanager.swarmDownloader()}"""
+    use.start_thread(_target=swarmmanager.swarmDownloader, _args=(_path,))
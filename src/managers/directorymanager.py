@@ -1,21 +1,27 @@
 import importlib
+import itertools
 import os.path
 import pickle
 import tqdm
-import tempfile
 from pathlib import Path
-from multiprocessing import Process, Queue
-from zipfile import ZipFile, ZIP_DEFLATED
+from typing import BinaryIO
 
 import src.avails.connect
-from src.avails.fileobject import PeerFilePool, make_file_items
+from src.avails.archive import (ParallelZipWriter, CompressionPolicy, ZipStreamExtractor, compress_pool,
+                               shutdown_compress_pool)
+from src.avails import dirsync
+from src.avails.fileobject import PeerFilePool, _FileItem, walk_file_items, safe_relative_path, safe_name
+from src.avails.scancache import scan_cache_for
 from src.core import *
 from src.avails import useables as use
 from src.avails.textobject import DataWeaver
 from src.avails.dialogs import Dialog
+from src.avails.peerstats import peer_stats
+from src.managers import filemanager
 from src.managers.thread_manager import thread_handler, DIRECTORIES
 
-zipping_processes: set[Process] = set()  # a set to store references of ongoing processes used in case of force stopping
+ARCHIVE_CHUNK = 256 * 1024
+ARCHIVE_TIMEOUT = 60  # sec, sender may pause this long (compressing) before receiver gives up
 
 
 def do_handshake(_sock, controller, _content, receiver_obj):
@@ -41,94 +47,182 @@ def do_handshake(_sock, controller, _content, receiver_obj):
 
 
 def directorySender(_data: DataWeaver, recv_sock):
+    """
+    :param _data: content is path of the directory, or {'path': path, 'compress': bool, 'sync': bool}
+                  with sync only what changed since receiver last got this directory is sent
+    """
     receiver_obj = peer_list.get_peer(_data.id)
-    file_path = _data.content
+    options = _data.content if isinstance(_data.content, dict) else {'path': _data.content}
+    file_path = options.get('path')
     if not file_path:
         file_path = Dialog.open_directory_dialog_window()
-    zip_path = None
-    try:
-        zip_path = process_zipping(receiver_obj, file_path)
-        files = make_file_items([zip_path,])
-        _id = receiver_obj.get_file_count()
-        controller = ThreadActuator(threading.current_thread())
-        thread_handler.register_control(controller, DIRECTORIES)
-        receiver_sock = do_handshake(recv_sock, controller,
-                                     {'file_name':os.path.basename(file_path), 'file_id':_id},
-                                     receiver_obj)
-        if receiver_sock is None:
-            return
-        with receiver_sock:
-            PeerFilePool(file_items=files, _id=_id, control_flag=controller).send_files(receiver_sock)
-    finally:
-        print("sender zip path", zip_path)
-        if zip_path:
-            zip_path.unlink(missing_ok=True)
+    if not file_path:
+        return
+    if options.get('sync'):
+        return _syncSender(receiver_obj, file_path, recv_sock)
+    if options.get('compress'):
+        return _archiveSender(receiver_obj, file_path, recv_sock)
+
+    # tree is walked while it is being sent, entries are spread over a group of sockets like any file send
+    # and receiver creates files (and empty directories) under one root as they come on any of them
+    root = Path(file_path).expanduser().resolve(strict=True)
+    batches = walk_file_items(root, cache=scan_cache_for(root))
+    first_batch = next(batches, [])  # an empty tree still makes it's root at receiver, on handshake
+    handshake_content = {'directory': root.name, 'directory_id': f"{const.THIS_OBJECT.id}:{time.time_ns()}"}
+    filemanager.send_in_parallel(receiver_obj, recv_sock, itertools.chain([first_batch], batches),
+                                 sum(x.size for x in first_batch), len(first_batch), handshake_content)
+
+
+def _syncSender(receiver_obj, file_path, recv_sock):
+    """
+    Receiver streams manifest of it's copy, which is compared against this tree as both are read,
+    resulting changes go first (so receiver can delete), then added or changed files, see `src.avails.dirsync`
+    """
+    root = Path(file_path).expanduser().resolve(strict=True)
+    _id = receiver_obj.get_file_count()
+    controller = ThreadActuator(threading.current_thread())
+    thread_handler.register_control(controller, DIRECTORIES)
+    receiver_sock = do_handshake(recv_sock, controller,
+                                 {'file_name': root.name, 'file_id': _id, 'sync': dirsync.sync_id_for(root)},
+                                 receiver_obj)
+    if receiver_sock is None:
+        return
+    with receiver_sock:
+        cache = scan_cache_for(root)  # digests of files hashed by earlier syncs of this tree
+        cache.begin()
+        complete = False
+        try:
+            with receiver_sock.makefile('rb') as reader:
+                changes = list(dirsync.diff(root, dirsync.walk_sorted(root, cache=cache), dirsync.read_entries(reader),
+                                            cache))
+            complete = True
+        finally:
+            cache.save(complete)
+        dirsync.send_changes(receiver_sock, changes)
+        to_send = [_FileItem(name, size, os.path.join(root, *name.rstrip('/').split('/')), 0)
+                   for op, (name, size, *_) in changes if op == dirsync.SEND]
+        use.echo_print(f"::syncing {root}, {len(to_send)} to send, {len(changes) - len(to_send)} other changes")
+        PeerFilePool(file_items=to_send, _id=_id, control_flag=controller).send_files(receiver_sock)
+
+
+def _archiveSender(receiver_obj, file_path, recv_sock):
+    """
+    directory goes as a compressed archive (worth it only where link is slower than compressing),
+    archive is written into the socket while it is being made, receiver extracts it as it arrives
+    """
+    root = Path(file_path).expanduser().resolve(strict=True)
+    _id = receiver_obj.get_file_count()
+    controller = ThreadActuator(threading.current_thread())
+    thread_handler.register_control(controller, DIRECTORIES)
+    receiver_sock = do_handshake(recv_sock, controller,
+                                 {'file_name': root.name, 'file_id': _id, 'archive': True, 'stream': True},
+                                 receiver_obj)
+    if receiver_sock is None:
+        return
+    policy = CompressionPolicy(peer_stats.link_rate(receiver_obj.id))
+    with receiver_sock, receiver_sock.makefile('wb') as writer:
+        zipDir(writer, root, policy, controller)
+    use.echo_print("::zipped with", policy)
 
 
 def directoryReceiver(refer: DataWeaver):
     controller = ThreadActuator(threading.current_thread())
     thread_handler.register_control(controller, DIRECTORIES)
+    if refer.content.get('sync'):
+        return _syncReceiver(refer, controller)
+    if refer.content.get('stream'):
+        return _archiveStreamReceiver(refer, controller)
+    # every sender in this tree sends plain directories as file sends (`send_in_parallel`), archives streamed
+    error_log(f"::unknown directory send from {refer.id} at {func_str(directoryReceiver)} {refer.content}")
+
+
+def _receive_root(refer: DataWeaver):
+    """new directory under downloads named after the sent one, None if peer's name for it is no usable name"""
+    if (name := safe_name(refer.content['file_name'])) is None:
+        error_log(f"::refusing directory {refer.content['file_name']!r} from {refer.id} at {func_str(_receive_root)}")
+        return None
+    root = os.path.join(const.PATH_DOWNLOAD, PeerFilePool.__validatename__(name))
+    os.makedirs(root)
+    return root
+
+
+def _syncReceiver(refer: DataWeaver, controller):
+    """
+    Files go into the copy received last time (a new directory if there is none),
+    manifest is rebuilt from old one and the changes once files are in
+    """
+    sync_id = refer.content['sync']
+    if not dirsync.is_sync_id(sync_id):
+        error_log(f"::refusing sync id {sync_id!r} from {refer.id} at {func_str(_syncReceiver)}")
+        return
+    root, previous = dirsync.open_manifest(sync_id)
+    if root is None and (root := _receive_root(refer)) is None:
+        return
     with connect.create_connection(tuple(refer.content['bind_ip'])) as soc:
-        files = PeerFilePool(_id=refer.content['file_id'], control_flag=controller)
+        with soc.makefile('wb') as writer:
+            dirsync.write_entries(writer, dirsync.read_entries(previous) if previous else ())
+        if previous:
+            previous.close()
+        changes = dirsync.recv_changes(soc)
+        dirsync.apply_deletions(root, changes)
+        files = PeerFilePool(_id=refer.content['file_id'], control_flag=controller, download_path=root,
+                             overwrite=True)
         files.recv_files(soc)
-    print("unzipping...")
-    print(list(files))
-    for file in files:
-        process_unzipping(Path(file.path))
-
-
-def process_zipping(receiver_obj, target):
-    with tempfile.NamedTemporaryFile(mode='wb+', prefix=f"peer-conn{receiver_obj.get_file_count()}",
-                                     suffix='.zip', delete=False, delete_on_close=False) as temp_file:
-        temp_path = Path(temp_file.name)
-        zipper_process = Process(target=zipDir, args=(temp_path, target), name='peer-connect-zipping')
-        zipping_processes.add(zipper_process)
-        zipper_process.start()
-        zipper_process.join()
-        zipper_process.close()
-        zipping_processes.discard(zipper_process)
-    return temp_path
-
-
-def process_unzipping(file_path):
-    queue = Queue(1)
-    unzip_process = Process(target=unZipper, args=(file_path, const.PATH_DOWNLOAD, queue), name='peer-connect-unzipping')
-    unzip_process.start()
-    zipping_processes.add(unzip_process)
-    # unzip_process.join()
-    file_name = queue.get()
-    unzip_process.join()
-    unzip_process.close()
-    zipping_processes.discard(unzip_process)
-    print("file_name:", file_name, file_path)
-
-    file_path.unlink()
-
-
-def zipDir(zip_name: Union[str, Path], _target):
-    src_path = Path(_target).expanduser().resolve(strict=True)
-    with ZipFile(zip_name, 'w', ZIP_DEFLATED) as zf:
-        progress = tqdm.tqdm(src_path.rglob('*'), desc="Zipping", unit="files")
-        for file in src_path.rglob('*'):
-            zf.write(file, file.relative_to(src_path.parent))
-            progress.update(1)
-        progress.close()
+    _, previous = dirsync.open_manifest(sync_id)
+    dirsync.save_manifest(sync_id, root, dirsync.merge(root, dirsync.read_entries(previous) if previous else (),
+                                                       changes), previous)
+    use.echo_print(f"::synced {root} with {len(changes)} changes")
 
 
-def unZipper(zip_path, destination_path, name_queue):
-    with ZipFile(zip_path, 'r') as zip_ref:
-        try:
-            zip_ref.extractall(destination_path)
-        except PermissionError as pe:
-            error_log(f"::PermissionError in unzipper()/directory manager.py :{pe}")
-    print(f"::Extracted {zip_path} to {destination_path}")
-    name_queue.put(zip_ref.filename)
-    return
+def _archiveStreamReceiver(refer: DataWeaver, controller):
+    """
+    Archive is extracted while it is arriving (see `ZipStreamExtractor`) on a thread of it's own,
+    this thread only reads the socket, archive itself never touches the disk
+    """
+    if (root := _receive_root(refer)) is None:
+        return
+    extractor = ZipStreamExtractor(root, strip_components=1, safe_path=safe_relative_path).start()
+    try:
+        with connect.create_connection(tuple(refer.content['bind_ip'])) as soc:
+            soc.settimeout(ARCHIVE_TIMEOUT)
+            while not controller.to_stop and (chunk := soc.recv(ARCHIVE_CHUNK)):
+                extractor.feed(chunk)
+    except OSError as e:
+        error_log(f"::archive from {refer.id} broke at {func_str(_archiveStreamReceiver)} exp: {e}")
+    finally:
+        done = extractor.finish()
+    if not done:
+        error_log(f"::extracting archive from {refer.id} failed at {func_str(_archiveStreamReceiver)} {extractor}")
+        return
+    use.echo_print(f"::extracted {len(extractor.extracted)} files into {root}")
+
+
+def zipDir(zip_file: BinaryIO, _target, policy: CompressionPolicy = None, controller: ThreadActuator = None):
+    """
+    Writes :param _target: directory as a zip into :param zip_file:, tree is walked once,
+    members are named relative to target's parent (so archive has target's name as it's top folder)
+    :param policy: decides level of every file, everything is deflated at default level if not given
+    :param controller: archive is left incomplete once this says stop
+    """
+    src_path = Path(_target).expanduser().resolve(strict=True)
+    with tqdm.tqdm(desc="Zipping", unit="B", unit_scale=True) as progress:
+        zf = ParallelZipWriter(zip_file, compress_pool(), progress=progress.update)
+        for batch in walk_file_items(src_path, cache=scan_cache_for(src_path)):
+            if controller and controller.to_stop:
+                return  # no central directory, so receiver can't take it for a complete archive
+            for item in batch:
+                arcname = f"{src_path.name}/{item.name}"
+                if item.name.endswith('/'):
+                    zf.add_directory(arcname)
+                elif policy:
+                    zf.add_file(item.path, arcname, policy.level_for(item.path, item.size))
+                else:
+                    zf.add_file(item.path, arcname)
+        zf.close()
 
 
 def end_zipping_processes():
-    for process in zipping_processes:
-        process.terminate()
+    shutdown_compress_pool()
 
 
 @NotInUse
@@ -2,8 +2,8 @@ from src.avails import constants as const
 
 from src.core import connectserver as connect_server, requests_handler, senders
 from src.webpage_handlers import handle_data, handle_signals, httphandler
-from src.managers import filemanager, directorymanager, thread_manager
-from src.avails import textobject, remotepeer
+from src.managers import filemanager, directorymanager, swarmmanager, thread_manager
+from src.avails import textobject, remotepeer, history
 
 
 def end_session(sig='',frame=''):
@@ -29,7 +29,9 @@ def end_session(sig='',frame=''):
     # httphandler.end_serving()
     directorymanager.end_zipping_processes()
     filemanager.endFileThreads()
+    swarmmanager.endSwarm()
     textobject.stop_all_text()
     remotepeer.end()
+    history.close_store()
     thread_manager.thread_handler.signal_stopping()
     exit(1)
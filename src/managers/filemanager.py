@@ -1,5 +1,11 @@
 # This file is responsible for sending and receiving files between peers.
+import functools
+import hmac
 import importlib
+import itertools
+import random
+import tempfile
+from typing import Optional
 
 from concurrent.futures import ThreadPoolExecutor
 
@@ -9,11 +15,20 @@ from src.avails.dialogs import Dialog
 from src.core import *
 from src.avails.remotepeer import RemotePeer
 from src.avails import useables as use
-from src.avails.textobject import DataWeaver
-from src.avails.fileobject import FiLe, make_file_groups, make_sock_groups, PeerFilePool
+from src.avails.textobject import DataWeaver, SimplePeerText
+from src.avails.fileobject import (FiLe, _FileItem, _FileGroup, scan_file_items, stream_file_groups,
+                                   make_file_items, make_sock_groups, PeerFilePool, safe_name)
+from src.avails.fanout import FanOutSender
+from src.avails.multicast import MulticastSender, MulticastReceiver
+from src.avails.peerstats import peer_stats, MAX_STREAMS
+from src.managers.thread_manager import thread_handler, FILES
 from src.webpage_handlers.handle_data import feed_file_data_to_page
 
 global_files = FileDict()
+# (sender id, directory id): [directory being received into, handshakes and sockets still using it]
+_directory_roots: dict[tuple[str, str], list] = {}
+_roots_lock = threading.Lock()
+LOCAL_CONNECT_TIMEOUT = 10  # sec, for a same-host receiver to connect back before files go over network
 
 
 def fileSender(file_data: DataWeaver, receiver_sock):
@@ -24,34 +39,409 @@ def fileSender(file_data: DataWeaver, receiver_sock):
     if not file_list:
         return  
     receiver_obj = peer_list.get_peer(receiver_id)
-
-    def _sock_thread(_id, _file: FiLe, conn):
+    if src.avails.connect.is_same_host(receiver_obj):
+        if not (remaining := _local_file_sender(make_file_items(file_list), receiver_obj, receiver_sock)):
+            return
+        use.echo_print(f"::sending {len(remaining)} files to {receiver_obj.id} over network, it could not copy them")
+        return send_in_parallel(receiver_obj, receiver_sock, [remaining], sum(x.size for x in remaining),
+                                len(remaining))
+
+    # number of sockets is chosen from first scanned batch, rest of the scan goes on while sockets are set up
+    # and pools start sending as files get fed into them
+    batches = scan_file_items(file_list)
+    first_batch = next(batches, [])
+    if not first_batch:
+        return
+    estimated_size = sum(x.size for x in first_batch) * len(file_list) // len(first_batch)
+    send_in_parallel(receiver_obj, receiver_sock, itertools.chain([first_batch], batches), estimated_size,
+                     len(file_list))
+
+
+def send_in_parallel(receiver_obj: RemotePeer, receiver_sock, batches, estimated_size, file_count,
+                     handshake_content=None):
+    """
+    Sends files batch by batch over a group of sockets (number of them tuned while sending, see `_StreamTuner`),
+    files are balanced across sockets as they are fed
+    :param handshake_content: goes along with the handshake, like directory the files are to be received into
+    """
+    pool_count = peer_stats.choose_stream_count(receiver_obj.id, estimated_size, file_count)
+    file_pools = [PeerFilePool(_id=receiver_obj.get_file_count()) for _ in range(pool_count)]
+    feeder = use.start_thread(_target=functools.partial(stream_file_groups, seal=False), _args=(batches, file_pools))
+
+    tuner = _StreamTuner(receiver_obj, receiver_sock, handshake_content)
+    tuner.open_streams(file_pools)
+    tuner.run(feeder, file_pools)
+
+
+def _local_file_sender(file_items: list[_FileItem], receiver_obj: RemotePeer, receiver_sock) -> list[_FileItem]:
+    """
+    Receiver looks like it runs on this machine (see `connect.is_same_host`), so only paths are handed over
+    and it copies files itself (see `PeerFilePool.copy_files`), no bytes go through sockets.
+    Host ids match across containers made from one image too, so receiver first reads back a token file
+    this end wrote (see `_sees_probe`), and connects back to say how many files it copied once it is done,
+    transfer is complete only then
+
+    :returns: files that still have to be sent over network, all of them if anything goes wrong
+    """
+    if not file_items:
+        return []
+    file_pool = PeerFilePool(file_items, _id=receiver_obj.get_file_count())
+    probe_id, token = os.urandom(8).hex(), os.urandom(16).hex()
+    controller = ThreadActuator(threading.current_thread())
+    thread_handler.register_control(controller, FILES)
+    global_files.add_to_current(receiver_obj.id, file_pool)
+    copied = 0
+    try:
+        with open(_probe_path(probe_id), 'x') as probe:
+            probe.write(token)
+        bind_ip = (const.THIS_IP, src.avails.connect.get_free_port())
+        with src.avails.connect.create_server(bind_ip, family=const.IP_VERSION, backlog=1) as server_sock:
+            content = {
+                'file_id': file_pool.id,
+                'bind_ip': bind_ip,
+                'probe': (probe_id, token),
+                'files': [(x.name, x.size, os.path.abspath(x.path)) for x in file_items],
+            }
+            send_handshake(const.CMD_RECV_LOCAL_FILE, content, receiver_obj, receiver_sock)
+            reads, _, _ = select.select([server_sock, controller], [], [], LOCAL_CONNECT_TIMEOUT)
+            if server_sock not in reads:
+                raise TimeoutError("receiver did not connect back")
+            conn, _ = server_sock.accept()
         with conn:
-            conn.send(struct.pack('!I', _file.id))
-            if _file.send_files(conn):
-                global_files.add_to_completed(_id, _file)
-            else:
-                global_files.add_to_continued(_id, _file)
-                use.echo_print("ERROR ERROR SOMETHING WRONG IN SENDING FILES")
+            reads, _, _ = select.select([conn, controller], [], [])  # copying takes as long as it takes
+            if conn not in reads:
+                return []  # stopping
+            copied = max(0, min(int(DataWeaver().receive(conn).content['copied']), len(file_items)))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        error_log(f"::copying files on this host for {receiver_obj.id} failed "
+                  f"at {func_str(_local_file_sender)} exp: {e}")
+    finally:
+        thread_handler.delete(controller, FILES)
+        try:
+            os.remove(_probe_path(probe_id))
+        except OSError:
+            pass
+    if copied < len(file_items):
+        global_files.add_to_continued(receiver_obj.id, file_pool)
+        return file_items[copied:]
+    global_files.add_to_completed(receiver_obj.id, file_pool)
+    asyncio.run(feed_file_data_to_page({'file_id': file_pool.id}, receiver_obj.id))
+    return []
 
-    file_groups = make_file_groups(file_list, grouping_level=file_data.content['grouping_level'])
-    # file_groups = make_file_groups(file_list, grouping_level=4)
-    file_pools = [PeerFilePool(file_group, _id=receiver_obj.get_file_count()) for file_group in file_groups]
-    bind_ip = (const.THIS_IP, src.avails.connect.get_free_port())
 
-    send_handshake(1, {'count': len(file_pools), 'bind_ip': bind_ip}, receiver_obj, receiver_sock)
+def _probe_path(probe_id):
+    return os.path.join(tempfile.gettempdir(), f"peerconnect-probe-{probe_id}")
+
+
+def _sees_probe(probe_id, token) -> bool:
+    """whether token file of a same-host transfer is here, that is, this end sees sender's filesystem"""
+    if not (isinstance(probe_id, str) and len(probe_id) == 16 and all(x in '0123456789abcdef' for x in probe_id)):
+        return False
+    try:
+        with open(_probe_path(probe_id)) as probe:
+            return hmac.compare_digest(probe.read(), str(token))
+    except (OSError, UnicodeDecodeError):
+        return False
+
+
+def fanOutSender(file_data: DataWeaver):
+    """
+    Sends same files to every peer in `file_data.content['peers']` reading them from disk only once
+    (see `FanOutSender`), each receiver gets an ordinary file send over a socket of it's own
+    """
+    file_list = file_data.content['files']
+    if file_list == ['']:
+        file_list = Dialog.open_file_dialog_window()
+    file_items = make_file_items(file_list) if file_list else []
+    if not file_items:
+        return
+    receivers = [peer_list.get_peer(peer_id) for peer_id in file_data.content['peers'] if peer_id in peer_list]
+
+    streams = {}  # peer id : (pool id, connected socket)
+    listeners = {receiver.id: _ask_to_connect(receiver) for receiver in receivers}
+    for peer_id, listener in listeners.items():
+        if listener is None:
+            continue
+        file_id, server_sock = listener
+        with server_sock:
+            reads, _, _ = select.select([server_sock], [], [], 30)
+            if server_sock not in reads:
+                use.echo_print("::peer did not connect for fan out", peer_id)
+                continue
+            conn, _ = server_sock.accept()
+        connect.send_buffers(conn, (*SimplePeerText(conn, const.SOCKET_OK).frame(), struct.pack('!I', file_id)))
+        streams[peer_id] = file_id, conn
+    if not streams:
+        return
+
+    sender = FanOutSender(file_items)
+    thread_handler.register_control(sender.controller, FILES)
+    try:
+        interrupted_at = sender.send({peer_id: conn for peer_id, (_, conn) in streams.items()})
+    finally:
+        thread_handler.delete(sender.controller, FILES)
+        for _, conn in streams.values():
+            conn.close()
+
+    for peer_id, interrupted in interrupted_at.items():
+        file_id = streams[peer_id][0]
+        copies = [_FileItem(x.name, x.size, x.path, seeked=0) for x in file_items]
+        if interrupted is None:
+            global_files.add_to_completed(peer_id, PeerFilePool(copies, _id=file_id))
+            continue
+        # left over files make a pool of their own, which can be continued like any other send
+        file_pool = PeerFilePool(copies[interrupted + 1:], _id=file_id)
+        file_pool.current_file = iter(copies[interrupted:interrupted + 1])
+        global_files.add_to_continued(peer_id, file_pool)
+        use.echo_print("ERROR ERROR SOMETHING WRONG IN SENDING FILES TO", peer_id)
+
+
+def multicastSender(file_data: DataWeaver):
+    """
+    Sends same files to every peer in `file_data.content['peers']` (every peer known if not given) at once,
+    over udp multicast (see `MulticastSender`), falls back to `fanOutSender` where multicast can't be used (ipv6)
+    """
+    if const.IP_VERSION != socket.AF_INET:
+        if 'peers' not in file_data.content:
+            file_data.content['peers'] = [peer.id for peer in peer_list.peers()]
+        return fanOutSender(file_data)
+    file_list = file_data.content['files']
+    if file_list == ['']:
+        file_list = Dialog.open_file_dialog_window()
+    file_items = make_file_items(file_list) if file_list else []
+    if not file_items:
+        return
+    peer_ids = file_data.content.get('peers') or [peer.id for peer in peer_list.peers()]
+
+    sender = MulticastSender(file_items, transfer_id=random.getrandbits(32), interface=const.THIS_IP)
+    content = sender.handshake_content([x.name for x in file_items])
+    reached = 0
+    for peer_id in peer_ids:
+        if peer_id not in peer_list:
+            continue
+        receiver_obj = peer_list.get_peer(peer_id)
+        if (control_sock := _control_socket(receiver_obj)) is None:
+            continue
+        try:
+            send_handshake(const.CMD_RECV_MULTICAST, content, receiver_obj, control_sock)
+            reached += 1
+        except (socket.error, OSError):
+            use.echo_print("::could not reach for multicast", peer_id)
+    if not reached:
+        return
+    thread_handler.register_control(sender.controller, FILES)
+    try:
+        done = sender.send(reached)
+    finally:
+        thread_handler.delete(sender.controller, FILES)
+    use.echo_print(f"::multicast completed for {done} of {reached} peers")
+
+
+def multicast_receiver(file_data: DataWeaver):
+    content = file_data.content
+    names = [safe_name(name) for name, _ in content['files']]
+    if None in names:
+        error_log(f"::refusing multicast from {file_data.id}, unusable file names at {func_str(multicast_receiver)}")
+        return
+    paths = []
+    for name in names:
+        path = os.path.join(const.PATH_DOWNLOAD, PeerFilePool.__validatename__(name))
+        open(path, 'xb').close()  # holding the name, so same names in this transfer get unique ones
+        paths.append(path)
+    receiver = MulticastReceiver(content, paths, interface=const.THIS_IP)
+    thread_handler.register_control(receiver.controller, FILES)
+    try:
+        if not receiver.receive():
+            error_log(f"::multicast from {file_data.id} incomplete at {func_str(multicast_receiver)} {receiver}")
+    finally:
+        thread_handler.delete(receiver.controller, FILES)
+
 
-    sockets = make_sock_groups(len(file_pools), bind_ip=bind_ip)
-    th_pool = ThreadPoolExecutor(max_workers=len(sockets))
-    print("made connections")  # debug
-    print(sockets)  # debug
+def _control_socket(receiver_obj: RemotePeer):
+    """control connection to receiver, made if there isn't one already, None if receiver can't be reached"""
+    connections = getattr(importlib.import_module('src.core.senders'), 'RecentConnections')
+    connections.connect_peer(receiver_obj)
+    return connections.connected_sockets.get_socket(receiver_obj.id)
 
-    for file, sock in zip(file_pools, sockets):
-        asyncio.run(feed_file_data_to_page({'file_id': file.id}, receiver_id))
-        global_files.add_to_current(receiver_id, file)
-        th_pool.submit(_sock_thread, receiver_id, file, sock)
-        # threading.Thread(target=_sock_thread, args=(receiver_id, file, sock)).start()
-    #     print("completed mapping threads")  # debug
+
+def _ask_to_connect(receiver_obj: RemotePeer):
+    """
+    Opens a listening socket and asks receiver (through it's control connection) to connect to it
+    :returns (pool id, listening socket) or None if receiver can't be reached:
+    """
+    if (control_sock := _control_socket(receiver_obj)) is None:
+        return None
+    file_id = receiver_obj.get_file_count()
+    bind_ip = (const.THIS_IP, src.avails.connect.get_free_port())
+    server_sock = src.avails.connect.create_server(bind_ip, family=const.IP_VERSION, backlog=1)
+    try:
+        send_handshake(1, {'count': 1, 'bind_ip': bind_ip}, receiver_obj, control_sock)
+    except (socket.error, OSError):
+        server_sock.close()
+        return None
+    asyncio.run(feed_file_data_to_page({'file_id': file_id}, receiver_obj.id))
+    return file_id, server_sock
+
+
+def local_file_receiver(file_data: DataWeaver):
+    """
+    Receiving side of `_local_file_sender`, files are copied from sender's paths if this end sees sender's
+    token file, number of files copied goes back to sender (none if token is not seen), sender sends rest over network
+    """
+    sender_id, content = file_data.id, file_data.content
+    copied = 0
+    try:
+        with src.avails.connect.create_connection(tuple(content['bind_ip']), LOCAL_CONNECT_TIMEOUT) as sock:
+            if _sees_probe(*content['probe']):
+                file_items = [_FileItem(name, size, path, seeked=0) for name, size, path in content['files']]
+                file_pool = PeerFilePool(_id=content['file_id'])
+                global_files.add_to_current(sender_id, file_pool)
+                copied = file_pool.copy_files(file_items)
+                if copied == len(file_items):
+                    global_files.add_to_completed(sender_id, file_pool)
+                else:
+                    global_files.add_to_continued(sender_id, file_pool)
+                    use.echo_print(f"::copied {copied} of {len(file_items)} files, rest come over network")
+            else:
+                use.echo_print("::files are on another machine, they come over network", sender_id)
+            DataWeaver(header=const.CMD_RECV_LOCAL_FILE, content={'copied': copied},
+                       _id=const.THIS_OBJECT.id).send(sock)
+    except (OSError, ValueError, TypeError) as e:
+        error_log(f"::same-host transfer from {sender_id} failed at {func_str(local_file_receiver)} exp: {e}")
+
+
+def _send_pool(_id, _file: FiLe, conn):
+    with conn:
+        conn.send(struct.pack('!I', _file.id))
+        if _file.send_files(conn):
+            global_files.add_to_completed(_id, _file)
+        else:
+            global_files.add_to_continued(_id, _file)
+            use.echo_print("ERROR ERROR SOMETHING WRONG IN SENDING FILES")
+
+
+class _StreamTuner:
+    """
+    Opens sockets for pools of a file send, and keeps adjusting number of sockets while files are being sent.
+    A socket is added while there are enough files waiting, the added one is retired
+    if throughput does not improve by atleast `GAIN`, after which no more sockets are added for this send.
+    Pools stay unsealed while tuning, so files can be moved between them anytime (an idle pool gets files
+    from others), observed throughput goes into `peer_stats` for choosing socket count of later sends
+    """
+    INTERVAL = 2  # sec, between throughput samples
+    GAIN = 1.1
+    __slots__ = ('receiver_obj', 'receiver_sock', 'th_pool', 'active', 'orphans', 'futures', 'controller',
+                 'handshake_content')
+
+    def __init__(self, receiver_obj: RemotePeer, receiver_sock, handshake_content=None):
+        self.receiver_obj = receiver_obj
+        self.receiver_sock = receiver_sock
+        self.handshake_content = handshake_content or {}  # sent with every handshake, added sockets too
+        self.th_pool = ThreadPoolExecutor(max_workers=MAX_STREAMS, thread_name_prefix='peer-connect-file-send')
+        self.active: list[PeerFilePool] = []
+        self.orphans: list[PeerFilePool] = []  # pools that could not get a socket
+        self.futures = []
+        self.controller = ThreadActuator(threading.current_thread())
+        thread_handler.register_control(self.controller, FILES)
+
+    def open_streams(self, file_pools):
+        receiver_id = self.receiver_obj.id
+        bind_ip = (const.THIS_IP, src.avails.connect.get_free_port())
+
+        send_handshake(1, {'count': len(file_pools), 'bind_ip': bind_ip, **self.handshake_content},
+                       self.receiver_obj, self.receiver_sock)
+
+        sockets = make_sock_groups(len(file_pools), bind_ip=bind_ip)
+        print("made connections")  # debug
+        print(sockets)  # debug
+        for sock in sockets:
+            peer_stats.record_rtt(receiver_id, src.avails.connect.tcp_rtt(sock))
+            break
+
+        for file, sock in zip(file_pools, sockets):
+            asyncio.run(feed_file_data_to_page({'file_id': file.id}, receiver_id))
+            global_files.add_to_current(receiver_id, file)
+            self.active.append(file)
+            self.futures.append(self.th_pool.submit(_send_pool, receiver_id, file, sock))
+        self.orphans.extend(file_pools[len(sockets):])
+        return len(sockets) == len(file_pools)
+
+    def run(self, feeder, file_pools):
+        try:
+            feeder.join()  # files can be moved around only after they are fed
+            self.__tune()
+        finally:
+            for pool in file_pools + self.active:
+                pool.seal()
+            thread_handler.delete(self.controller, FILES)
+            self.th_pool.shutdown(wait=False)
+
+    def __tune(self):
+        receiver_id = self.receiver_obj.id
+        previous_rate, added, exhausted = None, None, False
+        sent = self.__bytes_sent()
+        self.__rebalance()
+        measured_at = self.__running()
+        while self.active:
+            reads, _, _ = select.select([self.controller], [], [], self.INTERVAL)
+            if self.controller.to_stop:
+                return
+            now = self.__bytes_sent()
+            rate, sent = (now - sent) / self.INTERVAL, now
+            running = self.__running()
+            if running < len(self.active):  # a pool got done or broke, rate is no more comparable
+                return
+            if running == measured_at:  # a retired socket that finished midway leaves a sample of neither count
+                peer_stats.record_rate(receiver_id, measured_at, rate)
+            pending = sum(pool.pending_size for pool in self.active)
+            if pending == 0:
+                return
+
+            if added is not None:
+                if rate < previous_rate * self.GAIN:
+                    self.__retire(added)
+                    exhausted = True
+                added = None
+            elif not exhausted and running < MAX_STREAMS and pending > 2 * rate * self.INTERVAL:
+                added = self.__add_stream()
+                exhausted = added is None
+            elif any(pool.pending_size == 0 for pool in self.active):
+                self.__rebalance()
+            previous_rate = rate
+            measured_at = self.__running()  # next sample is taken over these many sockets
+
+    def __running(self):
+        """sockets still sending, a retired one keeps sending till it's current file is done"""
+        return sum(not future.done() for future in self.futures)
+
+    def __bytes_sent(self):
+        # retired pools are counted too, their bytes taken out of the total would show up as a drop in rate
+        return sum(pool.bytes_sent for pool in self.active + self.orphans)
+
+    def __add_stream(self) -> Optional[PeerFilePool]:
+        pool = PeerFilePool(_id=self.receiver_obj.get_file_count())
+        if not self.open_streams([pool]):
+            self.orphans.remove(pool)
+            return None
+        self.__rebalance()
+        use.echo_print("::added a socket, now sending over", len(self.active))
+        return pool
+
+    def __retire(self, pool: PeerFilePool):
+        self.active.remove(pool)
+        self.orphans.append(pool)
+        pool.seal()
+        self.__rebalance()
+        use.echo_print("::retired a socket, now sending over", len(self.active))
+
+    def __rebalance(self):
+        """moves all pending files across active pools afresh, pools of lesser sockets included"""
+        if not self.active:
+            return
+        files = [x for pool in self.active + self.orphans for x in pool.take_pending()]
+        grouped = _FileGroup([], level=len(self.active))
+        for index, part in grouped.add(files).items():
+            self.active[index].feed(part)
 
 
 def file_receiver(file_data: DataWeaver):
@@ -71,34 +461,80 @@ def file_receiver(file_data: DataWeaver):
                     global_files.add_to_continued(_id, _file)
                     use.echo_print("ERROR ERROR SOMETHING WRONG IN RECEIVING FILES")
         finally:
+            _release_root(root_key) if root_key else None
             print("Done :", _file)  # debug
 
-    file_pools = [PeerFilePool(_id=0) for _ in range(conn_count)]
-    sockets = make_sock_groups(conn_count, connect_ip=tuple(file_data.content['bind_ip']))
-    print(sockets)  # debug
-
-    print(file_pools)  # debug
-
-    th_pool = ThreadPoolExecutor(max_workers=conn_count)
-    for file, sock in zip(file_pools, sockets):
-        global_files.add_to_current(sender_id, file)
-        th_pool.submit(_sock_thread, sender_id, file, sock)
-        # threading.Thread(target=_sock_thread, args=(sender_id, file, sock)).start()
+    download_path, root_key = None, None
+    if 'directory' in file_data.content:
+        root_key = sender_id, file_data.content['directory_id']
+        if (download_path := _directory_root(root_key, file_data.content['directory'])) is None:
+            return
+    try:
+        file_pools = [PeerFilePool(_id=0, download_path=download_path) for _ in range(conn_count)]
+        sockets = make_sock_groups(conn_count, connect_ip=tuple(file_data.content['bind_ip']))
+        print(sockets)  # debug
+
+        print(file_pools)  # debug
+
+        th_pool = ThreadPoolExecutor(max_workers=conn_count)
+        for file, sock in zip(file_pools, sockets):
+            global_files.add_to_current(sender_id, file)
+            _hold_root(root_key) if root_key else None
+            th_pool.submit(_sock_thread, sender_id, file, sock)
+            # threading.Thread(target=_sock_thread, args=(sender_id, file, sock)).start()
+    finally:
+        _release_root(root_key) if root_key else None  # sockets (if any) hold it from here
 #     th_pool.shutdown()  # wait for all threads to finish  # debug
 #     print("completed mapping threads")  # debug
 #     print('\n'.join(str(x) for x in file_pools))  # debug
 
 
+def _directory_root(key, directory):
+    """
+    Where files of a directory send go, made on first handshake of that send,
+    sockets added later (by the sender's tuner) get the same directory, None if peer's name for it is no usable name.
+    Calling handshake holds the entry until it calls `_release_root`, so does every socket it passes it to
+    """
+    if (name := safe_name(directory)) is None:
+        error_log(f"::refusing directory {directory!r} from {key[0]} at {func_str(_directory_root)}")
+        return None
+    with _roots_lock:
+        if key not in _directory_roots:
+            root = os.path.join(const.PATH_DOWNLOAD, PeerFilePool.__validatename__(name))
+            os.makedirs(root)
+            _directory_roots[key] = [root, 0]
+        entry = _directory_roots[key]
+        entry[1] += 1
+        return entry[0]
+
+
+def _hold_root(key):
+    with _roots_lock:
+        _directory_roots[key][1] += 1
+
+
+def _release_root(key):
+    """entry of :param key: goes once the last one holding it is done, a later handshake makes a new directory"""
+    with _roots_lock:
+        entry = _directory_roots[key]
+        entry[1] -= 1
+        if not entry[1]:
+            del _directory_roots[key]
+
+
 def send_handshake(header, content, receiver_obj, receiver_sock):
+    """
+    :param header: 1 for a new send, 2 for continuing a send, or a command header itself
+    """
+    header = {1: const.CMD_RECV_FILE, 2: const.CMD_RECV_FILE_AGAIN}.get(header, header)
     try:
-        header = const.CMD_RECV_FILE if header == 1 else const.CMD_RECV_FILE_AGAIN
         hand_shake = DataWeaver(header=header, content=content, _id=const.THIS_OBJECT.id)
         hand_shake.send(receiver_sock)
     except (ConnectionResetError, socket.error):
         # retry connecting to peer if this fails then we can return that receiver can't be reached
         connections = getattr(importlib.import_module('src.core.senders'), 'RecentConnections')
         receiver_sock = connections.add_connection(receiver_obj)
-        hand_shake = DataWeaver(header=const.CMD_RECV_FILE, content=content, _id=const.THIS_OBJECT.id)
+        hand_shake = DataWeaver(header=header, content=content, _id=const.THIS_OBJECT.id)
         hand_shake.send(receiver_sock)
 
 
@@ -0,0 +1,179 @@
+# This file is responsible for sharing files with, and downloading files from, a swarm of peers.
+import importlib
+
+from src.core import *
+from src.avails import useables as use
+from src.avails.container import FileDict
+from src.avails.fileobject import PeerFilePool, safe_name
+from src.avails.remotepeer import RemotePeer
+from src.avails.swarm import Manifest, SwarmDownload, serve_pieces, file_piece_reader, pack_bits, unpack_bits
+from src.avails.textobject import DataWeaver
+from src.managers.thread_manager import thread_handler, FILES
+from src.webpage_handlers import handle_data  # module import, handle_data imports this module back (via senders)
+
+QUERY_TIMEOUT = 5  # sec, waiting for the first peer to say it has the file
+SOURCE_WAIT = 10  # sec, download gives up after having no source for this long
+
+shared_files: dict[str, tuple[Manifest, str]] = {}  # content id: (manifest, path) of complete files
+swarm_downloads: dict[str, SwarmDownload] = {}
+swarm_files = FileDict()  # downloads keyed by content id, as there is no single peer to key them with
+_pending: dict[str, threading.Event] = {}  # content id: set once first manifest arrives
+_lock = threading.Lock()
+
+
+def share_files(file_data: DataWeaver):
+    """
+    Makes given files available to swarm downloads by other peers,
+    content id of every file is fed to page (that is what others download with)
+    """
+    for path in file_data.content['files']:
+        try:
+            manifest = Manifest.from_file(path)
+        except OSError as e:
+            error_log(f"::could not share {path} at {func_str(share_files)} exp: {e}")
+            continue
+        shared_files[manifest.content_id] = manifest, path
+        use.echo_print("::sharing", manifest)
+        asyncio.run(handle_data.feed_file_data_to_page({'content_id': manifest.content_id, 'name': manifest.name},
+                                                       const.THIS_OBJECT.id))
+
+
+def swarmDownloader(file_data: DataWeaver):
+    """
+    Downloads file of `file_data.content['content_id']` from every peer that has it,
+    asks `file_data.content['peers']` (every peer known if not given)
+    """
+    content_id = file_data.content['content_id']
+    if content_id in shared_files:
+        return
+    got_manifest = threading.Event()
+    with _lock:
+        if content_id in _pending or content_id in swarm_downloads:
+            return
+        _pending[content_id] = got_manifest
+    try:
+        peer_ids = file_data.content.get('peers') or [peer.id for peer in peer_list.peers()]
+        query = DataWeaver(header=const.CMD_SWARM_QUERY, content={'content_id': content_id},
+                           _id=const.THIS_OBJECT.id)
+        for peer_id in peer_ids:
+            if peer_id in peer_list and (control_sock := _control_socket(peer_list.get_peer(peer_id))):
+                try:
+                    query.send(control_sock)
+                except (socket.error, OSError):
+                    pass
+        if not got_manifest.wait(QUERY_TIMEOUT):
+            use.echo_print("::no peer has", content_id)
+            return
+    finally:
+        with _lock:
+            _pending.pop(content_id, None)
+
+    download = swarm_downloads[content_id]
+    thread_handler.register_control(download.controller, FILES)
+    swarm_files.add_to_current(content_id, download)
+    try:
+        idle_since = time.monotonic()
+        while not download.wait(1) and not download.controller.to_stop:
+            if download.sources:
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since > SOURCE_WAIT:  # a late answer may still add a source till then
+                break
+    finally:
+        thread_handler.delete(download.controller, FILES)
+        with _lock:
+            swarm_downloads.pop(content_id, None)  # late answers find nothing to add a source to
+        download.break_loop()  # sources still going stop before the file is closed under them
+        download.close()
+    if not download.complete:
+        swarm_files.add_to_continued(content_id, download)
+        use.echo_print("ERROR ERROR SOMETHING WRONG IN SWARM DOWNLOAD", download)
+        return
+    final_path = os.path.join(const.PATH_DOWNLOAD, PeerFilePool.__validatename__(safe_name(download.manifest.name)))
+    os.replace(download.path, final_path)
+    download.path = final_path
+    shared_files[content_id] = download.manifest, final_path  # seeding others from now on
+    swarm_files.add_to_completed(content_id, download)
+    asyncio.run(handle_data.feed_file_data_to_page({'content_id': content_id, 'name': download.manifest.name},
+                                                   const.THIS_OBJECT.id))
+
+
+def answer_query(query: DataWeaver):
+    """tells the asking peer whether this peer has the file, and which pieces if it is still downloading it"""
+    content_id = query.content['content_id']
+    if content_id in shared_files:
+        manifest = shared_files[content_id][0]
+        have = bytearray(b'\x01') * manifest.piece_count
+    elif download := swarm_downloads.get(content_id):
+        manifest, have = download.manifest, download.have
+    else:
+        return
+    asker = peer_list.get_peer(query.id) if query.id in peer_list else None
+    if asker is None or (control_sock := _control_socket(asker)) is None:
+        return
+    content = {'content_id': content_id, 'manifest': manifest.to_dict(), 'have': pack_bits(have)}
+    DataWeaver(header=const.CMD_SWARM_HAVE, content=content, _id=const.THIS_OBJECT.id).send(control_sock)
+
+
+def add_source(answer: DataWeaver):
+    """a peer answered it has (a part of) a file being downloaded, pieces are pulled from it from now on"""
+    content_id = answer.content['content_id']
+    with _lock:
+        download = swarm_downloads.get(content_id)
+        if download is None:
+            if content_id not in _pending:
+                return
+            manifest = Manifest.from_dict(answer.content['manifest'], content_id)
+            if manifest is None or safe_name(manifest.name) is None:
+                error_log(f"::bad manifest from {answer.id} at {func_str(add_source)}")
+                return
+            part_path = os.path.join(const.PATH_DOWNLOAD, f"{content_id[:16]}.swarm")
+            download = swarm_downloads[content_id] = SwarmDownload(manifest, part_path, _id=content_id)
+            _pending[content_id].set()
+    have = unpack_bits(answer.content['have'], download.manifest.piece_count)
+    if not any(have) or answer.id not in peer_list:
+        return
+    source = peer_list.get_peer(answer.id)
+    bind_ip = (const.THIS_IP, connect.get_free_port())
+    with connect.create_server(bind_ip, family=const.IP_VERSION, backlog=1) as server_sock:
+        if (control_sock := _control_socket(source)) is None:
+            return
+        DataWeaver(header=const.CMD_SWARM_SERVE, content={'content_id': content_id, 'bind_ip': bind_ip},
+                   _id=const.THIS_OBJECT.id).send(control_sock)
+        reads, _, _ = select.select([server_sock], [], [], 30)
+        if server_sock not in reads:
+            return
+        piece_sock, _ = server_sock.accept()
+    with _lock:
+        added = swarm_downloads.get(content_id) is download and download.add_source(answer.id, have, piece_sock)
+    if not added:
+        piece_sock.close()
+
+
+def serve_swarm(request: DataWeaver):
+    """connects back to a downloading peer and answers it's piece requests"""
+    content_id = request.content['content_id']
+    close = None
+    if content_id in shared_files:
+        manifest, path = shared_files[content_id]
+        read_piece, close = file_piece_reader(path, manifest)
+    elif download := swarm_downloads.get(content_id):
+        manifest, read_piece = download.manifest, download.read_piece
+    else:
+        return
+    try:
+        serve_pieces(connect.create_connection(tuple(request.content['bind_ip']), timeout=20), manifest, read_piece)
+    except OSError as e:
+        error_log(f"::serving {content_id} to {request.id} failed at {func_str(serve_swarm)} exp: {e}")
+    finally:
+        close() if close else None
+
+
+def _control_socket(peer_obj: RemotePeer):
+    connections = getattr(importlib.import_module('src.core.senders'), 'RecentConnections')
+    connections.connect_peer(peer_obj)
+    return connections.connected_sockets.get_socket(peer_obj.id)
+
+
+def endSwarm():
+    swarm_files.stop_all_files()
+    return True
@@ -0,0 +1,129 @@
+"""
+Benchmarks file-to-socket partitioning of `_FileGroup` (LPT) against the older greedy grouping,
+on size distributions seen in practice.
+
+run from project root :
+    python -m src.trails.bench_grouping
+
+reports, per distribution and grouping level:
+    parts   : number of non-empty parts (sockets actually used)
+    max %   : share of bytes held by the heaviest part
+    spread  : heaviest part's predicted time / ideal time (total / level), 1.00 is perfect
+    ms      : time taken to group
+"""
+import random
+import time
+from math import isclose
+
+from src.avails.fileobject import _FileGroup, _FileItem, FILE_OVERHEAD, GROUP_MIN, GROUP_MID, GROUP_MAX
+
+KB, MB, GB = 1024, 1024 ** 2, 1024 ** 3
+
+
+def legacy_group(files, level):
+    """grouping as it was before LPT, kept only for comparison"""
+    files = sorted(files, key=lambda x: x.size)
+    total_size = sum(x.size for x in files)
+    part_size = total_size // level
+    parts = [[]]
+    current_part_size = 0
+    for file in files:
+        file_size = file.size
+        if current_part_size + file_size <= part_size or \
+                isclose(current_part_size + file_size, part_size, rel_tol=0.004):
+            parts[-1].append(file)
+            current_part_size += file_size
+            continue
+        if file_size >= 2 ** 30 or isclose(file_size, 2 ** 30, rel_tol=0.0002):
+            parts.append([file])
+            current_part_size = 0
+        else:
+            parts.append([file])
+            current_part_size = file_size
+    grouped = [x for x in parts if x]
+    if len(grouped) <= level:
+        return grouped
+    new_group, combined_group, combined_size = [], [], 0
+    for part in grouped:
+        size = sum(file.size for file in part)
+        if combined_size + size <= part_size * level:
+            combined_group.extend(part)
+            combined_size += size
+        else:
+            new_group.append(combined_group)
+            combined_group, combined_size = part, size
+    if combined_group:
+        new_group.append(combined_group)
+    return new_group
+
+
+def lpt_group(files, level):
+    grouped = _FileGroup(files, level=level)
+    grouped.group()
+    return list(grouped)
+
+
+def _items(sizes):
+    return [_FileItem(f"file{i}", int(size), f"file{i}", seeked=0) for i, size in enumerate(sizes)]
+
+
+def source_tree(rng):
+    return _items(rng.lognormvariate(8.5, 1.6) for _ in range(20_000))
+
+
+def photo_library(rng):
+    return _items(rng.uniform(2 * MB, 9 * MB) for _ in range(3_000))
+
+
+def media_with_few_large(rng):
+    return _items([rng.uniform(1 * GB, 4 * GB) for _ in range(3)] +
+                  [rng.uniform(100 * MB, 900 * MB) for _ in range(25)] +
+                  [rng.uniform(10 * KB, 2 * MB) for _ in range(400)])
+
+
+def mixed_downloads(rng):
+    return _items(rng.paretovariate(1.1) * 200 * KB for _ in range(2_000))
+
+
+def handful(rng):
+    return _items(rng.uniform(50 * MB, 700 * MB) for _ in range(7))
+
+
+DISTRIBUTIONS = {
+    'source tree': source_tree,
+    'photo library': photo_library,
+    'media + few large': media_with_few_large,
+    'mixed downloads': mixed_downloads,
+    'handful of files': handful,
+}
+
+
+def measure(parts, level):
+    costs = [sum(file.size + FILE_OVERHEAD for file in part) for part in parts]
+    sizes = [sum(file.size for file in part) for part in parts]
+    ideal = sum(costs) / level
+    return len(parts), 100 * max(sizes) / sum(sizes), max(costs) / ideal
+
+
+def run(seed=7):
+    rng = random.Random(seed)
+    header = f"{'distribution':<20}{'level':>6} | {'legacy parts':>12}{'max %':>8}{'spread':>8}{'ms':>8}" \
+             f" | {'lpt parts':>10}{'max %':>8}{'spread':>8}{'ms':>8}"
+    print(header)
+    print('-' * len(header))
+    for name, distribution in DISTRIBUTIONS.items():
+        files = distribution(rng)
+        for level in (GROUP_MIN, GROUP_MID, GROUP_MAX):
+            row = f"{name:<20}{level:>6}"
+            for grouper in (legacy_group, lpt_group):
+                start = time.perf_counter()
+                parts = grouper(files, level)
+                took = (time.perf_counter() - start) * 1000
+                count, max_share, spread = measure(parts, level)
+                width = 12 if grouper is legacy_group else 10
+                row += f" | {count:>{width}}{max_share:>8.1f}{spread:>8.2f}{took:>8.1f}"
+            print(row)
+
+
+if __name__ == '__main__':
+    run()
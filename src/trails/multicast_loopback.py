@@ -0,0 +1,80 @@
+"""
+Runs a multicast transfer (`src.avails.multicast`) on loopback, one sender and many receivers in this process,
+with some packets dropped on purpose at receivers so that NAK repair gets exercised.
+
+run from project root :
+    python -m src.trails.multicast_loopback [receivers] [loss %]
+"""
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from src.avails.fileobject import make_file_items
+from src.avails.multicast import MulticastSender, MulticastReceiver
+
+INTERFACE = '127.0.0.1'
+
+
+class LossyReceiver(MulticastReceiver):
+    """drops `loss` share of incoming packets before they are looked at"""
+    __slots__ = 'loss', 'dropped'
+
+    def __init__(self, *args, loss, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loss, self.dropped = loss, 0
+
+    def _MulticastReceiver__on_packet(self, packet):
+        if random.random() < self.loss:
+            self.dropped += 1
+            return None, 0
+        return super()._MulticastReceiver__on_packet(packet)
+
+
+def digest(path):
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def run(receiver_count=4, loss=0.02):
+    source = tempfile.mkdtemp(prefix='multicast-src-')
+    paths = []
+    for i, size in enumerate([0, 1, 1399, 1400, 1401, 3 * 1024 * 1024, 700_000, 12 * 1024 * 1024]):
+        path = os.path.join(source, f"file{i}.bin")
+        with open(path, 'wb') as file:
+            file.write(os.urandom(size))
+        paths.append(path)
+    file_items = make_file_items(paths)
+    file_items.sort(key=lambda x: x.name)
+
+    sender = MulticastSender(file_items, transfer_id=random.getrandbits(32), interface=INTERFACE)
+    content = sender.handshake_content([x.name for x in file_items])
+
+    receivers, results = [], {}
+    for r in range(receiver_count):
+        destination = tempfile.mkdtemp(prefix=f'multicast-dst{r}-')
+        receiver = LossyReceiver(content, [os.path.join(destination, x.name) for x in file_items],
+                                 interface=INTERFACE, loss=loss)
+        thread = threading.Thread(target=lambda _r=receiver, _d=destination: results.update({_d: _r.receive()}))
+        receivers.append((receiver, destination, thread))
+        thread.start()
+
+    start = time.perf_counter()
+    done = sender.send(receiver_count)
+    took = time.perf_counter() - start
+    total = sum(x.size for x in file_items)
+    print(f"{sender}\n{done}/{receiver_count} receivers completed, {total / 1024 ** 2:.1f} MB in {took:.2f}s")
+
+    expected = {x.name: digest(x.path) for x in file_items}
+    for receiver, destination, thread in receivers:
+        thread.join()
+        same = all(digest(os.path.join(destination, name)) == value for name, value in expected.items())
+        print(f"  {destination}: received={results[destination]} identical={same} dropped={receiver.dropped}")
+
+
+if __name__ == '__main__':
+    run(*(int(sys.argv[1]),) if len(sys.argv) > 1 else (),
+        **({'loss': float(sys.argv[2]) / 100} if len(sys.argv) > 2 else {}))
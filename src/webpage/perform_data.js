@@ -79,6 +79,11 @@ function initiate_data()
                 if (data == false){
                     return
                 }
+                if (focusedUser.dataset.held)
+                {
+                    holdMessage(focusedUser, data);
+                    return
+                }
                 connectToCode_.send(data);
                 console.log("message sent :", data);
             }
@@ -146,6 +151,18 @@ function recieveDataFromPython(connecttocode_)
         if (data.header == "this is a message")
         {
             recievedMessage(data);
+        }
+        if (data.header == "load history")
+        {
+            loadedHistory(data);
+        }
+        if (data.header == "outbox status")
+        {
+            outboxStatus(data);
+        }
+        if (data.header == "message refused")
+        {
+            refusedMessage(data);
         }});
     /* data syntax : thisisamessage_/!_message~^~recieverid syntax of recieverid :
         name(^)ipaddress
@@ -184,6 +201,10 @@ function createUserTile(name, name_id) // idin is the id of the user to be added
     newview_.className = "viewer division";
     newview_.style.display = "none";
     newtile_.addEventListener("click",function(){showcurrent(newview_)});
+    newview_.addEventListener("scroll",function(){
+        if (newview_.scrollTop < 50 && newview_.dataset.before)
+            requestHistory(newview_);
+    });
     EventListeners.push(newtile_);
     if (division_alive.contains(newtile_)){
         console.warn("RETURNING TILE WITH SAME ID FOUND",newtile_);
@@ -193,6 +214,7 @@ function createUserTile(name, name_id) // idin is the id of the user to be added
     division_viewerpov.appendChild(newview_);
     users_views.push(newview_);
     users_list.push(newtile_);
+    requestHistory(newview_);  /* now, while nothing is shown in it yet */
     return newtile_;
 }
 
@@ -241,7 +263,7 @@ function createmessage()
         subDiv_.textContent = "U sent a file : " + Content_;
         return JSON.stringify({
             "header":"this is a file",
-            "content":{'files':[Content_,], 'grouping_level':4},
+            "content":{'files':[Content_,]},
             "id":focusedUser.id.split("_")[1]
         });
     }
@@ -298,6 +320,103 @@ function recievedMessage(recievedata)
     reciever_view.appendChild(wrapperdiv_);
     countMessage++;
 }
+function holdMessage(view, data)
+{
+    /* outbox to this user is full, message waits here (shown faded) till python says it takes messages again */
+    let shown = view.lastChild;
+    if (shown)
+        shown.style.opacity = "0.5";
+    view.held = view.held || [];
+    view.held.push([data, shown]);
+}
+function outboxStatus(data)
+{
+    let view = document.getElementById("viewer_"+data.id.trim());
+    let tile = document.getElementById("person_"+data.id.trim());
+    if (view == null)
+        return;
+    if (data.content)
+    {
+        delete view.dataset.held;
+        if (tile)
+            tile.style.opacity = "";
+        sendHeld(view);
+    }
+    else
+    {
+        view.dataset.held = "1";
+        if (tile)
+            tile.style.opacity = "0.6";
+    }
+}
+function sendHeld(view)
+{
+    /* a few at a time, a status saying outbox is full again gets a chance to arrive in between */
+    for (let i = 0; i < 32 && view.held && view.held.length && !view.dataset.held; i++)
+    {
+        let [data, shown] = view.held.shift();
+        Connection.send(data);
+        if (shown)
+            shown.style.opacity = "";
+    }
+    if (view.held && view.held.length && !view.dataset.held)
+        setTimeout(function(){sendHeld(view)}, 0);
+}
+function refusedMessage(data)
+{
+    let view = document.getElementById("viewer_"+data.id.trim());
+    if (view == null)
+        return;
+    let wrapperdiv_ = document.createElement("div");
+    let subDiv_ = document.createElement("div");
+    subDiv_.className = "message";
+    subDiv_.style.backgroundColor = "#b89292";
+    subDiv_.textContent = "not sent : " + data.content;
+    wrapperdiv_.className = "messagewrapper right";
+    wrapperdiv_.appendChild(subDiv_);
+    view.appendChild(wrapperdiv_);
+    view.scrollTop = view.scrollHeight;
+}
+function requestHistory(view)
+{
+    /* asks for messages older than view.dataset.before (latest ones the first time), a page at a time */
+    if (view.dataset.loading)
+        return;
+    view.dataset.loading = "1";
+    if (view.dataset.before === undefined)
+        view.dataset.asked = Date.now() / 1000;
+    Connection.send(JSON.stringify({
+        "header":"load history",
+        "content":view.dataset.before ? Number(view.dataset.before) : null,
+        "id":view.id.split("_")[1]
+    }));
+}
+function loadedHistory(data)
+{
+    let view = document.getElementById("viewer_"+data.id.trim());
+    if (view == null)
+        return;
+    let first_page = view.dataset.before === undefined;
+    let height = view.scrollHeight;
+    let older = document.createDocumentFragment();
+    data.content.messages.forEach(message => {
+        /* messages recorded after first page was asked for are on screen already, they came in live */
+        if (first_page && message.at >= Number(view.dataset.asked))
+            return;
+        let wrapperdiv_ = document.createElement("div");
+        let subDiv_ = document.createElement("div");
+        subDiv_.textContent = message.content;
+        subDiv_.className = "message";
+        wrapperdiv_.className = "messagewrapper " + (message.outgoing ? "right" : "left");
+        wrapperdiv_.appendChild(subDiv_);
+        older.appendChild(wrapperdiv_);
+    });
+    view.insertBefore(older, view.firstChild);  /* above whatever came in while it was loading */
+    view.dataset.before = data.content.before === null ? "" : data.content.before;
+    delete view.dataset.loading;
+    /* keeps what was on screen in place, older messages show up above it */
+    view.scrollTop = first_page ? view.scrollHeight : view.scrollTop + view.scrollHeight - height;
+}
 function removeuser(idin)
 {
     const user_ = document.getElementById("person_" + idin);
@@ -1,5 +1,6 @@
 import asyncio
 from functools import wraps
+import sqlite3
 import sys
 
 import websockets.server
@@ -10,7 +11,7 @@ from src.managers import endmanager
 import asyncio
 from src.core.senders import *
 from src.avails.remotepeer import RemotePeer
-from src.avails import useables as use
+from src.avails import useables as use, history
 from src.avails.textobject import DataWeaver
 from src.core import requests_handler as req_handler
 from src import avails
@@ -60,6 +61,12 @@ async def control_data_flow(data_in: DataWeaver):
         const.HANDLE_MESSAGE_HEADER: lambda x: sendMessage(x),
         const.HANDLE_FILE_HEADER: lambda x: sendFile(x),
         const.HANDLE_DIR_HEADER: lambda x: sendDir(x),
+        const.HANDLE_FAN_OUT_FILE_HEADER: lambda x: sendFileToMany(x),
+        const.HANDLE_MULTICAST_FILE_HEADER: lambda x: sendFileMulticast(x),
+        const.HANDLE_SWARM_SHARE: lambda x: shareWithSwarm(x),
+        const.HANDLE_SWARM_DOWNLOAD: lambda x: downloadFromSwarm(x),
+        const.HANDLE_LOAD_HISTORY: lambda x: asyncio.ensure_future(feed_history_to_page(x)),
+        const.HANDLE_SEARCH_HISTORY: lambda x: asyncio.ensure_future(feed_search_results_to_page(x)),
     }
     try:
         function_map.get(data_in.header, lambda x: None)(data_in)
@@ -148,6 +155,87 @@ async def feed_file_data_to_page(_data, _id):
     #     return
 
 
+async def feed_outbox_status_to_page(peer_id, accepting: bool):
+    """tells page whether messages to :param peer_id: are taken, page holds back while they are not"""
+    if safe_end.is_set():
+        use.echo_print("Can't send data to page, safe_end is flip", safe_end)
+        return
+    global web_socket
+    _data = DataWeaver(header=const.HANDLE_OUTBOX_STATUS,
+                       content=accepting,
+                       _id=peer_id)
+    use.echo_print(f"::signaling page outbox of {peer_id} accepting:{accepting}")
+    try:
+        await web_socket.send(_data.dump())
+    except websockets.exceptions.ConnectionClosedError:
+        pass
+
+
+async def feed_refused_message_to_page(peer_id, content):
+    """tells page a message of it's to :param peer_id: was not sent, page shows it as such"""
+    if safe_end.is_set():
+        use.echo_print("Can't send data to page, safe_end is flip", safe_end)
+        return
+    global web_socket
+    _data = DataWeaver(header=const.HANDLE_MESSAGE_REFUSED,
+                       content=content,
+                       _id=peer_id)
+    try:
+        await web_socket.send(_data.dump())
+    except websockets.exceptions.ConnectionClosedError:
+        pass
+
+
+async def feed_history_to_page(request: DataWeaver):
+    """
+    sends page a page of messages exchanged with peer of `request.id`, older than `request.content`
+    (cursor page got along with previous page, latest messages if None)
+    """
+    if safe_end.is_set():
+        use.echo_print("Can't send data to page, safe_end is flip", safe_end)
+        return
+    global web_socket
+    try:
+        messages, before = await asyncio.get_running_loop().run_in_executor(
+            None, history.message_store().page, request.id, request.content)
+    except (OSError, sqlite3.Error) as e:
+        error_log(f"::could not load history of {request.id} at {func_str(feed_history_to_page)} exp: {e}")
+        return
+    _data = DataWeaver(header=const.HANDLE_LOAD_HISTORY,
+                       content={'messages': messages, 'before': before},
+                       _id=request.id)
+    try:
+        await web_socket.send(_data.dump())
+    except websockets.exceptions.ConnectionClosedError:
+        pass
+
+
+async def feed_search_results_to_page(request: DataWeaver):
+    """
+    sends page messages matching `request.content['query']`, best first, `request.content['page']` th page of them,
+    messages of `request.content['peer']` only if it is given.
+    query is sent back along, page drops results of a query it no longer shows
+    """
+    if safe_end.is_set():
+        use.echo_print("Can't send data to page, safe_end is flip", safe_end)
+        return
+    global web_socket
+    query, page = request.content['query'], int(request.content.get('page') or 0)
+    try:
+        results, more = await asyncio.get_running_loop().run_in_executor(
+            None, history.message_store().search, query, request.content.get('peer'), page)
+    except (OSError, sqlite3.Error) as e:
+        error_log(f"::could not search history for {query} at {func_str(feed_search_results_to_page)} exp: {e}")
+        return
+    _data = DataWeaver(header=const.HANDLE_SEARCH_HISTORY,
+                       content={'query': query, 'page': page, 'results': results, 'more': more},
+                       _id=request.id)
+    try:
+        await web_socket.send(_data.dump())
+    except websockets.exceptions.ConnectionClosedError:
+        pass
+
+
 async def feed_user_status_to_page(peer: RemotePeer):
     if safe_end.is_set():
         use.echo_print("Can't send data to page, safe_end is flip", safe_end)
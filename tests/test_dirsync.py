@@ -0,0 +1,63 @@
+import os
+
+from src.avails import dirsync
+
+
+def _delete(*names):
+    return [(dirsync.DELETE, (name, 0, 0, dirsync.NO_DIGEST)) for name in names]
+
+
+def test_apply_deletions_stays_under_root(tmp_path):
+    root = tmp_path / 'root'
+    (root / 'sub').mkdir(parents=True)
+    (root / 'sub' / 'gone.txt').write_text('x')
+    outside = tmp_path / 'outside.txt'
+    outside.write_text('x')
+    absolute = tmp_path / 'absolute.txt'
+    absolute.write_text('x')
+
+    dirsync.apply_deletions(str(root), _delete('../outside.txt', str(absolute), 'sub/gone.txt'))
+
+    assert outside.exists()
+    assert absolute.exists()
+    assert not (root / 'sub').exists()  # emptied by the deletion, so removed too
+    assert root.exists()
+
+
+def test_apply_deletions_does_not_follow_symlinked_directories(tmp_path):
+    root, elsewhere = tmp_path / 'root', tmp_path / 'elsewhere'
+    root.mkdir()
+    elsewhere.mkdir()
+    (elsewhere / 'victim.txt').write_text('x')
+    os.symlink(elsewhere, root / 'link', target_is_directory=True)
+
+    dirsync.apply_deletions(str(root), _delete('link/victim.txt'))
+
+    assert (elsewhere / 'victim.txt').exists()
+
+
+def test_is_sync_id():
+    assert dirsync.is_sync_id(dirsync.sync_id_for('.'))
+    assert not dirsync.is_sync_id('../../escape')
+    assert not dirsync.is_sync_id(None)
+
+
+def test_sync_reuses_digests_from_scan_cache(tmp_path, monkeypatch):
+    from src.avails import constants as const, scancache
+    monkeypatch.setattr(const, 'PATH_CACHE', str(tmp_path / 'cache'))
+    root = tmp_path / 'root'
+    root.mkdir()
+    (root / 'a.txt').write_bytes(b'same content')
+    past = (os.stat(root / 'a.txt').st_mtime_ns - 10 ** 10,) * 2  # out of the racy window
+    os.utime(root / 'a.txt', ns=past)
+    theirs = [('a.txt', 12, past[0] - 1, dirsync.file_digest(root / 'a.txt'))]  # only mtime differs
+    hashed = []
+    monkeypatch.setattr(dirsync, 'file_digest', lambda path: hashed.append(path) or b'\x01' * 32)
+
+    for _ in range(2):
+        cache = scancache.ScanCache(str(root))  # loaded from disk, as by a later run
+        cache.begin()
+        list(dirsync.diff(str(root), dirsync.walk_sorted(str(root), cache=cache), theirs, cache))
+        cache.save()
+
+    assert len(hashed) == 1
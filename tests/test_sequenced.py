@@ -0,0 +1,112 @@
+import socket
+import threading
+import time
+
+from src.avails import codec, constants as const
+from src.avails.textobject import DataWeaver
+from src.core import nomad, senders  # nomad first, same order main imports them in
+
+
+class _Peers:
+    def __contains__(self, peer_id):
+        return True
+
+    def get_peer(self, peer_id):
+        return peer_id
+
+
+def _pair():
+    """socket pair whose writing end reads sequenced messages, like a negotiated one would"""
+    writer, reader = socket.socketpair()
+    codec.accept(writer, {'codecs': [codec.JsonCodec.name], 'sequenced': True})
+    return writer, reader
+
+
+def _pump(reader, outbox, drop=lambda envelope: False, taken=None):
+    """feeds envelopes read off :param reader: into :param outbox:, as nomad would"""
+    def run():
+        while True:
+            try:
+                envelope = DataWeaver().receive(reader)
+            except (OSError, ValueError, TypeError, KeyError):
+                return
+            if drop(envelope):
+                continue
+            messages = outbox.received(envelope.content)
+            if taken is not None:
+                taken.extend(message['content'] for message in messages)
+    threading.Thread(target=run, daemon=True).start()
+
+
+def _wait_for(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+def _link(monkeypatch, sockets: dict):
+    """outboxes write to sockets[peer_id], messages and acks alike"""
+    monkeypatch.setattr(senders, 'peer_list', _Peers())
+    monkeypatch.setattr(senders, 'RETRANSMIT_TIMEOUT', 0.2)
+    monkeypatch.setattr(senders.RecentConnections, 'socket_for', classmethod(lambda cls, peer: sockets[peer]))
+    monkeypatch.setattr(senders.RecentConnections.connected_sockets, 'get_socket', lambda peer_id: sockets[peer_id])
+    monkeypatch.setattr(const, 'THIS_OBJECT', type('Peer', (), {'id': 'a'})())
+
+
+def _message(text):
+    return DataWeaver(header=const.CMD_TEXT, content=text, _id='a')
+
+
+def test_dropped_envelope_is_taken_exactly_once(monkeypatch):
+    to_b, at_b = _pair()
+    to_a, at_a = _pair()
+    _link(monkeypatch, {'b': to_b, 'a': to_a})
+    sender, receiver = senders.PeerOutbox('b'), senders.PeerOutbox('a')
+    seen, taken = [], []
+
+    def drop_second(envelope):
+        seen.append(envelope)
+        return len(seen) == 2
+
+    _pump(at_b, receiver, drop_second, taken)
+    _pump(at_a, sender)  # acks
+    try:
+        for text in ('m0', 'm1', 'm2', 'm3'):
+            sender.put(_message(text))
+            time.sleep(0.05)  # an envelope each
+        assert _wait_for(lambda: len(taken) >= 4 and 'unacked=0' in repr(sender))
+        time.sleep(0.3)  # nothing more comes after a retransmit
+        assert taken == ['m0', 'm1', 'm2', 'm3']
+    finally:
+        sender.close()
+        receiver.close()
+        for sock in (to_b, at_b, to_a, at_a):
+            sock.close()
+
+
+def test_window_goes_whole_to_a_new_socket(monkeypatch):
+    dead, _unread = _pair()
+    to_a, at_a = _pair()
+    sockets = {'b': dead, 'a': to_a}
+    _link(monkeypatch, sockets)
+    sender, receiver = senders.PeerOutbox('b'), senders.PeerOutbox('a')
+    taken = []
+    _pump(at_a, sender)
+    try:
+        sender.put(_message('m0'))
+        time.sleep(0.05)  # written to a socket whose other end never reads
+        to_b, at_b = _pair()
+        sockets['b'] = to_b  # reconnected
+        _pump(at_b, receiver, taken=taken)
+        sender.put(_message('m1'))
+        assert _wait_for(lambda: len(taken) >= 2)
+        time.sleep(0.3)
+        assert taken == ['m0', 'm1']
+    finally:
+        sender.close()
+        receiver.close()
+        for sock in sockets.values():
+            sock.close()
+        _unread.close()
+        at_a.close()